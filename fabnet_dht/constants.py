@@ -14,6 +14,7 @@ RC_OLD_DATA = 325
 RC_INVALID_DATA = 326
 RC_NO_FREE_SPACE = 327
 RC_ALREADY_EXISTS = 330
+RC_NOT_MY_RANGE = 331
 RC_MD_NOFREESPACE = 400
 RC_MD_NOTINIT= 401
 
@@ -33,7 +34,16 @@ DEFAULT_DHT_CONFIG = { 'WAIT_RANGE_TIMEOUT': 120, #if no ranges found for init D
                         'WAIT_FILE_MD_TIMEDELTA': 10,
                         'WAIT_DHT_TABLE_UPDATE': 3,
                         'RANGES_TABLE_FLAPPING_TIMEOUT': 3,
-                        'FLUSH_MD_CACHE_TIMEOUT': 600,
+                        'FLUSH_MD_CACHE_TIMEOUT': 600, #user metadata not used for this time is closed
+                        'MD_CACHE_SIZE': 64, #max count of opened user metadata DBs
+                        'MD_CACHE_MAX_OPEN_FILES': 8192, #files budget of all opened user metadata DBs
+                        'MD_GROUP_SYNC_INTERVAL': 0, #if > 0 user metadata writes are synced to disk in groups
+                        'VIRTUAL_RANGES_COUNT': 1, #count of hash ranges (main and virtual) owned by node
+                        'NODE_IOPS_WEIGHT': 1, #capacity weight multiplier for node disks class
+                        'NODE_ZONE': '', #rack/zone label of node, replicas are placed to distinct zones
+                        'RANGES_GOSSIP': 0, #disseminate ranges table changes by gossip instead of broadcast
+                        'GOSSIP_FANOUT': 3, #count of nodes contacted in every gossip round
+                        'GOSSIP_INTERVAL': 1,
                         'DHT_STOP_TIMEOUT': 2} #wait sending messages from agents threads
 
 
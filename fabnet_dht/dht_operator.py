@@ -16,7 +16,6 @@ import random
 import traceback
 import shutil
 import tempfile
-from datetime import datetime
 
 from fabnet.core.operator import Operator
 
@@ -39,6 +38,7 @@ from fabnet_dht.operations.mgmt.split_range_request import SplitRangeRequestOper
 from fabnet_dht.operations.mgmt.pull_subrange_request import PullSubrangeRequestOperation
 from fabnet_dht.operations.mgmt.update_hash_range_table import UpdateHashRangeTableOperation
 from fabnet_dht.operations.mgmt.check_hash_range_table import CheckHashRangeTableOperation
+from fabnet_dht.operations.mgmt.gossip_ranges_table import GossipRangesTableOperation
 
 from fabnet_dht.operations.data_access.put_data_block import PutDataBlockOperation
 from fabnet_dht.operations.data_access.client_put import ClientPutOperation
@@ -53,7 +53,12 @@ from fabnet_dht.operations.data_access.update_metadata import UpdateMetadataOper
 from fabnet_dht.operations.data_access.restore_metadata import RestoreMetadataOperation
 from fabnet_dht.operations.data_access.put_object_part import PutObjectPartOperation
 from fabnet_dht.operations.data_access.get_object_info import GetObjectInfoOperation
+from fabnet_dht.operations.data_access.commit_object import CommitObjectOperation
 from fabnet_dht.hash_ranges_table import HashRange, HashRangesTable
+from fabnet_dht.key_utils import KeyUtils
+from fabnet_dht.ranges_gossip import RangesGossip, NodeWeights
+
+VRANGE_DIR_PREFIX = 'vrange_'
 
 OPERLIST = [GetRangeDataRequestOperation, GetRangesTableOperation,
              PutDataBlockOperation, GetDataBlockOperation,
@@ -63,7 +68,8 @@ OPERLIST = [GetRangeDataRequestOperation, GetRangesTableOperation,
              RepairDataBlocksOperation, GetKeysInfoOperation,
              ClientPutOperation, DeleteDataBlockOperation, ClientDeleteOperation,
              UpdateUserProfileOperation, UpdateMetadataOperation, RestoreMetadataOperation,
-             PutObjectPartOperation, GetObjectInfoOperation]
+             PutObjectPartOperation, GetObjectInfoOperation, CommitObjectOperation,
+             GossipRangesTableOperation]
 
 class DHTOperator(Operator):
     def __init__(self, self_address, home_dir='/tmp/', key_storage=None, \
@@ -76,17 +82,27 @@ class DHTOperator(Operator):
 
         self.status = DS_INITIALIZE
         self.ranges_table = HashRangesTable()
+        self.ranges_gossip = RangesGossip(self_address)
+        self.node_weights = NodeWeights()
 
         self.save_path = os.path.join(home_dir, 'dht_range')
         if not os.path.exists(self.save_path):
             os.mkdir(self.save_path)
 
-        self.__usr_md_cache = MetadataCache()
+        self.__usr_md_cache = MetadataCache(int(self.get_config_value('MD_CACHE_SIZE')), \
+                                int(self.get_config_value('MD_CACHE_MAX_OPEN_FILES')), \
+                                float(self.get_config_value('FLUSH_MD_CACHE_TIMEOUT')), \
+                                float(self.get_config_value('MD_GROUP_SYNC_INTERVAL')))
         self.__split_requests_cache = []
         self.__dht_range = FSMappedDHTRange.discovery_range(self.save_path)
+        self.__virtual_ranges = []
+        self.__pending_vrange = None
+        self.__restore_virtual_ranges()
+        self.update_node_weight()
         self.ranges_table.append(self.__dht_range.get_start(), self.__dht_range.get_end(), self.self_address)
         self.__start_dht_try_count = 0
         self.__init_dht_thread = None
+        self.__gossip_thread = None
 
         self.__check_hash_table_thread = CheckLocalHashTableThread(self)
         self.__check_hash_table_thread.setName('%s-CheckLocalHashTableThread'%self.node_name)
@@ -96,14 +112,61 @@ class DHTOperator(Operator):
         self.__monitor_dht_ranges.setName('%s-MonitorDHTRanges'%self.node_name)
         self.__monitor_dht_ranges.start()
 
+        if int(self.get_config_value('RANGES_GOSSIP')):
+            self.__gossip_thread = RangesGossipThread(self)
+            self.__gossip_thread.setName('%s-RangesGossipThread'%self.node_name)
+            self.__gossip_thread.start()
+
         self.status = DS_PREINIT
     
+    def __restore_virtual_ranges(self):
+        '''restore virtual ranges saved in vrange_* directories.
+        Not accepted virtual ranges (without saved range scope) and ranges
+        over VIRTUAL_RANGES_COUNT limit are released.
+        Restored ranges are checked against ranges table by check_near_range call
+        (see __check_virtual_ranges)'''
+        for item in sorted(os.listdir(self.save_path)):
+            if not item.startswith(VRANGE_DIR_PREFIX):
+                continue
+            vrange_path = os.path.join(self.save_path, item)
+            if FSMappedDHTRange.has_saved_range(vrange_path) and \
+                    len(self.__virtual_ranges) + 1 < int(self.get_config_value('VIRTUAL_RANGES_COUNT')):
+                vrange = FSMappedDHTRange.discovery_range(vrange_path)
+                logger.info('Restored virtual range [%040x-%040x]'%(vrange.get_start(), vrange.get_end()))
+                self.__virtual_ranges.append(vrange)
+            else:
+                self.__release_virtual_range(FSMappedDHTRange(MIN_KEY, MAX_KEY, vrange_path))
+
+    def __release_virtual_range(self, vrange):
+        '''data blocks of released virtual range are moved to main range
+        and will be sent to owners of their keys as foreign data'''
+        logger.info('Releasing virtual range at %s'%vrange.get_path())
+        vrange.move_data(self.get_dht_range())
+        shutil.rmtree(vrange.get_path())
+
     def flush_md_cache(self):
-        self.__usr_md_cache.destroy()
+        self.__usr_md_cache.flush_idle()
 
     def reinit_metadata(self, db_path):
         self.__usr_md_cache.close_md(db_path)
 
+    def export_metadata(self, db_path, out_file):
+        return self.__usr_md_cache.export_md(db_path, out_file)
+
+    def import_metadata(self, db_path, dump_file):
+        return self.__usr_md_cache.import_md(db_path, dump_file)
+
+    def pack_metadata(self, db_path, out_file, md_dump):
+        '''write user metadata to out_file as dump (see MDDump)
+        or as zip archive of metadata directory if md_dump is False.
+        Nodes of previous versions accept zip archives only
+        (dump support is reported by CheckDataBlock operation)'''
+        if md_dump:
+            self.export_metadata(db_path, out_file)
+        else:
+            self.reinit_metadata(db_path)
+            os.system('rm -f %s && cd %s && zip -r %s *'%(out_file, db_path, out_file))
+
     def get_status(self):
         return self.status
 
@@ -129,20 +192,87 @@ class DHTOperator(Operator):
     def _move_range(self, range_obj):
         logger.info('Node %s went from DHT. Updating hash range table on network...'%range_obj.node_address)
         rm_lst = [(range_obj.start, range_obj.end, range_obj.node_address)]
-        parameters = {'append': [], 'remove': rm_lst}
-
-        req = FabnetPacketRequest(method='UpdateHashRangeTable', sender=self.self_address, parameters=parameters)
-        self.call_network(req)
+        self.publish_ranges_changes(rm_lst, [])
 
     def _take_range(self, range_obj):
         logger.info('Take node old range %040x-%040x. Updating hash range table on network...'% \
                     (range_obj.start, range_obj.end))
 
         app_lst = [(range_obj.start, range_obj.end, range_obj.node_address)]
-        parameters = {'append': app_lst, 'remove': []}
+        self.publish_ranges_changes([], app_lst)
 
-        req = FabnetPacketRequest(method='UpdateHashRangeTable', sender=self.self_address, parameters=parameters)
-        self.call_network(req)
+    def publish_ranges_changes(self, rm_lst, append_lst):
+        '''send ranges table changes to all DHT nodes
+        changes are broadcasted by UpdateHashRangeTable operation
+        or are applied locally and spread by gossip rounds (RANGES_GOSSIP mode)
+        '''
+        if self.__gossip_thread is None or self.status == DS_DESTROYING:
+            req = FabnetPacketRequest(method='UpdateHashRangeTable', sender=self.self_address, \
+                    parameters={'append': append_lst, 'remove': rm_lst})
+            self.call_network(req)
+            return
+
+        self.__apply_rumor(self.ranges_gossip.new_rumor(rm_lst, append_lst))
+
+    def __apply_rumor(self, rumor):
+        '''return True if ranges table change is applied'''
+        _, _, rm_lst, append_lst = rumor
+        rm_obj_list = [HashRange(r[0], r[1], r[2]) for r in rm_lst]
+        ap_obj_list = [HashRange(a[0], a[1], a[2]) for a in append_lst]
+        self._lock()
+        try:
+            self.apply_ranges_table_changes(rm_obj_list, ap_obj_list)
+            return True
+        except Exception, err:
+            logger.warning('Ranges table change #%s from %s is not applied: %s'%(rumor[1], rumor[0], err))
+            return False
+        finally:
+            self._unlock()
+
+    def __apply_next_rumor(self, rumor):
+        '''version vector is advanced after successful change only,
+        so failed change is received again in next gossip round'''
+        if self.ranges_gossip.is_next(rumor) and self.__apply_rumor(rumor):
+            self.ranges_gossip.accept(rumor)
+
+    def apply_ranges_rumors(self, rumors):
+        self._lock()
+        try:
+            for rumor in rumors:
+                self.__apply_next_rumor(rumor)
+        finally:
+            self._unlock()
+
+    def get_missing_rumors(self, remote_vv):
+        local_vv = self.ranges_gossip.get_version_vector()
+        return local_vv, self.ranges_gossip.get_missing(remote_vv)
+
+    def restore_ranges_gossip(self, ranges_table_dump, remote_vv):
+        self._lock()
+        try:
+            self.restore_ranges_table(ranges_table_dump)
+            for rumor in self.ranges_gossip.reset(remote_vv):
+                if rumor[0] == self.self_address:
+                    #own changes are already counted in version vector
+                    self.__apply_rumor(rumor)
+                else:
+                    self.__apply_next_rumor(rumor)
+        finally:
+            self._unlock()
+
+    def gossip_ranges_table(self):
+        '''one gossip round: exchange version vectors with GOSSIP_FANOUT random nodes'''
+        nodes = set([r.node_address for r in self.ranges_table.iter_table()])
+        nodes.discard(self.self_address)
+        if not nodes:
+            nodes = set(self.get_neighbours(NT_SUPERIOR, self.OPTYPE))
+
+        fanout = min(int(Config.GOSSIP_FANOUT), len(nodes))
+        params = {'version_vector': self.ranges_gossip.get_version_vector(), \
+                    'node_weights': self.node_weights.dump()}
+        for node_address in random.sample(list(nodes), fanout):
+            req = FabnetPacketRequest(method='GossipRangesTable', sender=self.self_address, parameters=params)
+            self.call_node(node_address, req)
 
 
     def stop_inherited(self):
@@ -150,19 +280,64 @@ class DHTOperator(Operator):
         for range_obj in self.ranges_table.iter_table():
             if range_obj.node_address == self.self_address:
                 self._move_range(range_obj)
-                break
 
         self.__check_hash_table_thread.stop()
         self.__monitor_dht_ranges.stop()
+        if self.__gossip_thread:
+            self.__gossip_thread.stop()
         time.sleep(float(Config.DHT_STOP_TIMEOUT))
         self.__check_hash_table_thread.join()
         self.__monitor_dht_ranges.join()
+        if self.__gossip_thread:
+            self.__gossip_thread.join()
         self.__usr_md_cache.destroy()
 
+    def update_node_weight(self):
+        '''capacity weight of this node: free space (in GB) multiplied by NODE_IOPS_WEIGHT'''
+        free_size = self.get_dht_range().get_free_size()
+        weight = free_size * float(self.get_config_value('NODE_IOPS_WEIGHT')) / (1024 ** 3)
+        self.node_weights.update(self.self_address, weight, self.get_config_value('NODE_ZONE') or None)
+
+    def merge_node_weights(self, node_weights):
+        self.node_weights.merge(node_weights)
+
+    def get_replica_keys(self, key, replica_count):
+        '''return master key and replica keys of data block (zone aware)'''
+        return KeyUtils.get_zone_aware_keys(key, replica_count, self.ranges_table, self.node_weights)
+
+    def sort_by_zone(self, keys_info, zone):
+        '''locality preferred order of (key, dbct, node address) list:
+        keys owned by nodes from zone are first'''
+        return sorted(keys_info, key=lambda k_info: self.node_weights.get_zone(k_info[2]) != zone)
+
+    def __range_load(self, range_obj):
+        '''keys share of range relative to capacity weight of range owner
+        nodes with unknown weight are considered equal to this node'''
+        weight = self.node_weights.get(range_obj.node_address) \
+                    or self.node_weights.get(self.self_address) or 1.
+        return range_obj.length() / weight
+
+    def __get_weighted_subrange(self, range_obj):
+        '''return end part of range_obj for this node
+        size of part is proportional to weight of this node'''
+        self_weight = self.node_weights.get(self.self_address)
+        owner_weight = self.node_weights.get(range_obj.node_address)
+        if self_weight and owner_weight:
+            share = int(10000 * self_weight / (self_weight + owner_weight))
+        else:
+            share = 5000
+
+        start = range_obj.end - (range_obj.length() * share) / 10000
+        start = min(max(start, range_obj.start+1), range_obj.end)
+        return HashRange(long(start), long(range_obj.end), range_obj.node_address)
+
     def __get_next_max_range(self):
         max_range = None
+        vranges = [(r.get_start(), r.get_end()) for r in self.__virtual_ranges]
         for range_obj in self.ranges_table.iter_table():
             if range_obj.node_address == self.self_address:
+                if (range_obj.start, range_obj.end) in vranges:
+                    continue
                 return range_obj
 
             if range_obj.node_address in self.__split_requests_cache:
@@ -172,7 +347,7 @@ class DHTOperator(Operator):
                 max_range = range_obj
                 continue
 
-            if max_range.length() < range_obj.length():
+            if self.__range_load(max_range) < self.__range_load(range_obj):
                 max_range = range_obj
 
         if not max_range:
@@ -180,10 +355,13 @@ class DHTOperator(Operator):
 
         ranges = []
         for range_obj in self.ranges_table.iter_table():
-            if max_range.length() == range_obj.length():
+            if range_obj.node_address in self.__split_requests_cache \
+                    or range_obj.node_address == self.self_address:
+                continue
+            if self.__range_load(max_range) == self.__range_load(range_obj):
                 ranges.append(range_obj)
         max_range = random.choice(ranges)
-        return HashRange(long(max_range.start+max_range.length()/2+1), long(max_range.end), max_range.node_address)
+        return self.__get_weighted_subrange(max_range)
 
     def __normalize_range_request(self, c_start, c_end, f_range):
         r1 = r2 = None
@@ -282,9 +460,15 @@ class DHTOperator(Operator):
         req = FabnetPacketRequest(method='SplitRangeRequest', sender=self.self_address, parameters=parameters)
         self.call_node(new_range.node_address, req)
 
-    def get_dht_range(self):
+    def get_dht_range(self, key=None):
+        '''return main range of node
+        or local range (main or virtual) that contains key'''
         self._lock()
         try:
+            if key is not None:
+                for vrange in self.__virtual_ranges:
+                    if vrange.get_start() <= key <= vrange.get_end():
+                        return vrange
             return self.__dht_range
         finally:
             self._unlock()
@@ -341,27 +525,14 @@ class DHTOperator(Operator):
 
         self._lock()
         try:
-            self_dht_range = self.get_dht_range()
-
-            if self_dht_range.get_end() != MAX_KEY:
-                next_range = self.ranges_table.find(self_dht_range.get_end()+1)
-                if not next_range:
-                    next_exists_range = self.ranges_table.find_next(self_dht_range.get_end()-1)
-                    if next_exists_range:
-                        end = next_exists_range.start-1
-                    else:
-                        end = MAX_KEY
-                    new_dht_range = self_dht_range.extend(self_dht_range.get_end()+1, end)
-                    self.update_dht_range(new_dht_range)
-
-                    rm_lst = [(self_dht_range.get_start(), self_dht_range.get_end(), self.self_address)]
-                    append_lst = [(new_dht_range.get_start(), new_dht_range.get_end(), self.self_address)]
-
-                    logger.info('Extended range by next neighbours')
-
-                    req = FabnetPacketRequest(method='UpdateHashRangeTable', \
-                            sender=self.self_address, parameters={'append': append_lst, 'remove': rm_lst})
-                    self.call_network(req)
+            if self.__check_virtual_ranges():
+                return
+
+            if self.__remove_stale_ranges():
+                return
+
+            for local_range in self.get_local_ranges():
+                if self.__extend_by_next_gap(local_range):
                     return
 
             first_range = self.ranges_table.find(MIN_KEY)
@@ -370,22 +541,127 @@ class DHTOperator(Operator):
                 if not first_range:
                     return
                 if first_range.node_address == self.self_address:
-                    new_dht_range = self_dht_range.extend(MIN_KEY, first_range.start-1)
-                    self.update_dht_range(new_dht_range)
-                    rm_lst = [(self_dht_range.get_start(), self_dht_range.get_end(), self.self_address)]
-                    append_lst = [(new_dht_range.get_start(), new_dht_range.get_end(), self.self_address)]
+                    for local_range in self.get_local_ranges():
+                        if local_range.get_start() == first_range.start:
+                            self.__extend_local_range(local_range, MIN_KEY, first_range.start-1)
+                            logger.info('Extended range by first range')
+                            return
+        finally:
+            self._unlock()
+
+    def __is_published(self, local_range):
+        range_obj = self.ranges_table.find(local_range.get_start())
+        return bool(range_obj) and range_obj.start == local_range.get_start() \
+                and range_obj.end == local_range.get_end() and range_obj.node_address == self.self_address
+
+    def __check_virtual_ranges(self):
+        '''check virtual ranges against ranges table.
+        Virtual range that is not published (restored after node restart) is
+        published again if its keys are not owned by any node, requested back
+        by SplitRangeRequest if its keys are owned by one other node
+        or released otherwise.
+        return True if virtual range is unstable (spliting, updating or requested)'''
+        for vrange in list(self.__virtual_ranges):
+            if vrange.get_subranges():
+                return True
+            if self.__is_published(vrange):
+                continue
+
+            owners = [r for r in self.ranges_table.iter_table() \
+                    if r.start <= vrange.get_end() and r.end >= vrange.get_start()]
+            if not owners:
+                logger.info('Publishing restored virtual range [%040x-%040x]'%(vrange.get_start(), vrange.get_end()))
+                self.publish_ranges_changes([], [(vrange.get_start(), vrange.get_end(), self.self_address)])
+                return True
+
+            if all(r.node_address == self.self_address for r in owners):
+                #ranges table update is in flight
+                return True
+
+            if self.__pending_vrange:
+                return True
+
+            self.__virtual_ranges.remove(vrange)
+            owner = owners[0]
+            if len(owners) > 1 or not owner.start <= vrange.get_start() <= vrange.get_end() <= owner.end \
+                    or (owner.start == vrange.get_start()) == (owner.end == vrange.get_end()):
+                #range can be splitted at start or at end of owner range only
+                self.__release_virtual_range(vrange)
+                return True
+
+            self.__pending_vrange = vrange
+            logger.info('Call SplitRangeRequest [%040x-%040x] to %s for restored virtual range'% \
+                    (vrange.get_start(), vrange.get_end(), owner.node_address))
+            parameters = {'start_key': vrange.get_start(), 'end_key': vrange.get_end()}
+            req = FabnetPacketRequest(method='SplitRangeRequest', sender=self.self_address, parameters=parameters)
+            self.call_node(owner.node_address, req)
+            return True
 
-                    logger.info('Extended range by first range')
+        return bool(self.__pending_vrange)
+
+    def __remove_stale_ranges(self):
+        '''remove ranges of this node that are not owned by it anymore
+        (released virtual ranges) from ranges table,
+        return True if ranges table is changed.
+        Should be called when all local ranges are published (see __check_virtual_ranges),
+        so ranges with in flight updates are not removed'''
+        local_ranges = [(r.get_start(), r.get_end()) for r in self.get_local_ranges()]
+        rm_lst = []
+        for range_obj in self.ranges_table.iter_table():
+            if range_obj.node_address == self.self_address \
+                    and (range_obj.start, range_obj.end) not in local_ranges:
+                rm_lst.append((range_obj.start, range_obj.end, range_obj.node_address))
+
+        if not rm_lst:
+            return False
+        logger.info('Removing stale ranges of node: %s'% \
+                ', '.join(['%040x-%040x'%(start, end) for start, end, _ in rm_lst]))
+        self.publish_ranges_changes(rm_lst, [])
+        return True
+
+    def __extend_by_next_gap(self, local_range):
+        '''extend local range (main or virtual) by keys
+        that are not owned by any node after its end'''
+        if local_range.get_end() == MAX_KEY or not self.__is_published(local_range):
+            return False
+        if self.ranges_table.find(local_range.get_end()+1):
+            return False
+
+        next_exists_range = self.ranges_table.find_next(local_range.get_end()-1)
+        if next_exists_range:
+            end = next_exists_range.start-1
+        else:
+            end = MAX_KEY
+        self.__extend_local_range(local_range, local_range.get_end()+1, end)
+        logger.info('Extended range by next neighbours')
+        return True
 
-                    req = FabnetPacketRequest(method='UpdateHashRangeTable', \
-                            sender=self.self_address, parameters={'append': append_lst, 'remove': rm_lst})
-                    self.call_network(req)
+    def __replace_local_range(self, local_range, new_range):
+        '''replace main or virtual range by its extended or splitted part'''
+        self._lock()
+        try:
+            if local_range is self.__dht_range:
+                self.update_dht_range(new_range)
+            else:
+                new_range.save_range()
+                self.__virtual_ranges[self.__virtual_ranges.index(local_range)] = new_range
         finally:
             self._unlock()
 
+    def __extend_local_range(self, local_range, start, end):
+        new_range = local_range.extend(start, end)
+        self.__replace_local_range(local_range, new_range)
+
+        rm_lst = [(local_range.get_start(), local_range.get_end(), self.self_address)]
+        append_lst = [(new_range.get_start(), new_range.get_end(), self.self_address)]
+        self.publish_ranges_changes(rm_lst, append_lst)
+
 
     def extend_range(self, subrange_size, start_key, end_key):
-        dht_range = self.get_dht_range()
+        #local range (main or virtual) next to pulled subrange
+        dht_range = self.get_dht_range(start_key-1)
+        if dht_range.get_end() != start_key-1:
+            dht_range = self.get_dht_range(end_key+1)
         if dht_range.get_subranges():
             raise Exception('Local range is spliited at this time...')
 
@@ -412,12 +688,9 @@ class DHTOperator(Operator):
         rm_lst = [(dht_range.get_start(), dht_range.get_end(), self.self_address)]
         rm_lst.append(old_foreign_range)
 
-        self.update_dht_range(new_range)
+        self.__replace_local_range(dht_range, new_range)
 
-        req = FabnetPacketRequest(method='UpdateHashRangeTable', \
-                    sender=self.self_address,\
-                    parameters={'append': append_lst, 'remove': rm_lst})
-        self.call_network(req)
+        self.publish_ranges_changes(rm_lst, append_lst)
 
     def find_range(self, key):
         if type(key) in (str, unicode):
@@ -427,16 +700,33 @@ class DHTOperator(Operator):
             return None
         return range_obj.start, range_obj.end, range_obj.node_address
 
+    def find_ranges(self, keys):
+        l_keys = []
+        for key in keys:
+            if type(key) in (str, unicode):
+                key = long(key, 16)
+            l_keys.append(key)
+
+        ret_list = []
+        for range_obj in self.ranges_table.find_many(l_keys):
+            if not range_obj:
+                ret_list.append(None)
+            else:
+                ret_list.append((range_obj.start, range_obj.end, range_obj.node_address))
+        return ret_list
+
     def get_ranges_table_status(self):
-        c_mod_index = self.ranges_table.get_mod_index()
-        c_ranges_count = self.ranges_table.count()
-        return c_mod_index, c_ranges_count, self.ranges_table.get_first()
+        snapshot = self.ranges_table.get_snapshot()
+        first_range = None
+        if snapshot.ranges:
+            first_range = snapshot.ranges[0]
+        return snapshot.mod_index, len(snapshot.ranges), first_range, '%040x' % snapshot.checksum
 
     def remove_node_range(self, nodeaddr):
+        #node can own main range and virtual ranges
         for range_obj in self.ranges_table.iter_table():
             if range_obj.node_address == nodeaddr:
                 self._move_range(range_obj)
-                break
 
     def dump_ranges_table(self):
         return self.ranges_table.dump()
@@ -444,6 +734,15 @@ class DHTOperator(Operator):
     def restore_ranges_table(self, ranges_table_dump):
         return self.ranges_table.load(ranges_table_dump)
 
+    def wait_ranges_table(self, predicate, timeout):
+        return self.ranges_table.wait(predicate, timeout)
+
+    def get_ranges_table_changes(self, mod_index):
+        return self.ranges_table.get_changes(mod_index)
+
+    def apply_ranges_table_log(self, changes, mod_index, checksum):
+        return self.ranges_table.apply_log(changes, mod_index, checksum)
+
     def apply_ranges_table_changes(self, rm_obj_list, ap_obj_list):
         self.ranges_table.apply_changes(rm_obj_list, ap_obj_list)
 
@@ -451,12 +750,21 @@ class DHTOperator(Operator):
         repair_proc = RepairProcess(self)
         return repair_proc.repair_process(params)
 
+    def __get_splitted_range(self):
+        for local_range in self.get_local_ranges():
+            if local_range.get_subranges():
+                return local_range
+        return None
+
     def split_range(self, start_key, end_key):
-        dht_range = self.get_dht_range()
+        '''split local range (main or virtual) that contains requested subrange'''
+        splitted = self.__get_splitted_range()
+        if splitted:
+            raise Exception('Already splitted %s'%str(splitted.get_subranges()))
 
-        subranges = dht_range.get_subranges()
-        if subranges:
-            raise Exception('Already splitted %s'%str(subranges))
+        dht_range = self.get_dht_range(start_key)
+        if not (dht_range.get_start() <= end_key <= dht_range.get_end()):
+            raise Exception('No local range found for subrange [%040x-%040x]'%(start_key, end_key))
 
         ret_range, new_range = dht_range.split_range(start_key, end_key)
         range_size = ret_range.get_data_size()
@@ -464,7 +772,8 @@ class DHTOperator(Operator):
         return range_size
 
     def join_subranges(self):
-        self.get_dht_range().join_subranges()
+        for local_range in self.get_local_ranges():
+            local_range.join_subranges()
 
     def accept_foreign_subrange(self, foreign_node, subrange_size):
         dht_range = self.get_dht_range()
@@ -472,6 +781,7 @@ class DHTOperator(Operator):
         estimated_data_size_perc = dht_range.get_estimated_data_percents(subrange_size)
         if estimated_data_size_perc >= float(Config.ALLOW_USED_SIZE_PERCENTS):
             logger.info('Requested range is huge for me :( canceling...')
+            self.__pop_pending_vrange()
             req = FabnetPacketRequest(method='SplitRangeCancel', sender=self.self_address)
             self.call_node(foreign_node, req)
         else:
@@ -483,8 +793,7 @@ class DHTOperator(Operator):
         '''Check range table with with other DHT nodes
         If no neighbours found - return False
         '''
-        ranges_count = self.ranges_table.count()
-        mod_index = self.ranges_table.get_mod_index()
+        mod_index, ranges_count, _, checksum = self.get_ranges_table_status()
         range_start = self.get_dht_range().get_start()
         range_end = self.get_dht_range().get_end()
 
@@ -501,33 +810,149 @@ class DHTOperator(Operator):
 
         logger.debug('Checking range table at %s'%neighbour)
         params = {'mod_index': mod_index, 'ranges_count': ranges_count, \
-                    'range_start': range_start, 'range_end': range_end}
+                    'range_start': range_start, 'range_end': range_end, \
+                    'checksum': checksum, 'node_weights': self.node_weights.dump()}
 
         packet_obj = FabnetPacketRequest(method='CheckHashRangeTable',
                     sender=self.self_address, parameters=params)
         self.call_node(neighbour, packet_obj)
         return True
 
+    def get_local_ranges(self):
+        '''return main range and virtual ranges of this node'''
+        self._lock()
+        try:
+            return [self.__dht_range] + self.__virtual_ranges
+        finally:
+            self._unlock()
+
+    def __get_local_range(self, key):
+        try:
+            l_key = long(key, 16)
+        except ValueError:
+            #temporary data block
+            return self.get_dht_range()
+
+        self._lock()
+        try:
+            for vrange in self.__virtual_ranges + filter(None, [self.__pending_vrange]):
+                if vrange.get_start() <= l_key <= vrange.get_end():
+                    return vrange
+            return self.__dht_range
+        finally:
+            self._unlock()
+
+    def acquire_virtual_range(self):
+        '''request half of max foreign range as new virtual range
+        if node owns less than VIRTUAL_RANGES_COUNT ranges'''
+        if self.status != DS_NORMALWORK:
+            return False
+
+        self._lock()
+        try:
+            if self.__pending_vrange or len(self.__virtual_ranges) + 1 >= int(Config.VIRTUAL_RANGES_COUNT):
+                return False
+
+            max_range = None
+            for range_obj in self.ranges_table.iter_table():
+                if range_obj.node_address == self.self_address:
+                    continue
+                if (not max_range) or self.__range_load(max_range) < self.__range_load(range_obj):
+                    max_range = range_obj
+            if not max_range:
+                return False
+
+            new_range = self.__get_weighted_subrange(max_range)
+            #scope of restored virtual range can differ from its directory name
+            vrange_path = tempfile.mkdtemp(prefix='%s%040x_'%(VRANGE_DIR_PREFIX, new_range.start), dir=self.save_path)
+            self.__pending_vrange = FSMappedDHTRange(new_range.start, new_range.end, vrange_path)
+        finally:
+            self._unlock()
+
+        logger.info('Call SplitRangeRequest [%040x-%040x] to %s for virtual range'% \
+                (new_range.start, new_range.end, new_range.node_address))
+        parameters = {'start_key': new_range.start, 'end_key': new_range.end}
+        req = FabnetPacketRequest(method='SplitRangeRequest', sender=self.self_address, parameters=parameters)
+        self.call_node(new_range.node_address, req)
+        return True
+
+    def move_to_local_range(self, from_range, key, dbct, path):
+        '''move foreign data block of from_range to other range of this node
+        that contains key (main or virtual range)
+        return True if data block is moved'''
+        try:
+            l_key = long(key, 16)
+        except ValueError:
+            return False
+
+        dht_range = self.__get_local_range(key)
+        if dht_range is from_range or \
+                not (dht_range.get_start() <= l_key <= dht_range.get_end()):
+            return False
+        os.rename(path, dht_range.get_db_path(key, dbct, for_write=False))
+        return True
+
+    def __pop_pending_vrange(self):
+        self._lock()
+        try:
+            vrange = self.__pending_vrange
+            self.__pending_vrange = None
+        finally:
+            self._unlock()
+
+        if vrange:
+            self.__release_virtual_range(vrange)
+        return vrange
+
+    def on_range_request_failed(self):
+        '''SplitRangeRequest or GetRangeDataRequest operation is failed'''
+        if self.__pop_pending_vrange():
+            logger.info('Virtual range is not accepted')
+            return
+        self.start_as_dht_member()
+
+    def on_range_accepted(self):
+        '''data of requested range is received'''
+        self._lock()
+        try:
+            vrange = self.__pending_vrange
+            self.__pending_vrange = None
+            if vrange:
+                vrange.save_range()
+                self.__virtual_ranges.append(vrange)
+        finally:
+            self._unlock()
+
+        if vrange:
+            logger.info('Virtual range [%040x-%040x] is accepted'%(vrange.get_start(), vrange.get_end()))
+            return
+        self.set_status_to_normalwork(True) #with save_range=True
+
     def get_db_path(self, key, cnt_type):
-        return self.get_dht_range().get_db_path(key, cnt_type)
+        return self.__get_local_range(key).get_db_path(key, cnt_type)
+
+    def remove_db(self, key, cnt_type):
+        self.__get_local_range(key).remove_db(key, cnt_type)
 
     def copy_db(self, s_key, s_ct, d_key, d_ct):
-        s_path = self.get_dht_range().get_db_path(s_key, s_ct)
-        d_path = self.get_dht_range().get_db_path(d_key, d_ct)
+        s_path = self.__get_local_range(s_key).get_db_path(s_key, s_ct)
+        d_path = self.__get_local_range(d_key).get_db_path(d_key, d_ct)
         shutil.copyfile(s_path, d_path)
 
     def send_subrange_data(self, node_address):
-        dht_range = self.get_dht_range()
-        subranges = dht_range.get_subranges()
-        if not subranges:
+        dht_range = self.__get_splitted_range()
+        if not dht_range:
             raise Exception('Range is not splitted!')
 
-        ret_range, new_range = subranges
+        ret_range, new_range = dht_range.get_subranges()
         try:
             self.__monitor_dht_ranges.force()
 
-            self.update_dht_range(new_range)
-            self.set_status_to_normalwork(save_range=True)
+            if dht_range is self.get_dht_range():
+                self.update_dht_range(new_range)
+                self.set_status_to_normalwork(save_range=True)
+            else:
+                self.__replace_local_range(dht_range, new_range)
         except Exception, err:
             logger.error('send_subrange_data error: %s'%err)
             dht_range.join_subranges()
@@ -536,10 +961,7 @@ class DHTOperator(Operator):
         append_lst = [(ret_range.get_start(), ret_range.get_end(), node_address)]
         append_lst.append((new_range.get_start(), new_range.get_end(), self.self_address))
         rm_lst = [(dht_range.get_start(), dht_range.get_end(), self.self_address)]
-        req = FabnetPacketRequest(method='UpdateHashRangeTable', \
-                    sender=self.self_address,\
-                    parameters={'append': append_lst, 'remove': rm_lst})
-        self.call_network(req)
+        self.publish_ranges_changes(rm_lst, append_lst)
 
     def user_metadata_call(self, method, *args, **kv_args):
         return self.__usr_md_cache.call(method, *args, **kv_args)
@@ -555,25 +977,42 @@ class CheckLocalHashTableThread(threading.Thread):
     def run(self):
         logger.info('Thread started!')
 
-        t0 = datetime.now()
         while not self.stopped.is_set():
-            dt = datetime.now() - t0
-            if dt.total_seconds() > float(Config.FLUSH_MD_CACHE_TIMEOUT):
-                self.operator.flush_md_cache()
-                t0 = datetime.now()
-
             try:
+                self.operator.flush_md_cache()
+                self.operator.update_node_weight()
                 if not self.operator.check_range_table():
                     logger.info('Waiting neighbours...')
-                    time.sleep(float(Config.INIT_DHT_WAIT_NEIGHBOUR_TIMEOUT))
+                    self.stopped.wait(float(Config.INIT_DHT_WAIT_NEIGHBOUR_TIMEOUT))
                     continue
             except Exception, err:
                 logger.error(str(err))
 
-            for i in xrange(int(Config.CHECK_HASH_TABLE_TIMEOUT)):
-                if self.stopped.is_set():
-                    break
-                time.sleep(1)
+            self.stopped.wait(float(Config.CHECK_HASH_TABLE_TIMEOUT))
+
+        logger.info('Thread stopped!')
+
+    def stop(self):
+        self.stopped.set()
+
+
+class RangesGossipThread(threading.Thread):
+    def __init__(self, operator):
+        threading.Thread.__init__(self)
+        self.operator = operator
+        self.stopped = threading.Event()
+
+    def run(self):
+        logger.info('Thread started!')
+
+        while not self.stopped.is_set():
+            try:
+                if self.operator.get_status() != DS_INITIALIZE:
+                    self.operator.gossip_ranges_table()
+            except Exception, err:
+                logger.error('[RangesGossipThread] %s'%err)
+
+            self.stopped.wait(float(Config.GOSSIP_INTERVAL))
 
         logger.info('Thread stopped!')
 
@@ -608,6 +1047,7 @@ class MonitorDHTRanges(threading.Thread):
                 dht_range.block_for_write(float(Config.CRITICAL_FREE_SPACE_PERCENT))
 
             logger.warning('Few free size for data range. Trying pull part of range to network')
+            self.__last_is_start_part = self._is_start_part_preferred(dht_range)
 
             if not self._pull_subrange(dht_range):
                 self._pull_subrange(dht_range)
@@ -624,6 +1064,20 @@ class MonitorDHTRanges(threading.Thread):
             self.__changed_range = False
             self.__notification_flag = False
 
+    def _is_start_part_preferred(self, dht_range):
+        '''pull subrange to neighbour with greater capacity weight'''
+        weights = []
+        for key in (dht_range.get_start() - 1, dht_range.get_end() + 1):
+            k_range = None
+            if MIN_KEY <= key <= MAX_KEY:
+                k_range = self.operator.ranges_table.find(key)
+            weights.append(k_range and self.operator.node_weights.get(k_range.node_address))
+
+        left_weight, right_weight = weights
+        if left_weight is None or right_weight is None or left_weight == right_weight:
+            return self.__last_is_start_part
+        return left_weight > right_weight
+
     def _pull_subrange(self, dht_range):
         split_part = int((dht_range.length() * float(Config.PULL_SUBRANGE_SIZE_PERC)) / 100)
         if self.__last_is_start_part:
@@ -672,16 +1126,21 @@ class MonitorDHTRanges(threading.Thread):
 
     def _process_foreign(self):
         self.__full_nodes = []
-        dht_range = self.operator.get_dht_range()
         cnt = 0
-        for digest, dbct, file_path in dht_range.iterator(foreign_only=True):
-            cnt += 1
+        for dht_range in self.operator.get_local_ranges():
+            for digest, dbct, file_path in dht_range.iterator(foreign_only=True):
+                cnt += 1
+                if self.stopped.is_set():
+                    break
+                logger.info('Processing foreign data block %s %s'%(digest, dbct))
+                if self.operator.move_to_local_range(dht_range, digest, dbct, file_path):
+                    logger.debug('data block with key=%s is moved to other local range'%digest)
+                    continue
+                if self._put_data(digest, file_path, dbct):
+                    logger.debug('data block with key=%s is send'%digest)
+                    os.remove(file_path)
             if self.stopped.is_set():
                 break
-            logger.info('Processing foreign data block %s %s'%(digest, dbct))
-            if self._put_data(digest, file_path, dbct):
-                logger.debug('data block with key=%s is send'%digest)
-                os.remove(file_path)
 
         if cnt == 0:
             self.__changed_range = False
@@ -734,13 +1193,8 @@ class MonitorDHTRanges(threading.Thread):
     def run(self):
         logger.info('started')
         while True:
-            for i in xrange(int(Config.MONITOR_DHT_RANGES_TIMEOUT)):
-                if self.stopped.is_set():
-                    break
-                if self.interrupt.is_set():
-                    self.interrupt.clear()
-                    break
-                time.sleep(1)
+            self.interrupt.wait(float(Config.MONITOR_DHT_RANGES_TIMEOUT))
+            self.interrupt.clear()
 
             if self.stopped.is_set():
                 break
@@ -757,6 +1211,8 @@ class MonitorDHTRanges(threading.Thread):
                 self._check_range_free_size()
                 if self.stopped.is_set():
                     break
+
+                self.operator.acquire_virtual_range()
             except Exception, err:
                 logger.write = logger.debug
                 traceback.print_exc(file=logger)
@@ -766,6 +1222,7 @@ class MonitorDHTRanges(threading.Thread):
 
     def stop(self):
         self.stopped.set()
+        self.interrupt.set()
 
     def force(self):
         self.interrupt.set()
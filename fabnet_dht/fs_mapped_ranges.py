@@ -50,6 +50,11 @@ class FSMappedDHTRange:
 
         return FSMappedDHTRange(range_start, range_end, range_path)
 
+    @classmethod
+    def has_saved_range(cls, range_path):
+        '''return True if range scope is saved in range_info file'''
+        return os.path.exists(os.path.join(range_path, cls.__RANGE_INFO_FN))
+
     def __init__(self, start, end, range_path):
         if not os.path.exists(range_path):
             raise FSHashRangesException('Path %s does not found!'%range_path) 
@@ -131,6 +136,9 @@ class FSMappedDHTRange:
     def get_start(self):
         return self.__start
 
+    def get_path(self):
+        return self.__range_path
+
     def get_end(self):
         return self.__end
 
@@ -317,6 +325,11 @@ class FSMappedDHTRange:
         self.__free_for_unlock = free_for_unlock
         self.__no_free_space_flag.set()
 
+    def move_data(self, dest_range):
+        '''move all data blocks to other range (on the same file system)'''
+        for db_key, dbct, path in self.iterator(all_data=True):
+            os.rename(path, dest_range.get_db_path(db_key, dbct, for_write=False))
+
     def remove_db(self, key, db_content_type):
         '''remove data block'''
         f_path = self.__dirs_map.get(db_content_type, None)
@@ -9,14 +9,24 @@ Copyright (C) 2012 Konstantin Andrusenko
 @author Konstantin Andrusenko
 @date September 5, 2012
 """
-import threading
+import time
 import pickle
-import copy
+import threading
+import collections
+import struct
+import bisect
 import hashlib
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from fabnet.utils.logger import oper_logger as logger
 
+CHANGES_LOG_SIZE = 1024
+
+OP_APPEND = '+'
+OP_REMOVE = '-'
+
+CHECKSUM_MOD = 2 ** 160
+
 
 class RangeException(Exception):
     pass
@@ -39,190 +49,327 @@ class HashRange:
             return True
         return False
 
+    def get_hash(self):
+        return long(hashlib.sha1(self.to_str()).hexdigest(), 16)
+
+
+class RangesSnapshot:
+    '''immutable state of ranges table
+    HashRangesTable replaces snapshot object on every change,
+    so readers can use it without any locking
+    '''
+    def __init__(self, ranges, last_dm, mod_index, starts=None, checksum=None):
+        self.ranges = tuple(ranges)
+        if starts is None:
+            starts = [r.start for r in self.ranges]
+        #sorted range starts, parallel to ranges
+        self.starts = tuple(starts)
+        self.last_dm = last_dm
+        self.mod_index = mod_index
+        if checksum is None:
+            checksum = sum([r.get_hash() for r in self.ranges]) % CHECKSUM_MOD
+        #order independent digest: sum of ranges hashes
+        self.checksum = checksum
+
+
+class RangesDump:
+    '''compact binary representation of ranges table
+
+    header: label, version, last modification time (microseconds
+            since epoch), mod index, addresses count, ranges count
+    addresses table: (<address length><address>)*
+    ranges: (<end key (20 bytes)><varint address index><varint start delta>)*
+            start delta is distance from previous range end + 1
+
+    Dump starts with label, so pickled dump of previous release
+    ([ranges, last_dm, mod_index]) is recognized and accepted too.
+    FIXME: support of pickled dump should be removed in next release
+    '''
+    LABEL = 'FHRT'
+    VERSION = 1
+    HEADER_FMT = '<4sBqQII'
+    HEADER_LEN = struct.calcsize(HEADER_FMT)
+    EPOCH = datetime(1970, 1, 1)
+
+    @classmethod
+    def _pack_varint(cls, value):
+        ret = []
+        while value > 0x7f:
+            ret.append(chr((value & 0x7f) | 0x80))
+            value >>= 7
+        ret.append(chr(value))
+        return ''.join(ret)
+
+    @classmethod
+    def _unpack_varint(cls, raw, pos):
+        value = 0
+        shift = 0
+        while True:
+            byte = ord(raw[pos])
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value, pos
+            shift += 7
+
+    @classmethod
+    def pack(cls, ranges, last_dm, mod_index):
+        dm_delta = last_dm - cls.EPOCH
+        dm_us = (dm_delta.days * 86400 + dm_delta.seconds) * 1000000 + dm_delta.microseconds
+
+        addresses = {}
+        addr_list = []
+        raw_ranges = []
+        next_start = 0
+        for range_obj in ranges:
+            addr_idx = addresses.get(range_obj.node_address, None)
+            if addr_idx is None:
+                addr_idx = addresses[range_obj.node_address] = len(addr_list)
+                addr_list.append(range_obj.node_address)
+
+            raw_ranges.append(('%040x'%range_obj.end).decode('hex'))
+            raw_ranges.append(cls._pack_varint(addr_idx))
+            raw_ranges.append(cls._pack_varint(range_obj.start - next_start))
+            next_start = range_obj.end + 1
+
+        raw = [struct.pack(cls.HEADER_FMT, cls.LABEL, cls.VERSION, dm_us, mod_index, \
+                    len(addr_list), len(ranges))]
+        for address in addr_list:
+            raw.append(struct.pack('<H', len(address)) + address)
+        raw += raw_ranges
+        return ''.join(raw)
+
+    @classmethod
+    def _unpack_pickle(cls, raw):
+        try:
+            ranges, last_dm, mod_index = pickle.loads(raw)
+            for range_obj in ranges:
+                if not isinstance(range_obj, HashRange):
+                    raise ValueError('invalid range object %r'%range_obj)
+            if not isinstance(last_dm, datetime):
+                raise ValueError('invalid modification time %r'%last_dm)
+            return list(ranges), last_dm, int(mod_index)
+        except Exception, err:
+            raise RangeException('Invalid ranges table dump: %s'%err)
+
+    @classmethod
+    def unpack(cls, raw):
+        '''return (list of HashRange objects, last_dm, mod_index)
+        raise RangeException if dump is invalid'''
+        if not raw.startswith(cls.LABEL):
+            logger.debug('Ranges table dump of previous release is received')
+            return cls._unpack_pickle(raw)
+
+        try:
+            label, version, dm_us, mod_index, addr_cnt, ranges_cnt = \
+                    struct.unpack(cls.HEADER_FMT, raw[:cls.HEADER_LEN])
+            if version != cls.VERSION:
+                raise ValueError('unsupported version %s'%version)
+
+            pos = cls.HEADER_LEN
+            addr_list = []
+            for _ in xrange(addr_cnt):
+                addr_len, = struct.unpack('<H', raw[pos:pos+2])
+                pos += 2
+                address = raw[pos:pos+addr_len]
+                if len(address) != addr_len:
+                    raise ValueError('unexpected end of addresses table')
+                addr_list.append(address)
+                pos += addr_len
+
+            ranges = []
+            next_start = 0
+            for _ in xrange(ranges_cnt):
+                raw_end = raw[pos:pos+20]
+                if len(raw_end) != 20:
+                    raise ValueError('unexpected end of ranges list')
+                end = long(raw_end.encode('hex'), 16)
+                addr_idx, pos = cls._unpack_varint(raw, pos+20)
+                start_delta, pos = cls._unpack_varint(raw, pos)
+                start = next_start + start_delta
+                if start > end:
+                    raise ValueError('invalid range [%040x-%040x]'%(start, end))
+                ranges.append(HashRange(start, end, addr_list[addr_idx]))
+                next_start = end + 1
+
+            if pos != len(raw):
+                raise ValueError('unexpected data at end of dump')
+        except (ValueError, IndexError, struct.error), err:
+            raise RangeException('Invalid ranges table dump: %s'%err)
+
+        return ranges, cls.EPOCH + timedelta(microseconds=dm_us), mod_index
+
 
 class HashRangesTable:
-    def __init__(self):
-        self.__ranges = []
+    def __init__(self, changes_log_size=CHANGES_LOG_SIZE):
         self.__lock = threading.RLock()
-        self.__last_dm = datetime(1, 1, 1, 1, 1, 1, 1)
+        #notified on every snapshot change
+        self.__changed = threading.Condition(self.__lock)
         self.__blocked = threading.Event()
-        self.__mod_index = 0
+        self.__snapshot = RangesSnapshot([], datetime(1, 1, 1, 1, 1, 1, 1), 0)
+        #history of applied changes: (mod_index, operation, start, end, node_address)
+        self.__changes = collections.deque(maxlen=changes_log_size)
+
+    def __commit(self, ranges, starts, changes):
+        '''every change increments mod_index'''
+        mod_index = self.__snapshot.mod_index
+        for change in changes:
+            mod_index += 1
+            self.__changes.append((mod_index,) + change)
+        checksum = self.__update_checksum(self.__snapshot.checksum, changes)
+        self.__snapshot = RangesSnapshot(ranges, datetime.utcnow(), mod_index, starts, checksum)
+        self.__changed.notify_all()
+
+    def __update_checksum(self, checksum, changes):
+        for operation, start, end, node_address in changes:
+            r_hash = HashRange(start, end, node_address).get_hash()
+            if operation == OP_APPEND:
+                checksum += r_hash
+            else:
+                checksum -= r_hash
+        return checksum % CHECKSUM_MOD
 
-    def is_blocked(self):
-        return self.__blocked.is_set()
+    def get_snapshot(self):
+        return self.__snapshot
 
-    def count(self):
+    def wait(self, predicate, timeout):
+        '''wait until predicate(snapshot) returns True
+        predicate is checked on every ranges table change
+        return False if timeout is expired'''
+        end_time = time.time() + timeout
         self.__lock.acquire()
         try:
-            return len(self.__ranges)
+            while not predicate(self.__snapshot):
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    return False
+                self.__changed.wait(remaining)
+            return True
         finally:
             self.__lock.release()
 
+    def is_blocked(self):
+        return self.__blocked.is_set()
+
+    def count(self):
+        return len(self.__snapshot.ranges)
+
     def get_checksum(self):
-        self.__lock.acquire()
-        try:
-            checksum = hashlib.sha1()
-            for range_obj in self.__ranges:
-                checksum.update(range_obj.to_str())
-            return checksum.hexdigest()
-        finally:
-            self.__lock.release()
+        return '%040x' % self.__snapshot.checksum
 
     def get_last_dm(self):
-        self.__lock.acquire()
-        try:
-            return self.__last_dm
-        finally:
-            self.__lock.release()
+        return self.__snapshot.last_dm
 
     def get_mod_index(self):
-        self.__lock.acquire()
-        try:
-            return self.__mod_index
-        finally:
-            self.__lock.release()
+        return self.__snapshot.mod_index
 
     def empty(self):
-        self.__lock.acquire()
-        try:
-            return not bool(self.__ranges)
-        finally:
-            self.__lock.release()
+        return not bool(self.__snapshot.ranges)
+
+    def __check_blocked(self):
+        if self.__blocked.is_set():
+            raise RangeException('Ranges table is blocked for write! Waiting neighbour arbitring...')
 
     def append(self, start, end, node_addr):
         self.__lock.acquire()
         try:
-            if self.__blocked.is_set():
-                raise RangeException('Ranges table is blocked for write! Waiting neighbour arbitring...')
-
-            r_obj = self.find(start)
-            if r_obj:
-                if r_obj.start == start and r_obj.end == end and r_obj.node_address == node_addr:
-                    #range is already exists in table
-                    return
+            self.__check_blocked()
 
-                err_msg = 'Cant append range [%040x-%040x]%s, it is crossed by existing [%040x-%040x]%s range' \
-                            % (start, end, node_addr, r_obj.start, r_obj.end, r_obj.node_address)
-                raise RangeException(err_msg)
-
-            r_obj = self.find(end)
-            if r_obj:
-                err_msg = 'Cant append range [%040x-%040x]%s, it is crossed by existing [%040x-%040x]%s range' \
-                            % (start, end, node_addr, r_obj.start, r_obj.end, r_obj.node_address)
-                raise RangeException(err_msg)
-
-            h_range = HashRange(start, end, node_addr)
-            self.__sorted_insert(h_range)
-            self.__last_dm = datetime.utcnow()
-            self.__mod_index += 1
+            snapshot = self.__snapshot
+            ranges, starts = list(snapshot.ranges), list(snapshot.starts)
+            if self.__append(ranges, starts, start, end, node_addr):
+                self.__commit(ranges, starts, [(OP_APPEND, start, end, node_addr)])
         finally:
             self.__lock.release()
 
+    def __append(self, ranges, starts, start, end, node_addr):
+        r_obj = self.__find(ranges, starts, start)
+        if r_obj:
+            if r_obj.start == start and r_obj.end == end and r_obj.node_address == node_addr:
+                #range is already exists in table
+                return False
+
+            err_msg = 'Cant append range [%040x-%040x]%s, it is crossed by existing [%040x-%040x]%s range' \
+                        % (start, end, node_addr, r_obj.start, r_obj.end, r_obj.node_address)
+            raise RangeException(err_msg)
+
+        r_obj = self.__find(ranges, starts, end)
+        if r_obj:
+            err_msg = 'Cant append range [%040x-%040x]%s, it is crossed by existing [%040x-%040x]%s range' \
+                        % (start, end, node_addr, r_obj.start, r_obj.end, r_obj.node_address)
+            raise RangeException(err_msg)
+
+        #no existing range contains start or end, but new range
+        #can cover some ranges at all
+        idx = bisect.bisect_left(starts, start)
+        if idx < len(ranges) and ranges[idx].start <= end:
+            r_obj = ranges[idx]
+            err_msg = 'Cant append range [%040x-%040x]%s, it is crossed by existing [%040x-%040x]%s range' \
+                        % (start, end, node_addr, r_obj.start, r_obj.end, r_obj.node_address)
+            raise RangeException(err_msg)
+
+        ranges.insert(idx, HashRange(start, end, node_addr))
+        starts.insert(idx, start)
+        return True
+
     def remove(self, ex_hash):
         self.__lock.acquire()
         try:
-            if self.__blocked.is_set():
-                raise RangeException('Ranges table is blocked for write! Waiting neighbour arbitring...')
+            self.__check_blocked()
 
-            r_obj = self.find(ex_hash)
-            if not r_obj:
-                return None
-                #raise RangeException('Range does not found for hash %s'%ex_hash)
-
-            del self.__ranges[self.__ranges.index(r_obj)]
-            self.__last_dm = datetime.utcnow()
-            self.__mod_index += 1
+            snapshot = self.__snapshot
+            ranges, starts = list(snapshot.ranges), list(snapshot.starts)
+            r_obj = self.__remove(ranges, starts, ex_hash)
+            if r_obj:
+                self.__commit(ranges, starts, [(OP_REMOVE, r_obj.start, r_obj.end, r_obj.node_address)])
         finally:
             self.__lock.release()
 
-    def __sorted_insert(self, new_range_obj):
-        tr_start = 0
-        max_len = tr_end = len(self.__ranges)-1
-        cur_n = int(tr_end/2)
-
-        while True:
-            if tr_start > tr_end:
-                break
-
-            if cur_n > 1:
-                pre_obj = self.__ranges[cur_n-1]
-            else:
-                pre_obj = None
-
-            if cur_n < max_len:
-                next_obj = self.__ranges[cur_n+1]
-            else:
-                next_obj = None
-
-            range_obj = self.__ranges[cur_n]
-            if pre_obj and pre_obj.end < new_range_obj.start \
-                    and range_obj.start > new_range_obj.end:
-                break
-
-            if next_obj and range_obj.end < new_range_obj.start \
-                    and next_obj.start > new_range_obj.end:
-                cur_n += 1
-                break
-
-            if new_range_obj.start > range_obj.end:
-                tr_start = cur_n + 1
-            else:
-                tr_end = cur_n - 1
-
-            cur_n = int((tr_start + tr_end)/2)
-            pre_obj = range_obj
-
-        if tr_start > tr_end:
-            if tr_end < 0:
-                self.__ranges.insert(0, new_range_obj)
-            else:
-                self.__ranges.append(new_range_obj)
-        else:
-            return self.__ranges.insert(cur_n, new_range_obj)
+    def __remove(self, ranges, starts, ex_hash):
+        idx = self.__find_int(ranges, starts, ex_hash)
+        if idx is None:
+            return None
+            #raise RangeException('Range does not found for hash %s'%ex_hash)
 
+        r_obj = ranges.pop(idx)
+        del starts[idx]
+        return r_obj
 
     def __repr__(self):
-        return str(self.__ranges)
+        return str(list(self.__snapshot.ranges))
 
     def copy(self):
-        self.__lock.acquire()
-        try:
-            return copy.copy(self.__ranges)
-        finally:
-            self.__lock.release()
+        return list(self.__snapshot.ranges)
 
     def dump(self):
-        self.__lock.acquire()
-        try:
-            return pickle.dumps([self.__ranges, self.__last_dm, self.__mod_index])
-        finally:
-            self.__lock.release()
+        snapshot = self.__snapshot
+        return RangesDump.pack(snapshot.ranges, snapshot.last_dm, snapshot.mod_index)
 
     def load(self, ranges_dump):
         self.__lock.acquire()
         try:
             is_old_ex = False
-            if self.__ranges:
-                is_old_ex = self.__ranges
+            if self.__snapshot.ranges:
+                is_old_ex = self.__snapshot.ranges
 
-            self.__ranges, self.__last_dm, self.__mod_index = pickle.loads(ranges_dump)
+            ranges, last_dm, mod_index = RangesDump.unpack(ranges_dump)
+            self.__snapshot = RangesSnapshot(ranges, last_dm, mod_index)
+            #local history does not lead to loaded table
+            self.__changes.clear()
+            self.__changed.notify_all()
 
-            logger.debug('HASH RANGES: %s'%'\n'.join([r.to_str() for r in self.__ranges]))
+            logger.debug('HASH RANGES: %s'%'\n'.join([r.to_str() for r in ranges]))
 
             if is_old_ex and len(is_old_ex) > 1:
+                old_set = set([r.to_str() for r in is_old_ex])
+                new_set = set([r.to_str() for r in ranges])
                 log_s = 'OLD(-)/NEW(+) HASHES IN TABLES:\n'
-                for range_o in self.iter_table():
-                    for old_range in is_old_ex:
-                        if old_range.to_str() == range_o.to_str():
-                            break
-                    else:
+                for range_o in ranges:
+                    if range_o.to_str() not in old_set:
                         log_s += '+ %s\n' % range_o.to_str()
 
                 for old_range in is_old_ex:
-                    for range_o in self.iter_table():
-                        if old_range.to_str() == range_o.to_str():
-                            break
-                    else:
+                    if old_range.to_str() not in new_set:
                         log_s += '- %s\n' % old_range.to_str()
 
                 logger.info(log_s)
@@ -234,6 +381,57 @@ class HashRangesTable:
         finally:
             self.__lock.release()
 
+    def get_changes(self, mod_index):
+        '''return (changes, current mod_index, checksum) where changes is list of
+        (operation, start, end, node_address) applied after mod_index
+        return None if changes history does not contain all these changes'''
+        self.__lock.acquire()
+        try:
+            snapshot = self.__snapshot
+            if mod_index > snapshot.mod_index:
+                return None
+
+            changes = []
+            if mod_index < snapshot.mod_index:
+                if not self.__changes or self.__changes[0][0] > mod_index + 1:
+                    return None
+                changes = [change[1:] for change in self.__changes if change[0] > mod_index]
+
+            return changes, snapshot.mod_index, '%040x' % snapshot.checksum
+        finally:
+            self.__lock.release()
+
+    def apply_log(self, changes, mod_index, checksum):
+        '''apply changes received by get_changes call on other node
+        table is not changed if changes can not be applied or
+        result table does not match checksum (RangeException is raised)
+        return count of ranges before applying'''
+        self.__lock.acquire()
+        try:
+            snapshot = self.__snapshot
+            if snapshot.mod_index + len(changes) != mod_index:
+                raise RangeException('Changes log is not continuous for mod_index=%s (local mod_index=%s)' \
+                        % (mod_index, snapshot.mod_index))
+
+            ranges, starts = list(snapshot.ranges), list(snapshot.starts)
+            for operation, start, end, node_address in changes:
+                if operation == OP_APPEND:
+                    applied = self.__append(ranges, starts, start, end, node_address)
+                else:
+                    r_obj = self.__remove(ranges, starts, start)
+                    applied = r_obj and (r_obj.start, r_obj.end, r_obj.node_address) == (start, end, node_address)
+                if not applied:
+                    raise RangeException('Cant apply change %s[%040x-%040x]%s'%(operation, start, end, node_address))
+
+            if '%040x' % self.__update_checksum(snapshot.checksum, changes) != checksum:
+                raise RangeException('Ranges table checksum mismatch after applying changes log')
+
+            self.__commit(ranges, starts, [tuple(change) for change in changes])
+            self.__blocked.clear()
+            return len(snapshot.ranges)
+        finally:
+            self.__lock.release()
+
     def block(self):
         self.__lock.acquire()
         try:
@@ -251,6 +449,8 @@ class HashRangesTable:
             self.__lock.release()
 
     def apply_changes(self, rm_obj_list, ap_obj_list):
+        '''remove and append ranges as one change
+        readers see table before or after all changes'''
         self.__lock.acquire()
         try:
             tmp_table = HashRangesTable()
@@ -263,104 +463,101 @@ class HashRangesTable:
                     raise Exception('Ranges are not one near one. END=%040x, next START=%040x'%(end_i, item.start))
                 end_i = item.end
 
+            snapshot = self.__snapshot
+            ranges, starts = list(snapshot.ranges), list(snapshot.starts)
             if not tmp_table.empty():
                 for app_obj in ap_obj_list:
-                    if (tmp_table.get_first().start > app_obj.start and self.find(app_obj.start)) \
-                            or (tmp_table.get_end().end < app_obj.end and self.find(app_obj.end)):
+                    if (tmp_table.get_first().start > app_obj.start and self.__find(ranges, starts, app_obj.start)) \
+                            or (tmp_table.get_end().end < app_obj.end and self.__find(ranges, starts, app_obj.end)):
                         raise Exception('Appending range {%040x-%040x} is intersected by exists range!'%(app_obj.start, app_obj.end))
 
             for rm_obj in rm_obj_list:
-                found = self.find(rm_obj.start)
+                found = self.__find(ranges, starts, rm_obj.start)
                 if found:
                     if rm_obj.start != found.start or rm_obj.end != found.end:
                         raise Exception('Removing range {%040x-%040x} is not found in ranges table'%(rm_obj.start, rm_obj.end))
                 else:
-                    found = self.find(rm_obj.end)
+                    found = self.__find(ranges, starts, rm_obj.end)
                     if found and (rm_obj.start != found.start or rm_obj.end != found.end):
                         raise Exception('Removing range {%040x-%040x} is not found in ranges table'%(rm_obj.start, rm_obj.end))
 
+            self.__check_blocked()
+
             #applying new new ranges and remove old
+            changes = []
             for rm_obj in rm_obj_list:
-                self.remove(rm_obj.start)
+                r_obj = self.__remove(ranges, starts, rm_obj.start)
+                if r_obj:
+                    changes.append((OP_REMOVE, r_obj.start, r_obj.end, r_obj.node_address))
 
             for app_obj in ap_obj_list:
-                self.append(app_obj.start, app_obj.end, app_obj.node_address)
+                if self.__append(ranges, starts, app_obj.start, app_obj.end, app_obj.node_address):
+                    changes.append((OP_APPEND, app_obj.start, app_obj.end, app_obj.node_address))
+
+            if changes:
+                self.__commit(ranges, starts, changes)
         finally:
             self.__lock.release()
 
 
-    def __find_int(self, find_value):
-        tr_start = 0
-        tr_end = len(self.__ranges)-1
-        cur_n = int(tr_end/2)
-
-        while True:
-            if tr_start > tr_end:
-                break
-
-            range_obj = self.__ranges[cur_n]
-            if range_obj.start <= find_value <= range_obj.end:
-                break
-
-            if find_value > range_obj.end:
-                tr_start = cur_n + 1
-            else:
-                tr_end = cur_n - 1
-
-            cur_n = int((tr_start + tr_end)/2)
-
-        if tr_start > tr_end:
+    def __find_int(self, ranges, starts, find_value):
+        idx = bisect.bisect_right(starts, find_value) - 1
+        if idx < 0 or ranges[idx].end < find_value:
             return None
-        else:
-            return cur_n
+        return idx
 
+    def __find(self, ranges, starts, find_value):
+        idx = self.__find_int(ranges, starts, find_value)
+        if idx is not None:
+            return ranges[idx]
+        return None
 
     def find(self, find_value):
-        self.__lock.acquire()
-        try:
-            idx = self.__find_int(find_value)
-            if idx is not None:
-                return self.__ranges[idx]
-            return None
-        finally:
-            self.__lock.release()
-
+        snapshot = self.__snapshot
+        return self.__find(snapshot.ranges, snapshot.starts, find_value)
+
+    def find_many(self, keys):
+        '''find ranges for list of keys in one merge pass over table
+        return list of HashRange objects (or None if range is not found)
+        in order of keys
+        '''
+        ranges = self.__snapshot.ranges
+        ret_list = [None] * len(keys)
+        s_keys = sorted((key, i) for i, key in enumerate(keys))
+
+        r_idx = 0
+        r_len = len(ranges)
+        for key, i in s_keys:
+            while r_idx < r_len and ranges[r_idx].end < key:
+                r_idx += 1
+            if r_idx == r_len:
+                break
+            if ranges[r_idx].start <= key:
+                ret_list[i] = ranges[r_idx]
+        return ret_list
 
     def find_next(self, find_value):
-        self.__lock.acquire()
-        try:
-            idx = self.__find_int(find_value)
-            if idx is not None and idx < (len(self.__ranges)-1):
-                return self.__ranges[idx+1]
-            return None
-        finally:
-            self.__lock.release()
+        snapshot = self.__snapshot
+        ranges = snapshot.ranges
+        idx = self.__find_int(ranges, snapshot.starts, find_value)
+        if idx is not None and idx < (len(ranges)-1):
+            return ranges[idx+1]
+        return None
 
     def get_first(self):
-        self.__lock.acquire()
-        try:
-            if self.__ranges:
-                return self.__ranges[0]
-            return None
-        finally:
-            self.__lock.release()
+        ranges = self.__snapshot.ranges
+        if ranges:
+            return ranges[0]
+        return None
 
     def get_end(self):
-        self.__lock.acquire()
-        try:
-            if self.__ranges:
-                return self.__ranges[-1]
-            return None
-        finally:
-            self.__lock.release()
+        ranges = self.__snapshot.ranges
+        if ranges:
+            return ranges[-1]
+        return None
 
     def iter_table(self):
-        self.__lock.acquire()
-        try:
-            for range_obj in self.__ranges:
-                yield range_obj
-        finally:
-            self.__lock.release()
-
+        for range_obj in self.__snapshot.ranges:
+            yield range_obj
 
 
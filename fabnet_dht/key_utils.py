@@ -13,6 +13,7 @@ import hashlib
 from datetime import datetime
 
 FULL_RANGE_LEN = pow(2, 160)
+ZONE_PROBES_COUNT = 8
 
 class KeyUtils:
     @classmethod
@@ -39,6 +40,71 @@ class KeyUtils:
 
         return keys
 
+    @classmethod
+    def get_candidate_keys(cls, key, replica_count, probes=ZONE_PROBES_COUNT):
+        '''return list of candidate keys for every replica
+        first candidate is replica key from get_all_keys,
+        others are distributed over replica segment of the ring'''
+        r_len = FULL_RANGE_LEN / (replica_count + 1)
+        p_len = r_len / probes
+        l_key = long(key, 16)
+        candidates = []
+        for i in xrange(1, replica_count+1):
+            r_key = l_key + r_len * i
+            candidates.append(['%040x' % ((r_key + p_len * j) % FULL_RANGE_LEN) for j in xrange(probes)])
+        return candidates
+
+    @classmethod
+    def get_zone_aware_keys(cls, key, replica_count, ranges_table, node_weights):
+        '''return master key and replica keys owned by nodes from distinct zones
+        for every replica first candidate key (see get_candidate_keys) owned by
+        node from not used zone is selected. If there is no such candidate
+        (or zones are unknown) replica key from get_all_keys is used
+
+        ranges_table - HashRangesTable object
+        node_weights - NodeWeights object with zone labels of nodes
+        '''
+        candidates = cls.get_candidate_keys(key, replica_count)
+        all_keys = [key] + [c_key for r_candidates in candidates for c_key in r_candidates]
+        ranges = ranges_table.find_many([long(c_key, 16) for c_key in all_keys])
+
+        zones = {}
+        for c_key, range_obj in zip(all_keys, ranges):
+            zones[c_key] = node_weights.get_zone(range_obj.node_address) if range_obj else None
+
+        keys = [key]
+        used_zones = set([zones[key]])
+        for r_candidates in candidates:
+            r_key = r_candidates[0]
+            for c_key in r_candidates:
+                if zones[c_key] is not None and zones[c_key] not in used_zones:
+                    r_key = c_key
+                    break
+            used_zones.add(zones[r_key])
+            keys.append(r_key)
+        return keys
+
+    @classmethod
+    def get_fallback_keys(cls, key, replica_count, keys):
+        '''return list of other candidate keys for every replica
+        keys - master key and replica keys from get_zone_aware_keys
+
+        Replica keys depend on ranges table and zones of nodes at the moment
+        of data block saving. Replica that is saved at fallback key is moved
+        to its current key by repair process, till then it can be found
+        at fallback keys of its replica'''
+        ret = []
+        for r_key, r_candidates in zip(keys[1:], cls.get_candidate_keys(key, replica_count)):
+            ret.append([c_key for c_key in r_candidates if c_key != r_key])
+        return ret
+
+    @classmethod
+    def is_replica_key(cls, key, master_key, replica_count):
+        for r_candidates in cls.get_candidate_keys(master_key, replica_count):
+            if key in r_candidates:
+                return True
+        return False
+
     @classmethod
     def to_hex(cls, key):
         if type(key) in (int, long):
@@ -32,6 +32,8 @@ class CheckDataBlockOperation(OperationBase):
         @param packet - object of FabnetPacketRequest class
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
+                responses of metadata check have md_dump=True parameter
+                (this node accepts metadata dumps by PutDataBlock operation)
         """
         key = packet.str_get('key')
         checksum = packet.str_get('checksum', '')
@@ -41,12 +43,15 @@ class CheckDataBlockOperation(OperationBase):
 
         #metadata check
         if dbct in (FSMappedDHTRange.DBCT_MD_MASTER, FSMappedDHTRange.DBCT_MD_REPLICA): 
+            md_params = {'md_dump': True}
             if not os.path.exists(db_path):
-                return FabnetPacketResponse(ret_code=RC_NO_DATA, ret_message='No data found!')
+                return FabnetPacketResponse(ret_code=RC_NO_DATA, ret_message='No data found!', \
+                        ret_parameters=md_params)
             c_checksum = self.operator.user_metadata_call(db_path, 'get_checksum')
             if checksum != c_checksum:
-                return FabnetPacketResponse(ret_code=RC_INVALID_DATA, ret_message='mistmatch checksum')
-            return FabnetPacketResponse()
+                return FabnetPacketResponse(ret_code=RC_INVALID_DATA, ret_message='mistmatch checksum', \
+                        ret_parameters=md_params)
+            return FabnetPacketResponse(ret_parameters=md_params)
 
         #db check
         with DataBlock(db_path) as db:
@@ -16,6 +16,7 @@ from fabnet.core.fri_base import FabnetPacketResponse
 from fabnet.core.constants import RC_OK, RC_ERROR
 from fabnet.utils.logger import oper_logger as logger
 from fabnet.core.constants import NODE_ROLE, CLIENT_ROLE
+from fabnet_dht.constants import RC_NO_DATA
 from fabnet_dht.fs_mapped_ranges import FSMappedDHTRange
 from fabnet_dht.data_block import DataBlockHeader, DataBlock, ThreadSafeDataBlock
 
@@ -40,13 +41,14 @@ class ClientDeleteOperation(OperationBase):
         replica_count = packet.int_get('replica_count')
         KeyUtils.validate(key)
 
-        keys = KeyUtils.generate_new_keys(self.node_name, replica_count, prime_key=key)
+        keys = self.operator.get_replica_keys(key, replica_count)
         errors = []
         if packet.role == NODE_ROLE:
             user_id_hash = packet.str_get('user_id_hash', '')
         else:
             user_id_hash = hashlib.sha1(str(packet.user_id)).hexdigest()
 
+        fallback_keys = [[]] + KeyUtils.get_fallback_keys(key, replica_count, keys)
         for i, key in enumerate(keys):
             cur_dbct = FSMappedDHTRange.DBCT_MASTER if i == 0 else FSMappedDHTRange.DBCT_REPLICA
             h_range = self.operator.find_range(key)
@@ -59,7 +61,12 @@ class ClientDeleteOperation(OperationBase):
                         'user_id_hash': user_id_hash}
 
             resp = self._init_operation(node_address, 'DeleteDataBlock', params, sync=True)
-            if resp.ret_code != RC_OK:
+            if resp.ret_code == RC_NO_DATA and fallback_keys[i]:
+                #replica can be saved with other ranges table or zones of nodes
+                #and not moved by repair process yet, so it is deleted at all
+                #fallback keys in parallel without waiting
+                self.__delete_fallback_blocks(fallback_keys[i], cur_dbct, user_id_hash)
+            elif resp.ret_code != RC_OK:
                 errors.append('DeleteDataBlock failed at %s: %s'%(node_address, resp.ret_message))
 
         if errors:
@@ -69,4 +76,11 @@ class ClientDeleteOperation(OperationBase):
 
         return FabnetPacketResponse(ret_code=ret_code, ret_message='\n'.join(errors))
 
-
+    def __delete_fallback_blocks(self, keys, dbct, user_id_hash):
+        for key, h_range in zip(keys, self.operator.find_ranges(keys)):
+            if not h_range:
+                continue
+            _, _, node_address = h_range
+            params = {'key': key, 'dbct': dbct, 'carefully_delete': True, \
+                        'user_id_hash': user_id_hash}
+            self._init_operation(node_address, 'DeleteDataBlock', params)
@@ -62,7 +62,9 @@ class ClientPutOperation(OperationBase):
         local_save = []
         tmp_db = None
         master_db = None
-        keys = KeyUtils.generate_new_keys(self.node_name, replica_count, prime_key=key)
+        if key is None:
+            key = KeyUtils.generate_key(self.node_name)
+        keys = self.operator.get_replica_keys(key, replica_count)
         try:
             user_id_hash = hashlib.sha1(str(packet.user_id)).hexdigest()
 
@@ -83,9 +85,8 @@ class ClientPutOperation(OperationBase):
             tmp_db.write(db_header.pack(), seek=0)
             size = os.path.getsize(tmp_db_path) - DataBlockHeader.HEADER_LEN
 
-            for i, key in enumerate(keys):
+            for i, (key, h_range) in enumerate(zip(keys, self.operator.find_ranges(keys))):
                 cur_dbct = FSMappedDHTRange.DBCT_MASTER if i == 0 else FSMappedDHTRange.DBCT_REPLICA
-                h_range = self.operator.find_range(key)
                 if not h_range:
                     errors.append('No hash range found for key=%s!'%key)
                     continue
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+"""
+Copyright (C) 2014 Konstantin Andrusenko
+    See the documentation for further information on copyrights,
+    or contact the author. All Rights Reserved.
+
+@package fabnet_dht.operations.commit_object
+
+@author Konstantin Andrusenko
+@date June 18, 2014
+"""
+import hashlib
+from fabnet.core.operation_base import  OperationBase
+from fabnet.core.fri_base import FabnetPacketResponse
+from fabnet.core.constants import RC_OK, RC_ERROR
+from fabnet.utils.logger import oper_logger as logger
+from fabnet.core.constants import CLIENT_ROLE
+
+from fabnet_dht.key_utils import KeyUtils
+
+class CommitObjectOperation(OperationBase):
+    ROLES = [CLIENT_ROLE]
+    NAME = 'CommitObject'
+
+    def process(self, packet):
+        """
+        @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * obj_path - path to object in user metadata
+                * data_blocks - list of (db_key, replica_count, seek, size)
+                  of already saved (with ClientPutData operation) object parts
+        @return object of FabnetPacketResponse
+                or None for disabling packet response to sender
+        """
+        obj_path = packet.str_get('obj_path')
+        data_blocks = packet.parameters.get('data_blocks', [])
+        for db_key, _, _, _ in data_blocks:
+            KeyUtils.validate(db_key)
+
+        user_id_hash = hashlib.sha1(str(packet.user_id)).hexdigest()
+        h_range = self.operator.find_range(user_id_hash)
+        if not h_range:
+            return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='No hash range found for key=%s!'%user_id_hash)
+
+        add_list = [(obj_path, [tuple(db) for db in data_blocks])]
+        params = {'user_id_hash': user_id_hash, 'add_list': add_list, 'rm_list': []}
+        _, _, node_address = h_range
+
+        resp = self._init_operation(node_address, 'UpdateMetadata', params, sync=True)
+        if resp.ret_code != RC_OK:
+            logger.warning('CommitObject %s failed: %s'%(obj_path, resp.ret_message))
+            return FabnetPacketResponse(ret_code=resp.ret_code, \
+                    ret_message='UpdateMetadata failed at %s: %s'%(node_address, resp.ret_message))
+
+        return FabnetPacketResponse()
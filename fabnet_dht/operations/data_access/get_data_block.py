@@ -9,13 +9,14 @@ Copyright (C) 2012 Konstantin Andrusenko
 @author Konstantin Andrusenko
 @date October 3, 2012
 """
+import os
 import hashlib
 from fabnet.core.operation_base import  OperationBase
 from fabnet.core.fri_base import FabnetPacketResponse
 from fabnet.core.constants import RC_OK, RC_ERROR, RC_PERMISSION_DENIED
 from fabnet.core.constants import NODE_ROLE, CLIENT_ROLE
 
-from fabnet_dht.constants import RC_NO_DATA
+from fabnet_dht.constants import RC_NO_DATA, RC_NOT_MY_RANGE
 from fabnet.core.fri_base import FileBasedChunks
 from fabnet_dht.fs_mapped_ranges import FSMappedDHTRange, FSHashRangesNoData
 from fabnet_dht.data_block import DataBlockHeader, DataBlock, ThreadSafeDataBlock
@@ -46,6 +47,10 @@ class GetDataBlockOperation(OperationBase):
             db_path = self.operator.get_db_path(key, dbct)
             db = DataBlock(db_path)
             if not db.exists():
+                if packet.role == CLIENT_ROLE and not self._is_local_key(key):
+                    db.close()
+                    return FabnetPacketResponse(ret_code=RC_NOT_MY_RANGE, \
+                            ret_message='Key %s is not in my range'%key)
                 raise FSHashRangesNoData('No data found!')
 
             raw = db.get_next_chunk(DataBlockHeader.HEADER_LEN)
@@ -53,7 +58,8 @@ class GetDataBlockOperation(OperationBase):
             if user_id_hash:
                 header.match(user_id_hash=user_id_hash)
 
-            return FabnetPacketResponse(binary_data=db, ret_parameters={'checksum': header.checksum})
+            size = os.path.getsize(db_path) - DataBlockHeader.HEADER_LEN
+            return FabnetPacketResponse(binary_data=db, ret_parameters={'checksum': header.checksum, 'size': size})
         except Exception, err:
             if db:
                 db.close()
@@ -63,6 +69,13 @@ class GetDataBlockOperation(OperationBase):
                 return FabnetPacketResponse(ret_code=RC_NO_DATA, ret_message='No data found')
             return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='Unexpected error: %s'%err)
 
+    def _is_local_key(self, key):
+        h_range = self.operator.find_range(key)
+        if not h_range:
+            return False
+        _, _, node_address = h_range
+        return node_address == self.self_address
+
 
     def callback(self, packet, sender=None):
         """In this method should be implemented logic of processing
@@ -30,6 +30,13 @@ class GetKeysInfoOperation(OperationBase):
         reuqest packet from sender node
 
         @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * key - (optional) master key of data block, new key is generated if not passed
+                * replica_count - replica count of data block (if key is passed)
+                * zone - (optional) zone of client, keys owned by nodes
+                  from this zone are returned first (for reading)
+                * lookup_keys - (optional) if True, fallback keys of replicas
+                  (see KeyUtils.get_fallback_keys) are returned after replica keys
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
         """
@@ -42,23 +49,37 @@ class GetKeysInfoOperation(OperationBase):
                 return FabnetPacketResponse(ret_code=RC_ERROR,
                         ret_message='Replica count should be passed to GetKeysInfo operation')
 
-            keys = KeyUtils.get_all_keys(key, replica_count)
+            keys = self.operator.get_replica_keys(key, replica_count)
+            fallback_keys = []
+            if packet.bool_get('lookup_keys', False):
+                for f_keys in KeyUtils.get_fallback_keys(key, replica_count, keys):
+                    fallback_keys += f_keys
         else:
             key = KeyUtils.generate_key(self.node_name)
             keys = [key]
+            fallback_keys = []
 
         msg = ''
         ret_keys = []
-        for i, key in enumerate(keys):
+        long_keys = [KeyUtils.validate(key) for key in keys]
+        for i, (key, range_obj) in enumerate(zip(keys, self.operator.find_ranges(long_keys))):
             cur_dbct = FSMappedDHTRange.DBCT_MASTER if i == 0 else FSMappedDHTRange.DBCT_REPLICA
-            long_key = KeyUtils.validate(key)
-            range_obj = self.operator.find_range(long_key)
             if not range_obj:
                 msg += '[GetKeysInfoOperation] Internal error: No hash range found for key=%s! \n'%key
             else:
                 _, _, node_address = range_obj
                 ret_keys.append((key, cur_dbct, node_address))
 
+        zone = packet.parameters.get('zone', None)
+        if zone:
+            ret_keys = self.operator.sort_by_zone(ret_keys, zone)
+
+        f_long_keys = [long(f_key, 16) for f_key in fallback_keys]
+        for f_key, range_obj in zip(fallback_keys, self.operator.find_ranges(f_long_keys)):
+            if range_obj:
+                _, _, node_address = range_obj
+                ret_keys.append((f_key, FSMappedDHTRange.DBCT_REPLICA, node_address))
+
         return FabnetPacketResponse(ret_parameters={'keys_info': ret_keys}, ret_message=msg)
 
 
@@ -32,6 +32,13 @@ class GetObjectInfoOperation(OperationBase):
         reuqest packet from sender node
 
         @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * obj_path - path to object in user metadata
+                * req_user_info - (optional) return user info if True
+                * limit - (optional) max count of directory children in response.
+                  If directory has more children, continuation token is returned
+                  in path_info['cursor']
+                * cursor - (optional) continuation token from previous response
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
         """
@@ -39,6 +46,8 @@ class GetObjectInfoOperation(OperationBase):
         req_user_info = packet.bool_get('req_user_info', False)
         replica_count = packet.int_get('md_replica_count', MIN_REPLICA_COUNT)
         get_key = packet.str_get('get_key', '')
+        limit = packet.int_get('limit', 0)
+        cursor = packet.str_get('cursor', '')
 
         if packet.role == NODE_ROLE:
             user_id_hash = packet.str_get('user_id_hash', '')
@@ -59,7 +68,7 @@ class GetObjectInfoOperation(OperationBase):
             _, _, node_address = h_range
             if self.self_address == node_address:
                 try:
-                    p_info = self.get_path_info(key, cur_dbct, o_path, req_user_info)
+                    p_info = self.get_path_info(key, cur_dbct, o_path, req_user_info, limit, cursor)
                     return FabnetPacketResponse(ret_parameters=p_info)
                 except Exception, err:
                     errors.append(str(err))
@@ -76,7 +85,7 @@ class GetObjectInfoOperation(OperationBase):
 
         return FabnetPacketResponse(ret_code=RC_ERROR, ret_message = '\n'.join(errors))
 
-    def get_path_info(self, key, dbct, o_path, req_user_info):
+    def get_path_info(self, key, dbct, o_path, req_user_info, limit=0, cursor=None):
         resp = {}
         db_path = self.operator.get_db_path(key, dbct)
         if req_user_info:
@@ -87,7 +96,7 @@ class GetObjectInfoOperation(OperationBase):
             user_info_d['flags'] = user_info.flags
             resp['user_info'] = user_info_d
 
-        path_info = self.operator.user_metadata_call(db_path, 'get_path_info', o_path)
+        path_info = self.operator.user_metadata_call(db_path, 'get_path_info', o_path, limit, cursor)
         resp['path_info'] = path_info.to_dict()
         
         if path_info.path_type == 'file':
@@ -33,6 +33,9 @@ class PutDataBlockOperation(OperationBase):
         reuqest packet from sender node
 
         @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * md_dump - (optional) if True, user metadata is sent as dump,
+                  else as zip archive of metadata directory
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
         """
@@ -43,6 +46,7 @@ class PutDataBlockOperation(OperationBase):
         carefully_save = packet.bool_get('carefully_save', False)
         user_id_hash = packet.str_get('user_id_hash', '')
         stored_unixtime = packet.parameters.get('stored_unixtime', None)
+        md_dump = packet.bool_get('md_dump', False) #metadata is sent as dump (see MDDump)
 
         if not packet.binary_data:
             return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='Binary data does not found!')
@@ -66,10 +70,16 @@ class PutDataBlockOperation(OperationBase):
                         db.block()
                         db.get_header().match(user_id_hash=user_id_hash, stored_dt=stored_unixtime)
 
-                if dbct in (FSMappedDHTRange.DBCT_MD_MASTER, FSMappedDHTRange.DBCT_MD_REPLICA):
+                if dbct in (FSMappedDHTRange.DBCT_MD_MASTER, FSMappedDHTRange.DBCT_MD_REPLICA) and md_dump:
+                    tmp = tempfile.NamedTemporaryFile(suffix='.mdd')
+                    with DataBlock(tmp.name) as tmp_db:
+                        tmp_db.write(data, iterate=True)
+                    self.operator.import_metadata(db_path, tmp.name)
+                elif dbct in (FSMappedDHTRange.DBCT_MD_MASTER, FSMappedDHTRange.DBCT_MD_REPLICA):
                     tmp = tempfile.NamedTemporaryFile(suffix='.zip')
                     with DataBlock(tmp.name) as tmp_db:
                         tmp_db.write(data, iterate=True)
+                    self.operator.reinit_metadata(db_path)
                     os.system('rm -rf %s && mkdir -p %s && cd %s && unzip %s'%(db_path, db_path, db_path, tmp.name))
                 else:
                     db.write(data, iterate=True)
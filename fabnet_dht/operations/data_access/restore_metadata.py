@@ -41,20 +41,26 @@ class RestoreMetadataOperation(OperationBase):
         dbct = packet.str_get('dbct', FSMappedDHTRange.DBCT_MD_REPLICA)
 
         db_path = self.operator.get_db_path(key, dbct)
-        self.operator.reinit_metadata(db_path)
         user_info = self.operator.user_metadata_call(db_path, 'get_user_info')
         if not user_info.storage_size:
             return FabnetPacketResponse(ret_code=RC_MD_NOTINIT, ret_message='MD is not initialized')
 
-        tmp = tempfile.NamedTemporaryFile(suffix='.zip')
+        tmp = tempfile.NamedTemporaryFile(suffix='.mdd')
         try:
-            os.system('rm -f %s && cd %s && zip -r %s *'%(tmp.name, db_path, tmp.name))
-            path = tmp.name
-            params = {'key': user_id_hash, 'dbct': FSMappedDHTRange.DBCT_MD_MASTER, 'init_block': False}
             h_range = self.operator.find_range(user_id_hash)
             if not h_range:
                 return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='No hash range found for key %s!'%key)    
             _, _, node_address = h_range
+
+            #nodes of previous versions do not report md_dump and accept zip archives only
+            resp = self._init_operation(node_address, 'CheckDataBlock', \
+                    {'key': user_id_hash, 'dbct': FSMappedDHTRange.DBCT_MD_MASTER}, sync=True)
+            md_dump = bool((resp.ret_parameters or {}).get('md_dump', False))
+
+            self.operator.pack_metadata(db_path, tmp.name, md_dump)
+            path = tmp.name
+            params = {'key': user_id_hash, 'dbct': FSMappedDHTRange.DBCT_MD_MASTER, \
+                    'init_block': False, 'md_dump': md_dump}
             tmp_db = ThreadSafeDataBlock(path)
             resp = self._init_operation(node_address, 'PutDataBlock', params, sync=True, binary_data=tmp_db.chunks())
             return resp
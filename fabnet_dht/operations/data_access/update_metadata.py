@@ -56,7 +56,7 @@ class UpdateMetadataOperation(OperationBase):
                 logger.info('User metadata %s does not initialized! Trying to restore from repicas...'%user_id_hash)
                 for _ in self.try_restore_from_replicas(user_id_hash):
                     try:
-                        return self.try_update(user_id_hash, key, add_list, rm_list, packet, reinit_md=True)
+                        return self.try_update(user_id_hash, key, add_list, rm_list, packet)
                     except MDNotInit:
                         pass
 
@@ -67,7 +67,7 @@ class UpdateMetadataOperation(OperationBase):
             traceback.print_exc(file=logger)
             return FabnetPacketResponse(ret_code=RC_ERROR, ret_message=str(err))
 
-    def try_update(self, user_id_hash, key, add_list, rm_list, packet, reinit_md=False):
+    def try_update(self, user_id_hash, key, add_list, rm_list, packet):
         if not key:
             keys = KeyUtils.get_all_keys(user_id_hash, MIN_REPLICA_COUNT)
             h_range = self.operator.find_range(user_id_hash)
@@ -82,17 +82,13 @@ class UpdateMetadataOperation(OperationBase):
             KeyUtils.validate(key)
             db_path = self.operator.get_db_path(key, FSMappedDHTRange.DBCT_MD_REPLICA)
 
-        if reinit_md:
-            self.operator.reinit_metadata(db_path)
-    
-        for rm_f_path in rm_list:
-            self.operator.user_metadata_call(db_path, 'remove_path', rm_f_path)
-
+        md_add_list = []
         for f_path, dbs in add_list:
             dbs_ol = []
             for db in dbs:
                 dbs_ol.append(MDDataBlockInfo(db[0], db[1], db[2], db[3]))
-            self.operator.user_metadata_call(db_path, 'update_path', f_path, dbs_ol)
+            md_add_list.append((f_path, dbs_ol))
+        self.operator.user_metadata_call(db_path, 'update', md_add_list, rm_list)
 
         if not key:
             for key in keys[1:]:
@@ -9,8 +9,6 @@ Copyright (C) 2012 Konstantin Andrusenko
 @author Konstantin Andrusenko
 @date October 3, 2012
 """
-from datetime import datetime
-import time
 
 from fabnet.core.operation_base import  OperationBase
 from fabnet.core.fri_base import FabnetPacketResponse
@@ -24,19 +22,27 @@ class CheckHashRangeTableOperation(OperationBase):
     ROLES = [NODE_ROLE]
     NAME = 'CheckHashRangeTable'
 
-    def _get_ranges_table(self, from_addr, mod_index, ranges_count, force=False):
-        for i in xrange(self.operator.get_config_value('RANGES_TABLE_FLAPPING_TIMEOUT')):
-            if force:
-                break
-            c_mod_index, c_ranges_count, _ = self.operator.get_ranges_table_status()
-            if c_ranges_count == 0:
-                break
-            if c_mod_index == mod_index and ranges_count == c_ranges_count:
-                return
-            time.sleep(1)
+    def _get_ranges_table(self, from_addr, mod_index, ranges_count, force=False, checksum=None):
+        def is_converged(snapshot):
+            return snapshot.mod_index == mod_index and len(snapshot.ranges) == ranges_count \
+                    and checksum in (None, '%040x'%snapshot.checksum)
+
+        if not force:
+            #waiting while ranges table is changed by broadcasted updates
+            if self.operator.wait_ranges_table(lambda snapshot: (not snapshot.ranges) or is_converged(snapshot), \
+                        float(self.operator.get_config_value('RANGES_TABLE_FLAPPING_TIMEOUT'))):
+                _, c_ranges_count, _, _ = self.operator.get_ranges_table_status()
+                if c_ranges_count:
+                    return
+
+        c_mod_index, c_ranges_count, _, _ = self.operator.get_ranges_table_status()
+        params = {}
+        if not force and c_ranges_count:
+            #only changes after local mod_index are requested
+            params['mod_index'] = c_mod_index
 
         logger.info('Ranges table is invalid! Requesting table from %s'% from_addr)
-        self._init_operation(from_addr, 'GetRangesTable', {})
+        self._init_operation(from_addr, 'GetRangesTable', params)
 
     def process(self, packet):
         """In this method should be implemented logic of processing
@@ -46,6 +52,8 @@ class CheckHashRangeTableOperation(OperationBase):
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
         """
+        self.operator.merge_node_weights(packet.parameters.get('node_weights', {}))
+
         if self.operator.get_status() == DS_INITIALIZE:
             return FabnetPacketResponse(ret_code=RC_OK, ret_message='Node is not initialized yet!')
 
@@ -65,19 +73,26 @@ class CheckHashRangeTableOperation(OperationBase):
         if range_end is None:
             raise Exception('range_end parameter is expected for CheckHashRangeTable operation')
 
-        c_mod_index, c_ranges_count, _ = self.operator.get_ranges_table_status()
+        #checksum is not sent by old nodes
+        f_checksum = packet.parameters.get('checksum', None)
+
+        c_mod_index, c_ranges_count, _, c_checksum = self.operator.get_ranges_table_status()
+        need_update_params = {'mod_index': c_mod_index, 'ranges_count': c_ranges_count, 'checksum': c_checksum}
 
         found_range = self._find_range(range_start, range_end, packet.sender)
-        if not found_range:
-            logger.debug('CheckHashRangeTable: sender range does not found in local hash table...')
+        diverged = ranges_count == c_ranges_count and c_mod_index == f_mod_index \
+                    and f_checksum is not None and f_checksum != c_checksum
+        if diverged:
+            logger.debug('CheckHashRangeTable: ranges tables have same mod_index but different checksum...')
+        if (not found_range) or diverged:
+            if not found_range:
+                logger.debug('CheckHashRangeTable: sender range does not found in local hash table...')
             if ranges_count < c_ranges_count:
-                return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, \
-                        ret_parameters={'mod_index': c_mod_index, 'ranges_count': c_ranges_count})
+                return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, ret_parameters=need_update_params)
             elif ranges_count == c_ranges_count and c_mod_index == f_mod_index:
                 if packet.sender > self.self_address:
-                    return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, \
-                        ret_parameters={'mod_index': c_mod_index, 'ranges_count': c_ranges_count,
-                                        'force': True})
+                    need_update_params['force'] = True
+                    return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, ret_parameters=need_update_params)
                 elif packet.sender < self.self_address:
                     return FabnetPacketResponse(ret_code=RC_JUST_WAIT)
 
@@ -85,8 +100,7 @@ class CheckHashRangeTableOperation(OperationBase):
         if f_mod_index >= c_mod_index:
             return FabnetPacketResponse()
         else:
-            return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, \
-                    ret_parameters={'mod_index': c_mod_index, 'ranges_count': c_ranges_count})
+            return FabnetPacketResponse(ret_code=RC_NEED_UPDATE, ret_parameters=need_update_params)
 
     def _find_range(self, range_start, range_end, sender):
         h_range = self.operator.find_range(range_start)
@@ -118,7 +132,10 @@ class CheckHashRangeTableOperation(OperationBase):
 
         if packet.ret_code == RC_DONT_STARTED:
             self.operator.remove_node_range(packet.from_node)
-            time.sleep(self.operator.get_config_value('WAIT_DHT_TABLE_UPDATE'))
+            #waiting while range of stopped node is removed from ranges table
+            self.operator.wait_ranges_table(lambda snapshot: \
+                    packet.from_node not in [r.node_address for r in snapshot.ranges], \
+                    float(self.operator.get_config_value('WAIT_DHT_TABLE_UPDATE')))
             self.operator.check_near_range()
 
         elif packet.ret_code == RC_OK:
@@ -132,7 +149,8 @@ class CheckHashRangeTableOperation(OperationBase):
 
         elif packet.ret_code == RC_NEED_UPDATE:
             self._get_ranges_table(packet.from_node, packet.ret_parameters['mod_index'], \
-                    packet.ret_parameters['ranges_count'], packet.ret_parameters.get('force', False))
+                    packet.ret_parameters['ranges_count'], packet.ret_parameters.get('force', False), \
+                    packet.ret_parameters.get('checksum', None))
 
         elif packet.ret_code == RC_JUST_WAIT:
             if self.operator.get_status() == DS_PREINIT:
@@ -48,6 +48,6 @@ class GetRangeDataRequestOperation(OperationBase):
         """
         if packet.ret_code != RC_OK:
             logger.info('GetRangeData failed "%s"! Trying select other hash range...'%packet.ret_message)
-            self.operator.start_as_dht_member()
+            self.operator.on_range_request_failed()
         else:
-            self.operator.set_status_to_normalwork(True) #with save_range=True
+            self.operator.on_range_accepted()
@@ -11,13 +11,14 @@ Copyright (C) 2012 Konstantin Andrusenko
 """
 from fabnet.core.operation_base import  OperationBase
 from fabnet.core.fri_base import FabnetPacketResponse
-from fabnet.core.constants import RC_ERROR, RC_OK, NODE_ROLE
+from fabnet.core.constants import RC_ERROR, RC_OK, NODE_ROLE, CLIENT_ROLE
 from fabnet.utils.logger import oper_logger as logger
 
 from fabnet_dht.constants import DS_INITIALIZE
+from fabnet_dht.hash_ranges_table import RangeException
 
 class GetRangesTableOperation(OperationBase):
-    ROLES = [NODE_ROLE]
+    ROLES = [NODE_ROLE, CLIENT_ROLE]
     NAME = 'GetRangesTable'
 
     def process(self, packet):
@@ -25,17 +26,31 @@ class GetRangesTableOperation(OperationBase):
         reuqest packet from sender node
 
         @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * mod_index - (optional) mod index of requestor ranges table.
+                  If passed and changes history contains all changes after it,
+                  only these changes are sent instead of full ranges table
         @return object of FabnetPacketResponse
                 or None for disabling packet response to sender
         """
         if self.operator.get_status() == DS_INITIALIZE:
             return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='Node is not initialized yet!')
 
+        mod_index = packet.parameters.get('mod_index', None)
+        if mod_index is not None:
+            changes_log = self.operator.get_ranges_table_changes(mod_index)
+            if changes_log is not None:
+                changes, c_mod_index, checksum = changes_log
+                logger.info('Sending %s ranges table changes to %s'%(len(changes), packet.sender))
+                return FabnetPacketResponse(ret_parameters={'changes': changes, \
+                                    'mod_index': c_mod_index, 'checksum': checksum})
+
         ranges_table = self.operator.dump_ranges_table()
 
         logger.info('Sending ranges table to %s'%packet.sender)
 
-        return FabnetPacketResponse(ret_parameters={'ranges_table': ranges_table})
+        return FabnetPacketResponse(ret_parameters={'ranges_table': ranges_table, \
+                                    'node_weights': self.operator.node_weights.dump()})
 
     def callback(self, packet, sender=None):
         """In this method should be implemented logic of processing
@@ -52,10 +67,23 @@ class GetRangesTableOperation(OperationBase):
             logger.info('[GetRangesTableCallback] Node %s does not initialized yet...'%packet.from_node)
             return
 
-        logger.info('Recevied ranges table')
+        if 'changes' in packet.ret_parameters:
+            logger.info('Recevied ranges table changes')
+            try:
+                prev_ranges_count = self.operator.apply_ranges_table_log(packet.ret_parameters['changes'], \
+                        packet.ret_parameters['mod_index'], packet.ret_parameters['checksum'])
+            except RangeException, err:
+                logger.info('Ranges table changes are not applied (%s). Requesting full table from %s'% \
+                                (err, packet.from_node))
+                self._init_operation(packet.from_node, 'GetRangesTable', {})
+                return
+            logger.info('Ranges table changes are applied to fabnet node')
+        else:
+            logger.info('Recevied ranges table')
+            self.operator.merge_node_weights(packet.ret_parameters.get('node_weights', {}))
 
-        prev_ranges_count = self.operator.restore_ranges_table(str(packet.ret_parameters['ranges_table']))
-        logger.info('Ranges table is loaded to fabnet node')
+            prev_ranges_count = self.operator.restore_ranges_table(str(packet.ret_parameters['ranges_table']))
+            logger.info('Ranges table is loaded to fabnet node')
 
         #prev_ranges_count == 1 --- first DHT communicate 
         if (self.operator.get_status() == DS_INITIALIZE) or (prev_ranges_count == 1):
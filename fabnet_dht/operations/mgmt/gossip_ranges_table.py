@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""
+Copyright (C) 2014 Konstantin Andrusenko
+    See the documentation for further information on copyrights,
+    or contact the author. All Rights Reserved.
+
+@package fabnet_dht.operations.mgmt.gossip_ranges_table
+
+@author Konstantin Andrusenko
+@date June 22, 2014
+"""
+from fabnet.core.operation_base import  OperationBase
+from fabnet.core.fri_base import FabnetPacketResponse
+from fabnet.core.constants import RC_OK, RC_ERROR, NODE_ROLE
+from fabnet.utils.logger import oper_logger as logger
+
+from fabnet_dht.constants import DS_INITIALIZE, DS_DESTROYING
+
+class GossipRangesTableOperation(OperationBase):
+    ROLES = [NODE_ROLE]
+    NAME = 'GossipRangesTable'
+
+    def process(self, packet):
+        """In this method should be implemented logic of processing
+        reuqest packet from sender node
+
+        @param packet - object of FabnetPacketRequest class
+            packet.parameters description:
+                * version_vector - {origin node: last applied change seq} of sender
+                * rumors - (optional) list of ranges table changes pushed by sender
+                * node_weights - (optional) capacity weights of DHT nodes known by sender
+        @return object of FabnetPacketResponse
+                or None for disabling packet response to sender
+        """
+        if self.operator.get_status() in (DS_INITIALIZE, DS_DESTROYING):
+            return FabnetPacketResponse(ret_code=RC_ERROR, ret_message='Node is not initialized yet!')
+
+        remote_vv = packet.parameters.get('version_vector', None)
+        if remote_vv is None:
+            raise Exception('version_vector parameter is expected for GossipRangesTable operation')
+
+        self.operator.ranges_gossip.merge_own_seq(remote_vv)
+        self.operator.apply_ranges_rumors(packet.parameters.get('rumors', []))
+        self.operator.merge_node_weights(packet.parameters.get('node_weights', {}))
+        node_weights = self.operator.node_weights.dump()
+
+        local_vv, rumors = self.operator.get_missing_rumors(remote_vv)
+        if rumors is None:
+            logger.info('Changes log is truncated. Sending ranges table to %s'%packet.sender)
+            return FabnetPacketResponse(ret_parameters={'version_vector': local_vv, \
+                            'ranges_table': self.operator.dump_ranges_table(), 'node_weights': node_weights})
+
+        return FabnetPacketResponse(ret_parameters={'version_vector': local_vv, 'rumors': rumors, \
+                            'node_weights': node_weights})
+
+    def callback(self, packet, sender=None):
+        """In this method should be implemented logic of processing
+        response packet from requested node
+
+        @param packet - object of FabnetPacketResponse class
+        @param sender - address of sender node.
+        If sender == None then current node is operation initiator
+        @return object of FabnetPacketResponse
+                that should be resended to current node requestor
+                or None for disabling packet resending
+        """
+        if packet.ret_code != RC_OK:
+            logger.debug('GossipRangesTable failed on %s: %s'%(packet.from_node, packet.ret_message))
+            return
+
+        if self.operator.get_status() == DS_DESTROYING:
+            return
+
+        remote_vv = packet.ret_parameters['version_vector']
+        self.operator.ranges_gossip.merge_own_seq(remote_vv)
+        self.operator.merge_node_weights(packet.ret_parameters.get('node_weights', {}))
+        if 'ranges_table' in packet.ret_parameters:
+            self.operator.restore_ranges_gossip(str(packet.ret_parameters['ranges_table']), remote_vv)
+        else:
+            self.operator.apply_ranges_rumors(packet.ret_parameters.get('rumors', []))
+
+        #push changes that remote node does not know
+        local_vv, rumors = self.operator.get_missing_rumors(remote_vv)
+        if rumors:
+            params = {'version_vector': local_vv, 'rumors': rumors}
+            self._init_operation(packet.from_node, 'GossipRangesTable', params)
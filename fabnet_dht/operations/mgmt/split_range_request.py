@@ -60,7 +60,7 @@ class SplitRangeRequestOperation(OperationBase):
         if packet.ret_code != RC_OK:
             logger.error('Cant split range from %s. Details: %s'%(sender, packet.ret_message))
             logger.info('SplitRangeRequest failed! Trying select other hash range...')
-            self.operator.start_as_dht_member()
+            self.operator.on_range_request_failed()
         else:
             subrange_size = int(packet.ret_parameters['range_size'])
             self.operator.accept_foreign_subrange(packet.from_node, subrange_size)
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+"""
+Copyright (C) 2014 Konstantin Andrusenko
+    See the documentation for further information on copyrights,
+    or contact the author. All Rights Reserved.
+
+@package fabnet_dht.ranges_gossip
+
+@author Konstantin Andrusenko
+@date June 22, 2014
+"""
+import time
+import threading
+import collections
+
+GOSSIP_LOG_SIZE = 1024
+
+
+class RangesGossip:
+    '''state of epidemic dissemination of ranges table changes
+
+    every ranges table change is a rumor (origin, seq, rm_list, append_list)
+    where seq is sequence number of change at origin node.
+    Version vector {origin: last applied seq} describes which changes
+    are already applied to local ranges table, so two nodes can find
+    missed changes by exchange of their version vectors only
+
+    Version vector orders changes from the same origin only. Concurrent changes
+    from different origins can be applied in different order on different nodes,
+    so ranges tables can diverge. Such divergence is not resolved by gossip,
+    it is found by checksum of ranges table in CheckHashRangeTable operation
+    and ranges table is reloaded from other node
+    '''
+    def __init__(self, self_address, log_size=GOSSIP_LOG_SIZE):
+        self.__self_address = self_address
+        self.__lock = threading.Lock()
+        self.__vv = {}
+        self.__log = collections.deque(maxlen=log_size)
+
+    def get_version_vector(self):
+        self.__lock.acquire()
+        try:
+            return dict(self.__vv)
+        finally:
+            self.__lock.release()
+
+    def new_rumor(self, rm_list, append_list):
+        '''register ranges table change made by this node'''
+        self.__lock.acquire()
+        try:
+            seq = self.__vv.get(self.__self_address, 0) + 1
+            rumor = (self.__self_address, seq, rm_list, append_list)
+            self.__vv[self.__self_address] = seq
+            self.__log.append(rumor)
+            return rumor
+        finally:
+            self.__lock.release()
+
+    def is_next(self, rumor):
+        '''return True if rumor is next change from its origin and should be applied'''
+        self.__lock.acquire()
+        try:
+            return rumor[1] == self.__vv.get(rumor[0], 0) + 1
+        finally:
+            self.__lock.release()
+
+    def accept(self, rumor):
+        '''register received rumor, it should be called after rumor is applied
+        return True if rumor is next change from its origin
+        return False for already known rumors and for rumors after gap'''
+        origin, seq = rumor[0], rumor[1]
+        self.__lock.acquire()
+        try:
+            if seq != self.__vv.get(origin, 0) + 1:
+                return False
+            self.__vv[origin] = seq
+            self.__log.append(tuple(rumor))
+            return True
+        finally:
+            self.__lock.release()
+
+    def merge_own_seq(self, remote_vv):
+        '''changes made by this node before restart are known by others,
+        so own changes sequence is continued from seq in remote_vv.
+        It should be called for every received version vector'''
+        self.__lock.acquire()
+        try:
+            remote_own_seq = remote_vv.get(self.__self_address, 0)
+            if remote_own_seq > self.__vv.get(self.__self_address, 0):
+                self.__vv[self.__self_address] = remote_own_seq
+        finally:
+            self.__lock.release()
+
+    def get_missing(self, remote_vv):
+        '''return list of rumors that are not applied at node with remote_vv
+        return None if some of these rumors are already dropped from log'''
+        self.__lock.acquire()
+        try:
+            first_seqs = {}
+            for rumor in self.__log:
+                first_seqs.setdefault(rumor[0], rumor[1])
+
+            for origin, seq in self.__vv.items():
+                remote_seq = remote_vv.get(origin, 0)
+                if seq > remote_seq and first_seqs.get(origin, seq+1) > remote_seq + 1:
+                    return None
+
+            return [rumor for rumor in self.__log if rumor[1] > remote_vv.get(rumor[0], 0)]
+        finally:
+            self.__lock.release()
+
+    def reset(self, remote_vv):
+        '''ranges table is loaded from node with remote_vv
+        return list of known rumors that are not applied in loaded table.
+        Received rumors are removed from log and should be accepted again
+        after they are applied, own rumors are counted in version vector already'''
+        self.__lock.acquire()
+        try:
+            own_seq = self.__vv.get(self.__self_address, 0)
+            self.__vv = dict(remote_vv)
+            self.__vv[self.__self_address] = max(own_seq, remote_vv.get(self.__self_address, 0))
+
+            ret_list = []
+            log = []
+            for rumor in self.__log:
+                if rumor[1] > remote_vv.get(rumor[0], 0):
+                    ret_list.append(rumor)
+                    if rumor[0] != self.__self_address:
+                        continue
+                log.append(rumor)
+            self.__log.clear()
+            self.__log.extend(log)
+            return ret_list
+        finally:
+            self.__lock.release()
+
+
+class NodeWeights:
+    '''capacity weights and zone labels advertised by DHT nodes
+    {node address: (weight, version, zone)}, version is changed by node itself only,
+    so weights can be merged from any source in any order
+    '''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__weights = {}
+
+    def update(self, node_address, weight, zone=None):
+        self.__lock.acquire()
+        try:
+            version = self.__weights.get(node_address, (None, 0, None))[1]
+            self.__weights[node_address] = (weight, max(time.time(), version + 1), zone)
+        finally:
+            self.__lock.release()
+
+    def merge(self, weights):
+        self.__lock.acquire()
+        try:
+            for node_address, item in weights.items():
+                weight, version = item[:2]
+                zone = item[2] if len(item) > 2 else None
+                c_version = self.__weights.get(node_address, (None, 0, None))[1]
+                if version > c_version:
+                    self.__weights[node_address] = (weight, version, zone)
+        finally:
+            self.__lock.release()
+
+    def get(self, node_address, default=None):
+        self.__lock.acquire()
+        try:
+            return self.__weights.get(node_address, (default, 0, None))[0]
+        finally:
+            self.__lock.release()
+
+    def get_zone(self, node_address):
+        self.__lock.acquire()
+        try:
+            return self.__weights.get(node_address, (None, 0, None))[2]
+        finally:
+            self.__lock.release()
+
+    def dump(self):
+        self.__lock.acquire()
+        try:
+            return dict(self.__weights)
+        finally:
+            self.__lock.release()
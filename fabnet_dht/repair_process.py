@@ -63,36 +63,40 @@ class RepairProcess:
 
     def repair_process(self, params):
         self.__init_stat(params)
-        dht_range = self.operator.get_dht_range()
+        local_ranges = self.operator.get_local_ranges()
 
         logger.info('[RepairDataBlocks] Processing DHT range...')
-        for key, dbct, path in dht_range.iterator([FSMappedDHTRange.DBCT_MASTER, FSMappedDHTRange.DBCT_REPLICA]):
-            if (key, dbct) in self.__local_moved:
-                continue
-            self.__process_data_block(key, path, dbct)
+        for dht_range in local_ranges:
+            for key, dbct, path in dht_range.iterator([FSMappedDHTRange.DBCT_MASTER, FSMappedDHTRange.DBCT_REPLICA]):
+                if (key, dbct) in self.__local_moved:
+                    continue
+                self.__process_data_block(key, path, dbct)
         logger.info('[RepairDataBlocks] DHT range is processed!')
 
         logger.info('[RepairDataBlocks] Processing users metadata range...')
-        for key, dbct, path in dht_range.iterator(FSMappedDHTRange.DBCT_MD_MASTER):
-            logger.info('PROCESS %s %s'%(dbct, path))
-            if (key, dbct) in self.__local_moved:
-                continue
-            self.__process_md_block(key, path)
+        for dht_range in local_ranges:
+            for key, dbct, path in dht_range.iterator(FSMappedDHTRange.DBCT_MD_MASTER):
+                logger.info('PROCESS %s %s'%(dbct, path))
+                if (key, dbct) in self.__local_moved:
+                    continue
+                self.__process_md_block(key, path)
         logger.info('[RepairDataBlocks] Users metadata range is processed!')
 
         return self.__get_stat()
 
     def __process_data_block(self, key, path, dbct):
         self.__processed_local_blocks += 1
+        migrated = False
         with ThreadSafeDataBlock(path) as db:
             try:
                 header = db.get_header()
-                data_keys = KeyUtils.get_all_keys(header.master_key, header.replica_count)
+                data_keys = self.operator.get_replica_keys(header.master_key, header.replica_count)
+                fallback_keys = KeyUtils.get_fallback_keys(header.master_key, header.replica_count, data_keys)
 
                 if dbct == FSMappedDHTRange.DBCT_MASTER and key != header.master_key:
                     raise Exception('Master key is invalid: %s != %s'%(key, header.master_key))
                 elif dbct == FSMappedDHTRange.DBCT_REPLICA:
-                    if key not in data_keys:
+                    if not KeyUtils.is_replica_key(key, header.master_key, header.replica_count):
                         raise Exception('Replica key is invalid: %s'%key)
             except Exception, err:
                 self.__invalid_local_blocks += 1
@@ -103,13 +107,24 @@ class RepairProcess:
                 self.__check_data_block(key, db, dbct,  data_keys[0], \
                         header, FSMappedDHTRange.DBCT_MASTER)
 
-            for repl_key in data_keys[1:]:
+            for repl_key, f_keys in zip(data_keys[1:], fallback_keys):
                 if repl_key == key:
+                    #local data block is this replica
                     continue
 
-                if self._in_check_range(repl_key):
-                    self.__check_data_block(key, db, dbct, repl_key, \
-                            header, FSMappedDHTRange.DBCT_REPLICA)
+                if not self._in_check_range(repl_key):
+                    continue
+
+                is_valid = self.__check_data_block(key, db, dbct, repl_key, \
+                        header, FSMappedDHTRange.DBCT_REPLICA)
+                if dbct == FSMappedDHTRange.DBCT_REPLICA and key in f_keys and is_valid:
+                    #local data block is this replica saved with other ranges table
+                    #or zones of nodes, it is moved to current replica key
+                    migrated = True
+
+        if migrated:
+            logger.info('[RepairDataBlocks] replica %s is moved to its zone aware key'%key)
+            self.operator.remove_db(key, dbct)
 
     def __process_md_block(self, check_key, path):
         self.__processed_local_blocks += 1
@@ -135,9 +150,12 @@ class RepairProcess:
             logger.info('Invalid metadata for user=%s at %s ([%s]%s). Sending valid block...'%\
                 (check_key, range_obj.node_address, resp.ret_code, resp.ret_message))
 
-            tmp = tempfile.NamedTemporaryFile(suffix='.zip')
-            os.system('rm -f %s && cd %s && zip -r %s *'%(tmp.name, path, tmp.name))
-            params = {'key': repl_key, 'dbct': FSMappedDHTRange.DBCT_MD_REPLICA, 'user_id_hash': check_key}
+            #nodes of previous versions do not report md_dump and accept zip archives only
+            md_dump = bool((resp.ret_parameters or {}).get('md_dump', False))
+            tmp = tempfile.NamedTemporaryFile(suffix='.mdd')
+            self.operator.pack_metadata(path, tmp.name, md_dump)
+            params = {'key': repl_key, 'dbct': FSMappedDHTRange.DBCT_MD_REPLICA, 'user_id_hash': check_key, \
+                        'md_dump': md_dump}
             req = FabnetPacketRequest(method='PutDataBlock', sender=self.operator.self_address, sync=True, \
                                         parameters=params, binary_data=ThreadSafeDataBlock(tmp.name))
             resp = self.operator.call_node(range_obj.node_address, req)
@@ -157,6 +175,7 @@ class RepairProcess:
             return None
 
     def __check_data_block(self, local_key, db, dbct, check_key, header, remote_dbct):
+        '''return True if valid data block is saved at check_key'''
         long_key = self.__validate_key(check_key)
         if long_key is None:
             logger.error('[RepairDataBlocks] Invalid data key "%s"'%key)
@@ -190,8 +209,12 @@ class RepairProcess:
                 logger.error('PutDataBlock failed on %s. Details: %s'%(range_obj.node_address, resp.ret_message))
             else:
                 self.__repaired_foreign_blocks += 1
+                return True
 
         elif resp.ret_code != RC_OK:
             self.__failed_repair_foreign_blocks += 1
             logger.error('CheckDataBlock failed on %s. Details: %s'%(range_obj.node_address, resp.ret_message))
+        else:
+            return True
+        return False
 
@@ -12,16 +12,34 @@ Copyright (C) 2014 Konstantin Andrusenko
 import os
 import zlib
 import copy
+import time
 import struct
+import shutil
 import threading
 import hashlib
+from collections import OrderedDict
 
+from fabnet.utils.logger import oper_logger as logger
 from fabnet_dht.data_block import ThreadSafeDataBlock
 from fabnet_dht import leveldb
 
 MAX_INDEX = pow(2, 16)
 MAX_LEVEL = pow(2, 16)
 
+MD_CACHE_SIZE = 64
+MD_CACHE_MAX_OPEN_FILES = 8192
+MD_CACHE_IDLE_TIMEOUT = 600
+#leveldb does not use less open files than this
+MIN_MAX_OPEN_FILES = 74
+PATH_CACHE_SIZE = 1024
+
+#version of metadata keys schema
+MD_SCHEMA_VERSION = 2
+#count of changes written by one batch in metadata migration
+MIGRATION_BATCH_SIZE = 10000
+#size of records block in metadata dump
+DUMP_BLOCK_SIZE = 64*1024
+
 class MDException(Exception):
     pass
 
@@ -60,41 +78,82 @@ class UserInfo:
         return UserInfo(user_id_hash.encode('hex'), st_size, fr_size, flags)
                 
 class MDKey:
-    STRUCT_FMT = 'QLHH'
-    def __init__(self, parent_id, path_hash, level, index=0):
-        assert(level < MAX_LEVEL)
+    '''key of metadata item: [I][parent id][path hash][index]
+    path hash is 64-bit hash of full item path, so index (collisions chain)
+    is not 0 practically never. Big-endian packing keeps children of directory
+    in one continuous range of keys'''
+    PREFIX = 'I'
+    STRUCT_FMT = '>QQH'
+    KEY_LEN = len(PREFIX) + struct.calcsize(STRUCT_FMT)
+    def __init__(self, parent_id, path_hash, index=0):
         assert(index < MAX_INDEX)
-        
+
         self.parent_id = parent_id
-        self.path_hash = path_hash & 0xffffffff
-        self.level = level
+        self.path_hash = path_hash
         self.index = index
 
     def __repr__(self):
-        return '[%016x][%08x][%02x][%02x]'%(self.parent_id, self.path_hash, self.level, self.index)
+        return '[%016x][%016x][%02x]'%(self.parent_id, self.path_hash, self.index)
+
+    def __eq__(self, other):
+        return isinstance(other, MDKey) and self.pack() == other.pack()
+
+    def __ne__(self, other):
+        return not self == other
+
+    @classmethod
+    def hash_path(cls, path):
+        return struct.unpack('>Q', hashlib.sha1(path).digest()[:8])[0]
 
     def pack(self):
-        return struct.pack(self.STRUCT_FMT, self.parent_id, self.path_hash, self.level, self.index)
+        return self.PREFIX + struct.pack(self.STRUCT_FMT, self.parent_id, self.path_hash, self.index)
 
     def make_parent(self):
-        return (self.path_hash << 32) | (self.level << 16) | self.index
+        if self.index == 0:
+            return self.path_hash
+        return self.hash_path('%016x:%s'%(self.path_hash, self.index))
 
     def make_parent_range(self):
-        parent = self.make_parent()
-        start = struct.pack('QQ', parent, 1)
-        end = struct.pack('QQ', parent, 0xffffffffffffffff)
-        return start, end
-
+        start = self.PREFIX + struct.pack('>Q', self.make_parent())
+        return start, start + '\xff' * (self.KEY_LEN - len(start) + 1)
 
     @classmethod
     def unpack(cls, raw):
-        parent_id, path_hash, level, index = struct.unpack(cls.STRUCT_FMT, raw)
-        return MDKey(parent_id, path_hash, level, index)
+        if len(raw) != cls.KEY_LEN or raw[0] != cls.PREFIX:
+            raise MDException('Invalid metadata key %s'%raw.encode('hex'))
+        parent_id, path_hash, index = struct.unpack(cls.STRUCT_FMT, raw[1:])
+        return MDKey(parent_id, path_hash, index)
+
+
+class MDKeyV1:
+    '''item key of first metadata schema version (without version key in DB):
+    [parent id][crc32 of path][level][index] (native packing).
+    Used by metadata migration only'''
+    STRUCT_FMT = 'QLHH'
+    KEY_LEN = struct.calcsize(STRUCT_FMT)
+    UI_KEY = '\x00' * KEY_LEN
+
+    @classmethod
+    def make_parent(cls, raw):
+        _, path_hash, level, index = struct.unpack(cls.STRUCT_FMT, raw)
+        return ((path_hash & 0xffffffff) << 32) | (level << 16) | index
+
+    @classmethod
+    def iter_children(cls, db, parent):
+        prefix = struct.pack('Q', parent)
+        for key, value in db.range(start_key=prefix, end_key=prefix + '\xff' * cls.KEY_LEN):
+            if len(key) == cls.KEY_LEN and key != cls.UI_KEY:
+                yield key, value
+
+    @classmethod
+    def is_v1_key(cls, key):
+        return len(key) == cls.KEY_LEN
 
 class MDItemValue:
     IT_FILE = 1
     IT_DIR = 2
     IT_INFO = 3
+    IT_PARTED_FILE = 4
 
     def __init__(self, item_type, name, content=''):
         assert(len(name) < 255)
@@ -160,17 +219,99 @@ class MDFileContent:
             i += MDDataBlockInfo.REC_LEN
         return MDFileContent(dbs)
 
+class MDFileSummary:
+    '''content of IT_PARTED_FILE item,
+    data blocks of such file are stored under separate part keys (see MDPartKey)'''
+    STRUCT_FMT = '<QQQ'
+
+    def __init__(self, size=0, used_size=0, parts_count=0):
+        self.size = size
+        self.used_size = used_size
+        self.parts_count = parts_count
+
+    def pack(self):
+        return struct.pack(self.STRUCT_FMT, self.size, self.used_size, self.parts_count)
+
+    @classmethod
+    def unpack(cls, raw):
+        return MDFileSummary(*struct.unpack(cls.STRUCT_FMT, raw))
+
+
+class MDPartKey:
+    '''key of file part: [P][file parent id][seek][db_key]
+    parts of file are ordered by seek
+
+    part is identified by db_key, index key [D][file parent id][db_key]
+    holds seek of part. So data block sent again with other seek
+    updates existing part'''
+    PREFIX = 'P'
+    INDEX_PREFIX = 'D'
+    SEEK_FMT = '>Q'
+
+    @classmethod
+    def get_prefix(cls, file_key):
+        return cls.PREFIX + struct.pack('>Q', file_key.make_parent())
+
+    @classmethod
+    def pack(cls, file_key, data_block, raw_seek=None):
+        if raw_seek is None:
+            raw_seek = struct.pack(cls.SEEK_FMT, data_block.seek)
+        return cls.get_prefix(file_key) + raw_seek + data_block.db_key.decode('hex')
+
+    @classmethod
+    def make_index_key(cls, file_key, db_key):
+        return cls.INDEX_PREFIX + struct.pack('>Q', file_key.make_parent()) + db_key.decode('hex')
+
+    @classmethod
+    def split_part_key(cls, part_key):
+        '''return (index key, raw seek) of part key'''
+        seek_len = struct.calcsize(cls.SEEK_FMT)
+        return cls.INDEX_PREFIX + part_key[1:9] + part_key[9+seek_len:], part_key[9:9+seek_len]
+
+    @classmethod
+    def make_range(cls, file_key):
+        prefix = cls.get_prefix(file_key)
+        return prefix, prefix + '\xff' * (struct.calcsize(cls.SEEK_FMT) + 20)
+
+
+class MDDirStat:
+    '''aggregated statistic of directory subtree
+    (files size, files count, subdirectories count)
+    stored under [S][dir parent id] key'''
+    STRUCT_FMT = '<QQQ'
+
+    def __init__(self, size=0, files_count=0, dirs_count=0):
+        self.size = size
+        self.files_count = files_count
+        self.dirs_count = dirs_count
+
+    def pack(self):
+        return struct.pack(self.STRUCT_FMT, self.size, self.files_count, self.dirs_count)
+
+    @classmethod
+    def unpack(cls, raw):
+        return MDDirStat(*struct.unpack(cls.STRUCT_FMT, raw))
+
+    @classmethod
+    def make_key(cls, dir_key):
+        return 'S' + struct.pack('>Q', dir_key.make_parent())
+
+
 class PathInfo:
     PT_DIR = 'dir'
     PT_FILE = 'file'
 
-    def __init__(self, name, path_type, size, children=None):
+    def __init__(self, name, path_type, size, children=None, files_count=0, dirs_count=0):
         self.name = name
         self.path_type = path_type
         if children is None:
             children = []
         self.children = children
         self.size = size
+        self.files_count = files_count
+        self.dirs_count = dirs_count
+        #continuation token of paginated directory listing
+        self.cursor = None
 
     def add_child(self, child):
         self.children.append(child)
@@ -179,7 +320,12 @@ class PathInfo:
         children = []
         for child in self.children:
             children.append(child.to_dict())
-        return {'name': self.name, 'type': self.path_type, 'children': children}
+        ret = {'name': self.name, 'type': self.path_type, 'size': self.size, \
+                'files_count': self.files_count, 'dirs_count': self.dirs_count, \
+                'children': children}
+        if self.cursor:
+            ret['cursor'] = self.cursor
+        return ret
 
     def __repr__(self):
         ret = 'path: %s, path_type: %s, size: %s'%(self.name, self.path_type, self.size)
@@ -189,16 +335,179 @@ class PathInfo:
                 ret += '\tname: %s, size: %s\n'%(child.name, child.size)
         return ret
 
+class MDDump:
+    '''sorted key/value stream of metadata DB snapshot
+    [FMDD][format version] header and blocks [data size][crc32 of data][records],
+    record is [key length][value length][key][value].
+    Last block is empty and keeps records count in crc32 field'''
+    MAGIC = 'FMDD'
+    VERSION = 1
+    HEADER_FMT = '<4sH'
+    BLOCK_FMT = '<II'
+    RECORD_FMT = '<II'
+
+    @classmethod
+    def __write_block(cls, fobj, data):
+        fobj.write(struct.pack(cls.BLOCK_FMT, len(data), zlib.crc32(data) & 0xffffffff))
+        fobj.write(data)
+
+    @classmethod
+    def dump(cls, db, out_file, block_size=DUMP_BLOCK_SIZE):
+        '''write all records of db (LevelDB or its snapshot) to out_file
+        return count of records'''
+        cnt = 0
+        fobj = open(out_file, 'wb')
+        try:
+            fobj.write(struct.pack(cls.HEADER_FMT, cls.MAGIC, cls.VERSION))
+            block = []
+            block_len = 0
+            for key, value in db.range():
+                block.append(struct.pack(cls.RECORD_FMT, len(key), len(value)) + key + value)
+                block_len += len(block[-1])
+                cnt += 1
+                if block_len >= block_size:
+                    cls.__write_block(fobj, ''.join(block))
+                    block = []
+                    block_len = 0
+            if block:
+                cls.__write_block(fobj, ''.join(block))
+            fobj.write(struct.pack(cls.BLOCK_FMT, 0, cnt))
+        finally:
+            fobj.close()
+        return cnt
+
+    @classmethod
+    def __read(cls, fobj, size):
+        data = fobj.read(size)
+        if len(data) != size:
+            raise MDException('Metadata dump is truncated')
+        return data
+
+    @classmethod
+    def iter_blocks(cls, dump_file):
+        '''yield list of (key, value) records of every block of dump'''
+        fobj = open(dump_file, 'rb')
+        try:
+            magic, version = struct.unpack(cls.HEADER_FMT, \
+                    cls.__read(fobj, struct.calcsize(cls.HEADER_FMT)))
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise MDException('Unsupported metadata dump format')
+
+            cnt = 0
+            b_header_len = struct.calcsize(cls.BLOCK_FMT)
+            r_header_len = struct.calcsize(cls.RECORD_FMT)
+            while True:
+                size, crc = struct.unpack(cls.BLOCK_FMT, cls.__read(fobj, b_header_len))
+                if size == 0:
+                    if crc != cnt:
+                        raise MDException('Metadata dump is corrupted (%s records expected, %s found)'%(crc, cnt))
+                    break
+                data = cls.__read(fobj, size)
+                if zlib.crc32(data) & 0xffffffff != crc:
+                    raise MDException('Metadata dump is corrupted (invalid block checksum)')
+
+                records = []
+                i = 0
+                while i < size:
+                    key_len, val_len = struct.unpack(cls.RECORD_FMT, data[i:i+r_header_len])
+                    i += r_header_len
+                    records.append((data[i:i+key_len], data[i+key_len:i+key_len+val_len]))
+                    i += key_len + val_len
+                cnt += len(records)
+                yield records
+        finally:
+            fobj.close()
+
+    @classmethod
+    def load(cls, dump_file, md_path):
+        '''create new metadata DB at md_path from dump_file
+        return count of records'''
+        if os.path.exists(md_path):
+            shutil.rmtree(md_path)
+        cnt = 0
+        db = leveldb.DB(md_path, create_if_missing=True, default_sync=False)
+        try:
+            for records in cls.iter_blocks(dump_file):
+                batch = leveldb.WriteBatch()
+                for key, value in records:
+                    batch.put(key, value)
+                db.write(batch)
+                cnt += len(records)
+            db.write(leveldb.WriteBatch(), sync=True)
+        except Exception:
+            db.close()
+            shutil.rmtree(md_path)
+            raise
+        db.close()
+        return cnt
+
+
+class MDBatch(leveldb.WriteBatch):
+    '''write batch of user metadata changes
+    get() and range() methods return data from DB with changes made in this batch
+    user_info is UserInfo object changed in this batch (or None)
+    '''
+    def __init__(self, db):
+        leveldb.WriteBatch.__init__(self)
+        self.__db = db
+        self.user_info = None
+
+    def is_changed(self, key):
+        return key in self._puts or key in self._deletes
+
+    def get(self, key, default=None):
+        if key in self._deletes:
+            return default
+        if key in self._puts:
+            return self._puts[key]
+        return self.__db.get(key, default)
+
+    def range(self, start_key, end_key):
+        puts = sorted([(key, value) for key, value in self._puts.items() \
+                        if start_key <= key < end_key])
+        i = 0
+        for key, value in self.__db.range(start_key=start_key, end_key=end_key):
+            while i < len(puts) and puts[i][0] < key:
+                yield puts[i]
+                i += 1
+            if i < len(puts) and puts[i][0] == key:
+                yield puts[i]
+                i += 1
+            elif key not in self._deletes:
+                yield key, value
+
+        for item in puts[i:]:
+            yield item
+
+
 class UserMetadata:
-    ROOT_KEY = MDKey(0, 0, 0)
-    UI_KEY = ROOT_KEY.pack()
+    ROOT_KEY = MDKey(0, 0)
+    UI_KEY = 'MU'
+    VERSION_KEY = 'MV'
 
-    def __init__(self, md_file):
+    def __init__(self, md_file, max_open_files=1000, sync_writes=True):
+        '''sync_writes=False - write batches are not synced to disk,
+        sync() method should be called for flushing them'''
         if not os.path.exists(md_file):
             os.mkdir(md_file)
         self.__db_lock = ThreadSafeDataBlock(os.path.join(md_file, 'dht.lock'))
         self.__db_lock.block()
-        self.__db = leveldb.DB(md_file, create_if_missing=True, default_sync=True)
+        self.__db = leveldb.DB(md_file, create_if_missing=True, default_sync=False, \
+                                max_open_files=max_open_files)
+        self.__md_file = md_file
+        self.__sync_writes = sync_writes
+        self.__unsynced = False
+        #LRU cache {directory path: (MDKey, level, value)}
+        self.__path_cache = OrderedDict()
+        #cached UserInfo, it is replaced by UserInfo of batch after batch write
+        self.__user_info = None
+        try:
+            self.__check_schema()
+        except Exception:
+            self.__db.close()
+            self.__db_lock.unblock()
+            self.__db_lock.close()
+            raise
 
     def block(self):
         self.__db_lock.block()
@@ -207,105 +516,311 @@ class UserMetadata:
         self.__db_lock.unblock()
 
     def close(self):
+        self.sync()
         self.__db.close()
         self.__db_lock.unblock()
         self.__db_lock.close()
 
-    def __get_item(self, parent, item_name, level, index=0):
-        key = MDKey(parent.make_parent(), zlib.crc32(item_name), level, index)
-        item = self.__db.get(key.pack(), None)
+    def __write(self, batch):
+        self.__db.write(batch, sync=self.__sync_writes)
+        if batch.user_info is not None:
+            self.__user_info = batch.user_info
+        if not self.__sync_writes:
+            self.__unsynced = True
+
+    def snapshot(self):
+        '''return consistent read-only view of metadata DB'''
+        return self.__db.snapshot()
+
+    def has_unsynced(self):
+        return self.__unsynced
+
+    def sync(self):
+        '''flush not synced writes to disk
+        (synced write to LevelDB flushes all previous writes from log)
+        return True if there were not synced writes'''
+        if not self.__unsynced:
+            return False
+        self.__db.write(leveldb.WriteBatch(), sync=True)
+        self.__unsynced = False
+        return True
+
+    def __check_schema(self):
+        raw = self.__db.get(self.VERSION_KEY, None)
+        if raw is not None:
+            version = struct.unpack('<H', raw)[0]
+            if version != MD_SCHEMA_VERSION:
+                raise MDException('Unsupported metadata schema version %s'%version)
+            return
+
+        migrate = False
+        for _ in self.__db.range():
+            migrate = True
+            break
+        if migrate:
+            self.__migrate_v1()
+            self.__calc_dir_stats()
+
+        batch = leveldb.WriteBatch()
+        batch.put(self.VERSION_KEY, struct.pack('<H', MD_SCHEMA_VERSION))
+        self.__db.write(batch, sync=True)
+        if migrate:
+            self.__remove_v1_keys()
+
+    def __migrate_v1(self):
+        '''copy items of first schema version to current keys
+        data blocks of IT_FILE items are moved to part keys.
+        Keys of first version are not changed here, so migration
+        can be restarted if it is failed'''
+        batch = MDBatch(self.__db)
+        changes = 0
+        raw_ui = self.__db.get(MDKeyV1.UI_KEY, None)
+        if raw_ui is not None:
+            batch.put(self.UI_KEY, raw_ui)
+
+        dirs = [(0, '', self.ROOT_KEY)]
+        while dirs:
+            v1_parent, path, parent_key = dirs.pop()
+            for v1_key, raw in MDKeyV1.iter_children(self.__db, v1_parent):
+                val = MDItemValue.unpack(raw)
+                item_path = '%s/%s'%(path, val.name)
+                item = self.__get_item(batch, parent_key, item_path)
+                if item is None:
+                    key = self.__mk_item(batch, parent_key, item_path, val)
+                else:
+                    key = item[0]
+                changes += 1
+
+                if val.item_type == MDItemValue.IT_DIR:
+                    batch.put(key.pack(), raw)
+                    dirs.append((MDKeyV1.make_parent(v1_key), item_path, key))
+                elif val.item_type == MDItemValue.IT_FILE:
+                    summary = self.__split_file(batch, key, val)
+                    val = MDItemValue(MDItemValue.IT_PARTED_FILE, val.name, summary.pack())
+                    batch.put(key.pack(), val.pack())
+                    changes += 2 * summary.parts_count
+
+                if changes >= MIGRATION_BATCH_SIZE:
+                    self.__db.write(batch)
+                    batch = MDBatch(self.__db)
+                    changes = 0
+
+        self.__db.write(batch, sync=True)
+
+    def __calc_dir_stats(self):
+        '''calculate statistic of all directories by subtree scan
+        (first schema version has no statistic of directories)'''
+        stats = []
+        self.__calc_dir_stat(self.ROOT_KEY, stats)
+        for i in xrange(0, len(stats), MIGRATION_BATCH_SIZE):
+            batch = leveldb.WriteBatch()
+            for dir_key, stat in stats[i:i+MIGRATION_BATCH_SIZE]:
+                batch.put(MDDirStat.make_key(dir_key), stat.pack())
+            self.__db.write(batch, sync=True)
+
+    def __calc_dir_stat(self, dir_key, stats):
+        stat = MDDirStat()
+        st_key, end_key = dir_key.make_parent_range()
+        for key, value in self.__db.range(start_key=st_key, end_key=end_key):
+            key, value = MDKey.unpack(key), MDItemValue.unpack(value)
+            if value.item_type == MDItemValue.IT_DIR:
+                child_stat = self.__calc_dir_stat(key, stats)
+                stat.size += child_stat.size
+                stat.files_count += child_stat.files_count
+                stat.dirs_count += child_stat.dirs_count + 1
+            else:
+                stat.size += self.__get_file_size(value)
+                stat.files_count += 1
+        stats.append((dir_key, stat))
+        return stat
+
+    def __remove_v1_keys(self):
+        batch = leveldb.WriteBatch()
+        changes = 0
+        for key in self.__db.keys():
+            if not MDKeyV1.is_v1_key(key):
+                continue
+            batch.delete(key)
+            changes += 1
+            if changes >= MIGRATION_BATCH_SIZE:
+                self.__db.write(batch)
+                batch = leveldb.WriteBatch()
+                changes = 0
+        self.__db.write(batch, sync=True)
+
+    def __get_item(self, db, parent, item_name, index=0):
+        key = MDKey(parent.make_parent(), MDKey.hash_path(item_name), index)
+        item = db.get(key.pack(), None)
         if item is None:
             return None
         if MDItemValue.unpack(item).name != os.path.basename(item_name):
-            return self.__get_item(parent, item_name, level, index+1)
+            return self.__get_item(db, parent, item_name, index+1)
         return key, item
 
-    def __mk_item(self, parent, item_name, level, value, index=0):
+    def __mk_item(self, batch, parent, item_name, value, index=0):
         assert(index < MAX_INDEX)
-        new_key = MDKey(parent.make_parent(), zlib.crc32(item_name), level, index)
+        new_key = MDKey(parent.make_parent(), MDKey.hash_path(item_name), index)
         new_key_s = new_key.pack()
-        item = self.__db.get(new_key_s, None)
+        item = batch.get(new_key_s, None)
         if item is None:
-            self.__db[new_key_s] = value.pack()
+            batch.put(new_key_s, value.pack())
             return new_key
         else:
             val = MDItemValue.unpack(item)
             if val.name == os.path.basename(item_name):
                 raise MDAlreadyExists('Path %s is already exists'%item_name)
-            return self.__mk_item(parent, item_name, value, level, index+1)
-
-    def __find(self, path):
-        parts = path.split('/')
+            return self.__mk_item(batch, parent, item_name, value, index+1)
+
+    def __get_cached_dir(self, path):
+        item = self.__path_cache.pop(path, None)
+        if item is not None:
+            self.__path_cache[path] = item
+        return item
+
+    def __cache_dir(self, path, item):
+        self.__path_cache[path] = item
+        if len(self.__path_cache) > PATH_CACHE_SIZE:
+            self.__path_cache.popitem(last=False)
+
+    def __find(self, path, db=None):
+        '''return (MDKey, level, value) of path or None if path does not found
+        lookup is started from deepest cached parent directory'''
+        if db is None:
+            db = self.__db
+        parts = [part for part in path.split('/') if part]
 
         cur_key = self.ROOT_KEY
         cur_path = ''
         cur_level = 0
         cur_val = '\x02\x00'
-        for part in parts:
-            if not part: continue
+        for i in xrange(len(parts), 0, -1):
+            c_path = '/' + '/'.join(parts[:i])
+            item = self.__get_cached_dir(c_path)
+            if item is not None:
+                cur_key, cur_level, cur_val = item
+                cur_path = c_path
+                break
+
+        for part in parts[cur_level:]:
             cur_level += 1
             cur_path += '/' + part
-            item = self.__get_item(cur_key, cur_path, cur_level)
+            item = self.__get_item(db, cur_key, cur_path)
             if item is None:
                 return None
             cur_key, cur_val = item
+            #not committed items are not cached
+            if ord(cur_val[0]) == MDItemValue.IT_DIR and \
+                    (db is self.__db or not db.is_changed(cur_key.pack())):
+                self.__cache_dir(cur_path, (cur_key, cur_level, cur_val))
 
         return cur_key, cur_level, cur_val
             
-    def __mkdir(self, path):
+    def __mkdir(self, batch, path):
         if path.endswith('/'): path = path[:-1]
         dir_name, item_name = os.path.split(path)
-        item = self.__find(dir_name)
+        item = self.__find(dir_name, batch)
         if item is None:
-            parent_key, level = self.__mkdir(dir_name)
+            parent_key, level = self.__mkdir(batch, dir_name)
         else:
             parent_key, level, _ = item
+        ancestors = self.__get_ancestors(batch, path)
 
         value = MDItemValue(MDItemValue.IT_DIR, item_name)
         level = level + 1
-        return self.__mk_item(parent_key, path, level, value), level
+        new_key = self.__mk_item(batch, parent_key, path, value)
+        batch.put(MDDirStat.make_key(new_key), MDDirStat().pack())
+        self.__update_dir_stats(batch, ancestors, dirs_count=1)
+        return new_key, level
+
+    def __get_dir_stat(self, db, dir_key):
+        '''return MDDirStat of directory'''
+        raw = db.get(MDDirStat.make_key(dir_key), None)
+        if raw is None:
+            #root directory of empty metadata
+            return MDDirStat()
+        return MDDirStat.unpack(raw)
+
+    def __get_ancestors(self, batch, path):
+        '''return list of directories keys from root to parent of path'''
+        parts = [part for part in path.split('/') if part][:-1]
+        ancestors = [self.ROOT_KEY]
+        for i in xrange(1, len(parts)+1):
+            ancestors.append(self.__find('/' + '/'.join(parts[:i]), batch)[0])
+        return ancestors
+
+    def __update_dir_stats(self, batch, ancestors, size=0, files_count=0, dirs_count=0):
+        for dir_key in ancestors:
+            stat = self.__get_dir_stat(batch, dir_key)
+            stat.size += size
+            stat.files_count += files_count
+            stat.dirs_count += dirs_count
+            if min(stat.size, stat.files_count, stat.dirs_count) < 0:
+                logger.error('Invalid statistic of directory %s in %s: size=%s, '\
+                        'files_count=%s, dirs_count=%s'%(dir_key.pack().encode('hex'), \
+                        self.__md_file, stat.size, stat.files_count, stat.dirs_count))
+                stat.size = max(stat.size, 0)
+                stat.files_count = max(stat.files_count, 0)
+                stat.dirs_count = max(stat.dirs_count, 0)
+            batch.put(MDDirStat.make_key(dir_key), stat.pack())
 
     def _iter_keys(self):
-        root = MDKey(0,0,0)
-        st_key, _ = root.make_parent_range()
-        root = MDKey(0xffffffffffffffff, 0xffffffff, 0xffff-1, 0xffff-1)
-        _, end_key = root.make_parent_range()
-        for key, value in self.__db.range(start_key=st_key, end_key=end_key):
+        for key, value in self.__db.range(start_key=MDKey.PREFIX, end_key=chr(ord(MDKey.PREFIX)+1)):
+            if len(key) != MDKey.KEY_LEN:
+                continue
             yield MDKey.unpack(key), MDItemValue.unpack(value)
 
-    def _inc_used_size(self, size):
-        user_info = self.get_user_info()
+    def _inc_used_size(self, size, batch):
+        user_info = self.__get_user_info(batch)
         user_info.used_size += size
-        self.update_user_info(user_info)
+        self.__put_user_info(batch, user_info)
 
-    def _dec_used_size(self, size):
-        user_info = self.get_user_info()
+    def _dec_used_size(self, size, batch):
+        user_info = self.__get_user_info(batch)
         user_info.used_size -= size
         if user_info.used_size < 0:
             user_info.used_size = 0
-        self.update_user_info(user_info)
+        self.__put_user_info(batch, user_info)
 
     def update_user_info(self, user_info):
-        self.__db[self.UI_KEY] = user_info.pack()
+        batch = MDBatch(self.__db)
+        self.__put_user_info(batch, copy.copy(user_info))
+        self.__write(batch)
 
     def add_user_storage_size(self, size):
-        user_info = self.get_user_info()
+        batch = MDBatch(self.__db)
+        user_info = self.__get_user_info(batch)
         user_info.storage_size += size
-        self.update_user_info(user_info)
+        self.__put_user_info(batch, user_info)
+        self.__write(batch)
+
+    def __load_user_info(self):
+        if self.__user_info is None:
+            raw = self.__db.get(self.UI_KEY, None)
+            if raw is None:
+                self.__user_info = UserInfo('', 0, 0, 0)
+            else:
+                self.__user_info = UserInfo.unpack(raw)
+        return self.__user_info
+
+    def __get_user_info(self, batch):
+        '''return UserInfo object that can be changed in batch
+        (cached UserInfo is not changed until batch is written)'''
+        if batch.user_info is None:
+            batch.user_info = copy.copy(self.__load_user_info())
+        return batch.user_info
+
+    def __put_user_info(self, batch, user_info):
+        batch.put(self.UI_KEY, user_info.pack())
+        batch.user_info = user_info
 
     def get_user_info(self):
-        raw = self.__db.get(self.UI_KEY, None)
-        if raw is None:
-            return UserInfo('', 0, 0, 0)
-        return UserInfo.unpack(raw)
+        return copy.copy(self.__load_user_info())
 
     def get_checksum(self):
         return hashlib.sha1(str(self.get_user_info())).hexdigest()
 
-    def iterdir(self, path):
-        if type(path) == unicode:
-            path = path.encode('utf8')
-        item = self.__find(path)
+    def __iterdir(self, path, db, cursor=None):
+        item = self.__find(path, db)
         if item is None:
             raise MDNotFound('Path %s does not found!'%path)
         dir_key, level, dir_val = item
@@ -314,10 +829,24 @@ class UserMetadata:
             raise MDException('Path %s is not dir!'%path)
 
         st_key, end_key = dir_key.make_parent_range()
-        for key, value in self.__db.range(start_key=st_key, end_key=end_key):
-            #yield MDItemValue.unpack(value).name
+        if cursor:
+            #listing is continued after item with cursor key
+            try:
+                c_key = cursor.decode('hex')
+            except TypeError:
+                raise MDException('Invalid cursor %s'%cursor)
+            if len(c_key) != MDKey.KEY_LEN or not (st_key <= c_key <= end_key):
+                raise MDException('Invalid cursor %s for path %s'%(cursor, path))
+            st_key = c_key + '\x00'
+
+        for key, value in db.range(start_key=st_key, end_key=end_key):
             yield MDKey.unpack(key), MDItemValue.unpack(value)
 
+    def iterdir(self, path):
+        if type(path) == unicode:
+            path = path.encode('utf8')
+        return self.__iterdir(path, self.__db)
+
     def listdir(self, path):
         if type(path) == unicode:
             path = path.encode('utf8')
@@ -326,60 +855,123 @@ class UserMetadata:
     def make_path(self, path):
         if type(path) == unicode:
             path = path.encode('utf8')
-        self.__mkdir(path)
+        batch = MDBatch(self.__db)
+        self.__mkdir(batch, path)
+        self.__write(batch)
+
+    def update(self, add_list, rm_list):
+        '''remove paths from rm_list and then update paths from
+        add_list [(path, data_blocks), ...]
+        All changes (with user info) are written in one batch,
+        so nothing is changed if some of them fails'''
+        batch = MDBatch(self.__db)
+        for path in rm_list:
+            self.__remove_path(batch, path)
+        for path, data_blocks in add_list:
+            self.__update_path(batch, path, data_blocks)
+        self.__write(batch)
 
     def update_path(self, path, data_blocks):
+        batch = MDBatch(self.__db)
+        self.__update_path(batch, path, data_blocks)
+        self.__write(batch)
+
+    def __update_path(self, batch, path, data_blocks):
         if type(path) == unicode:
             path = path.encode('utf8')
         size = 0
         for db in data_blocks:
             size += db.size * (db.replica_count + 1)
-        user_info = self.get_user_info()
+        user_info = self.__get_user_info(batch)
         if user_info.storage_size == 0:
             raise MDNotInit('Does not initialized')
         elif user_info.storage_size < (user_info.used_size + size):
             raise MDNoFreeSpace('No free user space!')
 
         if path.endswith('/'): path = path[:-1]
-        item = self.__find(path)
+        item = self.__find(path, batch)
         if item is None:
             dir_name, item_name = os.path.split(path)
-            item = self.__find(dir_name)
+            item = self.__find(dir_name, batch)
             if item is None:
                 raise MDNotFound('Path %s does not found!'%dir_name)
 
             parent_key, level, _ = item
-            content = MDFileContent(data_blocks)
-            val = MDItemValue(MDItemValue.IT_FILE, item_name, content.pack())
-            key = self.__mk_item(parent_key, path, level+1, val)
+            ancestors = self.__get_ancestors(batch, path)
+            summary = MDFileSummary()
+            val = MDItemValue(MDItemValue.IT_PARTED_FILE, item_name, summary.pack())
+            key = self.__mk_item(batch, parent_key, path, val)
+            new_files = 1
         else:
-            size = 0
             key, _, val = item
             val = MDItemValue.unpack(val)
-            content = MDFileContent.unpack(val.content)
-            for_app = []
-            for new_db in data_blocks:
-                for db in content.data_blocks:
-                    if new_db.db_key != db.db_key:
-                        continue
-                    if new_db.size != db.size:
-                        size += (new_db.size - db.size) * (db.replica_count + 1)
-                        db.size = new_db.size
-                    break
-                else:
-                    size += new_db.size * (new_db.replica_count + 1)
-                    for_app.append(new_db)
-
-            content.data_blocks += for_app
-            val.content = content.pack()
-            self.__db[key.pack()] = val.pack()
-
-        user_info.used_size += size
-        self.update_user_info(user_info)
-
-    def get_path_info(self, path):
+            if val.item_type == MDItemValue.IT_DIR:
+                raise MDException('Path %s is dir!'%path)
+            ancestors = self.__get_ancestors(batch, path)
+            summary = MDFileSummary.unpack(val.content)
+            new_files = 0
+
+        size, used_size = summary.size, summary.used_size
+        for new_db in data_blocks:
+            raw_seek = batch.get(MDPartKey.make_index_key(key, new_db.db_key), None)
+            if raw_seek is None:
+                summary.parts_count += 1
+                summary.size += new_db.size
+                summary.used_size += new_db.size * (new_db.replica_count + 1)
+                self.__put_part(batch, key, new_db)
+                continue
+
+            #seek of existing part is not changed
+            part_key = MDPartKey.pack(key, new_db, raw_seek)
+            db = MDDataBlockInfo.unpack(batch.get(part_key))
+            if new_db.size != db.size:
+                summary.size += new_db.size - db.size
+                summary.used_size += (new_db.size - db.size) * (db.replica_count + 1)
+                db.size = new_db.size
+                batch.put(part_key, db.pack())
+
+        val.content = summary.pack()
+        batch.put(key.pack(), val.pack())
+
+        user_info.used_size += summary.used_size - used_size
+        self.__put_user_info(batch, user_info)
+        self.__update_dir_stats(batch, ancestors, summary.size - size, new_files)
+
+    def __split_file(self, batch, key, val):
+        '''move data blocks of IT_FILE item (first schema version) to part keys
+        return MDFileSummary object'''
+        summary = MDFileSummary()
+        for db in MDFileContent.unpack(val.content).data_blocks:
+            summary.parts_count += 1
+            summary.size += db.size
+            summary.used_size += db.size * (db.replica_count + 1)
+            self.__put_part(batch, key, db)
+        return summary
+
+    def __put_part(self, batch, key, db):
+        part_key = MDPartKey.pack(key, db)
+        index_key, raw_seek = MDPartKey.split_part_key(part_key)
+        batch.put(part_key, db.pack())
+        batch.put(index_key, raw_seek)
+
+    def __get_file_size(self, val):
+        return MDFileSummary.unpack(val.content).size
+
+    def __iter_parts(self, db, key):
+        st_key, end_key = MDPartKey.make_range(key)
+        for part_key, raw_db in db.range(start_key=st_key, end_key=end_key):
+            yield part_key, MDDataBlockInfo.unpack(raw_db)
+
+    def get_path_info(self, path, limit=0, cursor=None):
         '''
         return instance of PathInfo class
+        size of directory is total size of files in its subtree
+        (statistic is returned for requested directory only,
+        its children directories are listed with zero size)
+
+        limit - if > 0, at most limit children of directory are listed
+                and path_info.cursor is set if directory has more children
+        cursor - path_info.cursor of previous page
         '''
         if type(path) == unicode:
             path = path.encode('utf8')
@@ -391,23 +983,24 @@ class UserMetadata:
         val = MDItemValue.unpack(val)
         path_info = PathInfo(path, None, 0)
         if val.item_type == MDItemValue.IT_DIR:
+            stat = self.__get_dir_stat(self.__db, key)
             path_info.path_type = PathInfo.PT_DIR
-            for key, value in self.iterdir(path):
-                f_size = 0
+            path_info.size = stat.size
+            path_info.files_count = stat.files_count
+            path_info.dirs_count = stat.dirs_count
+            last_key = None
+            for key, value in self.__iterdir(path, self.__db, cursor):
+                if limit and len(path_info.children) == limit:
+                    path_info.cursor = last_key.pack().encode('hex')
+                    break
+                last_key = key
                 if value.item_type == MDItemValue.IT_DIR:
-                    f_tp = PathInfo.PT_DIR
+                    path_info.add_child(PathInfo(value.name, PathInfo.PT_DIR, 0))
                 else:
-                    f_tp = PathInfo.PT_FILE
-                    content = MDFileContent.unpack(value.content)
-                    for db in content.data_blocks:
-                        f_size += db.size
-                path_info.add_child(PathInfo(value.name, f_tp, f_size))
-                path_info.size += f_size
+                    path_info.add_child(PathInfo(value.name, PathInfo.PT_FILE, self.__get_file_size(value)))
         else:
             path_info.path_type = PathInfo.PT_FILE
-            content = MDFileContent.unpack(val.content)
-            for db in content.data_blocks:
-                path_info.size += db.size
+            path_info.size = self.__get_file_size(val)
 
         return path_info
 
@@ -420,16 +1013,19 @@ class UserMetadata:
 
         key, _, val = item
         val = MDItemValue.unpack(val)
-        if val.item_type != MDItemValue.IT_FILE:
+        if val.item_type != MDItemValue.IT_PARTED_FILE:
             raise MDException('Path %s is not file!'%path)
-
-        content = MDFileContent.unpack(val.content)
-        return copy.copy(content.data_blocks)
+        return [db for _, db in self.__iter_parts(self.__db, key)]
 
     def remove_path(self, path):
+        batch = MDBatch(self.__db)
+        self.__remove_path(batch, path)
+        self.__write(batch)
+
+    def __remove_path(self, batch, path):
         if type(path) == unicode:
             path = path.encode('utf8')
-        item = self.__find(path)
+        item = self.__find(path, batch)
         if item is None:
             raise MDNotFound('Path %s does not found!'%path)
         key, _, val = item
@@ -438,59 +1034,339 @@ class UserMetadata:
             raise MDException('Can not remove root!')
 
         val = MDItemValue.unpack(val)
+        ancestors = self.__get_ancestors(batch, path)
         if val.item_type == MDItemValue.IT_DIR:
-            for _ in self.iterdir(path):
+            for _ in self.__iterdir(path, batch):
                 raise MDException('Directory %s is not empty!'%path)
+            batch.delete(MDDirStat.make_key(key))
+            self.__update_dir_stats(batch, ancestors, dirs_count=-1)
         else:
-            size = 0
-            content = MDFileContent.unpack(val.content)
-            for db in content.data_blocks:
-                size += db.size * (db.replica_count + 1)
-            self._dec_used_size(size)
+            self.__update_dir_stats(batch, ancestors, -self.__get_file_size(val), -1)
 
-        del self.__db[key.pack()]
+        if val.item_type == MDItemValue.IT_PARTED_FILE:
+            for part_key, _ in self.__iter_parts(batch, key):
+                batch.delete(part_key)
+                batch.delete(MDPartKey.split_part_key(part_key)[0])
+            self._dec_used_size(MDFileSummary.unpack(val.content).used_size, batch)
 
+        batch.delete(key.pack())
+        self.__path_cache.pop('/' + '/'.join([part for part in path.split('/') if part]), None)
 
-class MetadataCache:
-    def __init__(self):
-        self.__lock = threading.RLock()
-        self.__cached = {}
 
-    def call(self, path, method, *params, **kv_params):
+class MDCacheEntry:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        #count of dumps written from snapshot of md_obj,
+        #md_obj can not be closed while it is > 0
+        self.exports = 0
+        self.exports_done = threading.Condition(self.lock)
+        self.md_obj = None
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class MetadataCache:
+    '''LRU cache of opened UserMetadata objects
+
+    Count of opened objects is limited by max_size and every object can keep
+    at most max_open_files/max_size LevelDB files opened.
+    Objects that are not used for idle_timeout seconds are closed by flush_idle() call.
+    Global lock protects cache structure only, calls of UserMetadata methods
+    (and opening/closing of LevelDB) are serialized by per-path entry locks
+
+    If group_sync_interval > 0, write batches are not synced by every call.
+    Caller with not synced writes registers its entry and waits for sync thread.
+    Sync thread waits group_sync_interval seconds for writes of other callers
+    and syncs registered entries only. So many users share one fsync,
+    but call() returns after data is synced as before.
+
+    Entries evicted by call() are closed only if they are not locked
+    by other calls and not exported, so call() does not wait for them
+    '''
+    def __init__(self, max_size=MD_CACHE_SIZE, max_open_files=MD_CACHE_MAX_OPEN_FILES, \
+                                        idle_timeout=MD_CACHE_IDLE_TIMEOUT, group_sync_interval=0):
+        self.__lock = threading.Lock()
+        self.__cached = OrderedDict()
+        self.__max_size = max_size
+        self.__idle_timeout = idle_timeout
+        self.__db_max_open_files = max(MIN_MAX_OPEN_FILES, max_open_files / max_size)
+
+        self.__group_sync_interval = group_sync_interval
+        self.__sync_cond = threading.Condition()
+        #entries with not synced writes, they are synced by next sync round
+        self.__unsynced = set()
+        self.__sync_thread = None
+        self.__sync_stopped = False
+        self.__sync_started = 0
+        self.__sync_done = 0
+
+    def __pin(self, path):
         self.__lock.acquire()
         try:
-            md_obj = self.__cached.get(path, None)
-            if md_obj is None:
-                md_obj = UserMetadata(path)
-                self.__cached[path] = md_obj
+            entry = self.__cached.pop(path, None)
+            if entry is None:
+                entry = MDCacheEntry(path)
+            #most recently used entries are at the end
+            self.__cached[path] = entry
+            entry.refs += 1
+            return entry
         finally:
             self.__lock.release()
 
-        md_obj.block()
+    def __unpin(self, entry):
+        self.__lock.acquire()
         try:
-            method = getattr(md_obj, method) 
-            return method(*params, **kv_params)
+            entry.refs -= 1
+            entry.last_used = time.time()
+            if entry.refs == 0 and entry.md_obj is None \
+                    and self.__cached.get(entry.path, None) is entry:
+                del self.__cached[entry.path]
         finally:
-            md_obj.unblock()
+            self.__lock.release()
 
-    def destroy(self):
+    def __pin_victims(self, idle_timeout=None, all_entries=False):
+        '''pin and return not used entries that should be closed:
+        least recently used entries over max_size and entries idle for idle_timeout'''
         self.__lock.acquire()
         try:
-            for obj in self.__cached.values():
-                obj.block()
-                obj.close()
-            self.__cached = {}
+            victims = []
+            over = len(self.__cached) - self.__max_size
+            now = time.time()
+            for entry in self.__cached.values():
+                if entry.refs and not all_entries:
+                    continue
+                if all_entries:
+                    pass
+                elif over > 0:
+                    over -= 1
+                elif idle_timeout is None or (now - entry.last_used) < idle_timeout:
+                    continue
+                entry.refs += 1
+                victims.append(entry)
+            return victims
         finally:
             self.__lock.release()
 
-    def close_md(self, path):
+    def __close(self, entry):
+        entry.lock.acquire()
+        try:
+            self.__close_locked(entry)
+        finally:
+            entry.lock.release()
+
+    def __close_locked(self, entry):
+        '''close md_obj of entry after exports of its snapshots,
+        entry lock should be acquired by caller'''
+        while entry.exports:
+            entry.exports_done.wait()
+        if entry.md_obj is None:
+            return
+        entry.md_obj.block()
+        entry.md_obj.close()
+        entry.md_obj = None
+
+    def __close_victims(self, victims, wait=True):
+        '''close md_obj of victims
+        if wait is False, entries locked by other calls or exported are skipped'''
+        for entry in victims:
+            try:
+                if wait:
+                    self.__close(entry)
+                elif entry.lock.acquire(False):
+                    try:
+                        if not entry.exports:
+                            self.__close_locked(entry)
+                    finally:
+                        entry.lock.release()
+            finally:
+                self.__unpin(entry)
+
+    def __wait_sync(self, entry):
+        '''register entry with not synced writes and wait for its sync'''
+        self.__sync_cond.acquire()
+        try:
+            if self.__sync_thread is None:
+                self.__sync_thread = threading.Thread(target=self.__sync_loop)
+                self.__sync_thread.setName('MDSyncThread')
+                self.__sync_thread.setDaemon(True)
+                self.__sync_thread.start()
+
+            self.__unsynced.add(entry)
+            #next round takes all entries registered before it is started
+            need_round = self.__sync_started + 1
+            self.__sync_cond.notify_all()
+            while self.__sync_done < need_round:
+                self.__sync_cond.wait()
+        finally:
+            self.__sync_cond.release()
+
+    def __sync_loop(self):
+        while True:
+            self.__sync_cond.acquire()
+            try:
+                while not (self.__unsynced or self.__sync_stopped):
+                    self.__sync_cond.wait()
+                if not self.__unsynced:
+                    return
+            finally:
+                self.__sync_cond.release()
+
+            #collecting writes of other callers
+            time.sleep(self.__group_sync_interval)
+
+            self.__sync_cond.acquire()
+            try:
+                self.__sync_started += 1
+                cur_round = self.__sync_started
+                entries = list(self.__unsynced)
+                self.__unsynced.clear()
+            finally:
+                self.__sync_cond.release()
+
+            for entry in entries:
+                entry.lock.acquire()
+                try:
+                    #closed md_obj is synced by close()
+                    if entry.md_obj is not None:
+                        entry.md_obj.sync()
+                except Exception, err:
+                    logger.error('Sync of metadata %s failed: %s'%(entry.path, err))
+                finally:
+                    entry.lock.release()
+
+            self.__sync_cond.acquire()
+            try:
+                self.__sync_done = cur_round
+                self.__sync_cond.notify_all()
+            finally:
+                self.__sync_cond.release()
+
+    def __stop_sync(self):
+        '''stop sync thread after sync of registered entries'''
+        self.__sync_cond.acquire()
+        try:
+            thread = self.__sync_thread
+            self.__sync_stopped = True
+            self.__sync_cond.notify_all()
+        finally:
+            self.__sync_cond.release()
+
+        if thread is not None:
+            thread.join()
+
+        self.__sync_cond.acquire()
+        try:
+            self.__sync_thread = None
+            self.__sync_stopped = False
+        finally:
+            self.__sync_cond.release()
+
+    def __open(self, entry):
+        if entry.md_obj is None:
+            entry.md_obj = UserMetadata(entry.path, self.__db_max_open_files, \
+                    sync_writes=self.__group_sync_interval <= 0)
+        return entry.md_obj
+
+    def call(self, path, method, *params, **kv_params):
+        group_sync = self.__group_sync_interval > 0
+        need_sync = False
+        entry = self.__pin(path)
+        try:
+            entry.lock.acquire()
+            try:
+                md_obj = self.__open(entry)
+                md_obj.block()
+                try:
+                    method = getattr(md_obj, method)
+                    ret = method(*params, **kv_params)
+                    need_sync = group_sync and md_obj.has_unsynced()
+                finally:
+                    md_obj.unblock()
+            finally:
+                entry.lock.release()
+        finally:
+            self.__unpin(entry)
+            self.__close_victims(self.__pin_victims(), wait=False)
+
+        if need_sync:
+            self.__wait_sync(entry)
+        return ret
+
+    def flush_idle(self):
+        '''close objects that are not used for idle_timeout seconds'''
+        self.__close_victims(self.__pin_victims(self.__idle_timeout))
+
+    def size(self):
         self.__lock.acquire()
         try:
-            if not path in self.__cached:
-                return
-            obj = self.__cached[path]
-            obj.block()
-            obj.close()
-            del self.__cached[path]
+            return len(self.__cached)
         finally:
             self.__lock.release()
+
+    def destroy(self):
+        '''close all objects (waiting for current calls)'''
+        self.__stop_sync()
+        self.__close_victims(self.__pin_victims(all_entries=True))
+
+    def close_md(self, path):
+        entry = self.__pin(path)
+        try:
+            self.__close(entry)
+        finally:
+            self.__unpin(entry)
+
+    def export_md(self, path, out_file):
+        '''write dump (see MDDump) of metadata snapshot to out_file
+        calls of metadata are blocked while snapshot is created only,
+        closing of metadata (by close_md, import_md, destroy or eviction)
+        waits for end of dump
+        return count of records'''
+        entry = self.__pin(path)
+        try:
+            entry.lock.acquire()
+            try:
+                snapshot = self.__open(entry).snapshot()
+                entry.exports += 1
+            finally:
+                entry.lock.release()
+
+            try:
+                return MDDump.dump(snapshot, out_file)
+            finally:
+                entry.lock.acquire()
+                try:
+                    entry.exports -= 1
+                    entry.exports_done.notify_all()
+                finally:
+                    entry.lock.release()
+        finally:
+            self.__unpin(entry)
+
+    def import_md(self, path, dump_file):
+        '''replace metadata at path by metadata from dump_file
+        dump is loaded to new DB, then opened metadata is closed
+        and directories are swapped under entry lock
+        return count of records'''
+        new_path = path + '.import'
+        old_path = path + '.old'
+        cnt = MDDump.load(dump_file, new_path)
+
+        entry = self.__pin(path)
+        try:
+            entry.lock.acquire()
+            try:
+                self.__close_locked(entry)
+                if os.path.exists(old_path):
+                    shutil.rmtree(old_path)
+                if os.path.exists(path):
+                    os.rename(path, old_path)
+                os.rename(new_path, path)
+            finally:
+                entry.lock.release()
+        finally:
+            self.__unpin(entry)
+
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        return cnt
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+"""
+Copyright (C) 2014 Konstantin Andrusenko
+    See the documentation for further information on copyrights,
+    or contact the author. All Rights Reserved.
+
+@package nimbus.async_client
+
+@author Konstantin Andrusenko
+@date June 16, 2014
+"""
+import threading
+
+from fabnet.core.fri_base import FabnetPacketRequest
+from fabnet.core.constants import RC_OK
+from fabnet.utils.logger import logger
+from fabnet_dht.constants import RC_NO_DATA, MIN_REPLICA_COUNT, RC_ALREADY_EXISTS, RC_NOT_MY_RANGE
+from nimbus.client import Nimbus, NimbusError, get_user_id_hash
+from nimbus.calls_executor import CallsExecutor, NodeExecutor, DEFAULT_MAX_CALLS_PER_NODE
+
+
+class NimbusFuture:
+    def __init__(self):
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+
+    def set_result(self, result):
+        self.__finish(result, None)
+
+    def set_error(self, error):
+        self.__finish(None, error)
+
+    def __finish(self, result, error):
+        self.__lock.acquire()
+        try:
+            if self.__event.is_set():
+                return
+            self.__result = result
+            self.__error = error
+            self.__event.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        finally:
+            self.__lock.release()
+
+        for callback in callbacks:
+            self.__run_callback(callback)
+
+    def __run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception, err:
+            logger.error('[NimbusFuture] done callback failed: %s'%err)
+
+    def add_done_callback(self, callback):
+        '''callback(future) is called when operation is finished'''
+        self.__lock.acquire()
+        try:
+            if not self.__event.is_set():
+                self.__callbacks.append(callback)
+                return
+        finally:
+            self.__lock.release()
+        self.__run_callback(callback)
+
+    def done(self):
+        return self.__event.is_set()
+
+    def result(self, timeout=None):
+        if not self.__event.wait(timeout):
+            raise NimbusError('Operation timeout')
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+
+class AsyncNimbus:
+    '''non-blocking Nimbus client
+    every method returns NimbusFuture object. Operations are chains of
+    FRI calls processed by per-node workers of CallsExecutor, so count of threads is
+    limited by max_calls_per_node for every node and does not depend on
+    count of outstanding operations. CallsExecutor is shared with wrapped
+    Nimbus object, so calls of both are limited together.
+    Keys are resolved by separate workers, so resolving does not take
+    calls slots of endpoint node (except GetKeysInfo call itself)
+    '''
+    def __init__(self, key_storage, endpoint, max_calls_per_node=DEFAULT_MAX_CALLS_PER_NODE, cache_ranges=True):
+        self.__executor = CallsExecutor(key_storage, max_calls_per_node)
+        self.__nimbus = Nimbus(key_storage, endpoint, cache_ranges=cache_ranges, \
+                                executor=self.__executor)
+        self.__resolver = NodeExecutor('resolver', max_calls_per_node)
+        self.__user_id_hash = get_user_id_hash(key_storage)
+        self.__endpoint = endpoint
+
+    def __call(self, nodeaddr, packet, callback):
+        self.__executor.call_async(nodeaddr, packet, callback)
+
+    def __resolve(self, key, replica_count, callback):
+        self.__resolver.submit(lambda: self.__nimbus.get_keys_info(key, replica_count), callback)
+
+    def close(self):
+        self.__resolver.stop()
+        self.__nimbus.close()
+
+    def get_keys_info(self, key, replica_count=MIN_REPLICA_COUNT):
+        future = NimbusFuture()
+        def on_keys(keys_info, err):
+            if err:
+                return future.set_error(err)
+            future.set_result(keys_info)
+
+        self.__resolve(key, replica_count, on_keys)
+        return future
+
+    def put_data_block(self, data_block, u_key=None, replica_count=MIN_REPLICA_COUNT, \
+                                    init_block=True, wait_writes=MIN_REPLICA_COUNT+1):
+        future = NimbusFuture()
+
+        def on_keys(keys_info, err):
+            if err:
+                return future.set_error(err)
+            key, _, nodeaddr = keys_info[0]
+            params = {'wait_writes_count': wait_writes, 'replica_count': replica_count, \
+                    'init_block': init_block, 'key': key}
+            packet_obj = FabnetPacketRequest(method='ClientPutData', parameters=params, binary_data=data_block)
+            self.__call(nodeaddr, packet_obj, on_put)
+
+        def on_put(ret_packet, err):
+            if err:
+                return future.set_error(NimbusError('ClientPutData error: %s'%err))
+            if (ret_packet.ret_code == RC_ALREADY_EXISTS) and (u_key is None):
+                return self.__resolve(None, replica_count, on_keys)
+            if ret_packet.ret_code != RC_OK:
+                return future.set_error(NimbusError('ClientPutData error: %s'%ret_packet.ret_message))
+            future.set_result(ret_packet.ret_parameters['key'])
+
+        self.__resolve(u_key, replica_count, on_keys)
+        return future
+
+    def get_data_block(self, key, replica_count=MIN_REPLICA_COUNT):
+        future = NimbusFuture()
+
+        errors = []
+
+        def on_keys(keys_info, err):
+            if err:
+                return future.set_error(err)
+            fetch(list(keys_info))
+
+        def fetch(keys_info):
+            if not keys_info:
+                if errors:
+                    return future.set_error(NimbusError('GetDataBlock error: %s'%'\n'.join(errors)))
+                return future.set_error(NimbusError('No data found!'))
+            key, dbct, nodeaddr = keys_info[0]
+            params = {'key': key, 'dbct': dbct, 'user_id_hash': self.__user_id_hash}
+            req = FabnetPacketRequest(method='GetDataBlock', parameters=params)
+            self.__call(nodeaddr, req, lambda resp, err: on_get(resp, err, keys_info[1:]))
+
+        def on_get(resp, err, rest_keys_info):
+            if err:
+                #node is not available, next replica is asked
+                errors.append(str(err))
+                return fetch(rest_keys_info)
+            if resp.ret_code == RC_OK:
+                return future.set_result(resp.binary_data)
+            if resp.ret_code in (RC_NO_DATA, RC_NOT_MY_RANGE):
+                return fetch(rest_keys_info)
+            future.set_error(NimbusError('GetDataBlock error: %s'%resp.ret_message))
+
+        self.__resolve(key, replica_count, on_keys)
+        return future
+
+    def delete_data_block(self, key, replica_count=MIN_REPLICA_COUNT):
+        future = NimbusFuture()
+
+        def on_delete(resp, err):
+            if err:
+                return future.set_error(NimbusError('ClientDeleteData error: %s'%err))
+            if resp.ret_code != RC_OK:
+                return future.set_error(NimbusError('ClientDeleteData error: %s' % resp.ret_message))
+            future.set_result(None)
+
+        params = {'key': key, 'replica_count': replica_count}
+        packet_obj = FabnetPacketRequest(method='ClientDeleteData', parameters=params)
+        self.__call(self.__endpoint, packet_obj, on_delete)
+        return future
+
+    def put_many(self, data_blocks, replica_count=MIN_REPLICA_COUNT, \
+                                    init_block=True, wait_writes=MIN_REPLICA_COUNT+1):
+        return [self.put_data_block(data_block, None, replica_count, init_block, wait_writes) \
+                    for data_block in data_blocks]
+
+    def get_many(self, keys, replica_count=MIN_REPLICA_COUNT):
+        return [self.get_data_block(key, replica_count) for key in keys]
+
+
+def wait_all(futures, timeout=None):
+    '''wait all futures and return list of results
+    first operation error is raised'''
+    return [future.result(timeout) for future in futures]
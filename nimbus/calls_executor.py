@@ -0,0 +1,197 @@
+#!/usr/bin/python
+"""
+Copyright (C) 2014 Konstantin Andrusenko
+    See the documentation for further information on copyrights,
+    or contact the author. All Rights Reserved.
+
+@package nimbus.calls_executor
+
+@author Konstantin Andrusenko
+@date June 14, 2014
+"""
+import Queue
+import threading
+
+from fabnet.core.fri_base import FabnetPacketResponse
+from fabnet.core.fri_client import FriClient
+from fabnet.core.constants import RC_ERROR
+from fabnet.utils.logger import logger
+
+DEFAULT_MAX_CALLS_PER_NODE = 4
+IDLE_WORKER_TIMEOUT = 5
+
+
+class NodeExecutor:
+    '''queue of jobs for one node processed by limited count of workers
+    workers are started on demand and are stopped after IDLE_WORKER_TIMEOUT
+    '''
+    def __init__(self, nodeaddr, max_workers):
+        self.__nodeaddr = nodeaddr
+        self.__max_workers = max_workers
+        self.__queue = Queue.Queue()
+        self.__lock = threading.Lock()
+        self.__workers = 0
+        #count of workers that are not processing a job
+        self.__idle = 0
+        #count of submitted jobs that are not taken by a worker yet
+        self.__pending = 0
+
+    def submit(self, func, callback):
+        '''func() is called in worker thread, then callback(result, error)'''
+        self.__lock.acquire()
+        try:
+            self.__pending += 1
+            self.__queue.put((func, callback))
+            if self.__pending <= self.__idle or self.__workers >= self.__max_workers:
+                return
+            self.__workers += 1
+            self.__idle += 1
+        finally:
+            self.__lock.release()
+
+        thread = threading.Thread(target=self.__worker)
+        thread.setName('NimbusWorker-%s'%self.__nodeaddr)
+        thread.setDaemon(True)
+        thread.start()
+
+    def __worker(self):
+        while True:
+            try:
+                item = self.__queue.get(timeout=IDLE_WORKER_TIMEOUT)
+            except Queue.Empty:
+                item = False
+
+            self.__lock.acquire()
+            try:
+                if item is None or (item is False and self.__pending < self.__idle):
+                    #stop() call or idle timeout
+                    self.__workers -= 1
+                    self.__idle -= 1
+                    return
+                if item is False:
+                    continue
+                self.__pending -= 1
+                self.__idle -= 1
+            finally:
+                self.__lock.release()
+
+            func, callback = item
+            try:
+                try:
+                    ret, error = func(), None
+                except Exception, err:
+                    ret, error = None, err
+                callback(ret, error)
+            except Exception, err:
+                logger.error('[NodeExecutor] callback of call to %s failed: %s'%(self.__nodeaddr, err))
+            finally:
+                self.__lock.acquire()
+                self.__idle += 1
+                self.__lock.release()
+
+    def stop(self):
+        self.__lock.acquire()
+        try:
+            workers = self.__workers
+        finally:
+            self.__lock.release()
+        for _ in xrange(workers):
+            self.__queue.put(None)
+
+
+class CallsExecutor:
+    '''bounded executor of FRI calls
+
+    FriClient opens connection for every call, so connections are not reused here.
+    Count of in-flight calls to one node is limited by max_calls_per_node and
+    parallel calls are processed by per-node workers that are reused between calls
+    '''
+    def __init__(self, key_storage, max_calls_per_node=DEFAULT_MAX_CALLS_PER_NODE):
+        self.__client = FriClient(key_storage)
+        self.__max_calls = max_calls_per_node
+        self.__lock = threading.Lock()
+        self.__slots = {}
+        self.__executors = {}
+
+    def get_max_calls(self):
+        return self.__max_calls
+
+    def __get_slots(self, nodeaddr):
+        self.__lock.acquire()
+        try:
+            slots = self.__slots.get(nodeaddr, None)
+            if slots is None:
+                slots = self.__slots[nodeaddr] = threading.BoundedSemaphore(self.__max_calls)
+            return slots
+        finally:
+            self.__lock.release()
+
+    def __get_executor(self, nodeaddr):
+        self.__lock.acquire()
+        try:
+            executor = self.__executors.get(nodeaddr, None)
+            if executor is None:
+                executor = self.__executors[nodeaddr] = NodeExecutor(nodeaddr, self.__max_calls)
+            return executor
+        finally:
+            self.__lock.release()
+
+    def call_sync(self, nodeaddr, packet):
+        slots = self.__get_slots(nodeaddr)
+        slots.acquire()
+        try:
+            return self.__client.call_sync(nodeaddr, packet)
+        finally:
+            slots.release()
+
+    def submit(self, nodeaddr, func, callback):
+        '''func() is called by worker of node, then callback(result, error)'''
+        self.__get_executor(nodeaddr).submit(func, callback)
+
+    def call_async(self, nodeaddr, packet, callback):
+        '''packet is sent by worker of node, then callback(response, error) is called'''
+        self.submit(nodeaddr, lambda: self.call_sync(nodeaddr, packet), callback)
+
+    def call_many(self, calls):
+        '''call list of (node address, packet) pairs
+        requests to one node are processed by up to max_calls_per_node
+        workers, requests to different nodes are processed in parallel
+        return list of responses in order of calls
+        '''
+        results = [None] * len(calls)
+        if not calls:
+            return results
+
+        left = [len(calls)]
+        lock = threading.Lock()
+        done = threading.Event()
+        def on_response(i):
+            def callback(resp, err):
+                if err is not None:
+                    resp = FabnetPacketResponse(ret_code=RC_ERROR, ret_message=str(err))
+                results[i] = resp
+                lock.acquire()
+                try:
+                    left[0] -= 1
+                    if left[0] == 0:
+                        done.set()
+                finally:
+                    lock.release()
+            return callback
+
+        for i, (nodeaddr, packet) in enumerate(calls):
+            self.call_async(nodeaddr, packet, on_response(i))
+
+        done.wait()
+        return results
+
+    def close(self):
+        self.__lock.acquire()
+        try:
+            executors = self.__executors.values()
+            self.__executors = {}
+        finally:
+            self.__lock.release()
+
+        for executor in executors:
+            executor.stop()
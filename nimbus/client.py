@@ -10,35 +10,175 @@ Copyright (C) 2014 Konstantin Andrusenko
 @date May 31, 2014
 """
 
+import time
+import Queue
 import hashlib
+import threading
+from collections import deque
 from M2Crypto import X509
 
 from fabnet.core.fri_base import FabnetPacketRequest, FabnetPacketResponse
-from fabnet.core.fri_client import FriClient
 from fabnet.core.constants import RC_OK, RC_ERROR
-from fabnet_dht.constants import RC_NO_DATA, MIN_REPLICA_COUNT, RC_ALREADY_EXISTS 
+from fabnet_dht.constants import RC_NO_DATA, MIN_REPLICA_COUNT, RC_ALREADY_EXISTS, RC_NOT_MY_RANGE
+from fabnet_dht.fs_mapped_ranges import FSMappedDHTRange
+from fabnet_dht.hash_ranges_table import HashRangesTable
+from fabnet_dht.key_utils import KeyUtils
+from fabnet_dht.ranges_gossip import NodeWeights
+from nimbus.calls_executor import CallsExecutor, DEFAULT_MAX_CALLS_PER_NODE
+
+LATENCY_SAMPLES = 256
+HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_DELAY = 0.5
+MIN_HEDGE_DELAY = 0.01
+DIR_PAGE_SIZE = 1000
 
 
 class NimbusError(Exception):
     pass
 
 
+class LatencyHistogram:
+    '''recent (latency, response size) samples of one node
+
+    percentile() is calculated over time to first response, that is latency
+    without transfer of response data. Transfer time per byte is fitted
+    by least squares over samples, so estimation does not depend on size of data blocks
+    '''
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.__samples = deque(maxlen=samples)
+        self.__lock = threading.Lock()
+
+    def add(self, latency, size=0):
+        self.__lock.acquire()
+        try:
+            self.__samples.append((latency, size))
+        finally:
+            self.__lock.release()
+
+    def __get_time_per_byte(self, samples):
+        cnt = float(len(samples))
+        mean_lat = sum([lat for lat, _ in samples]) / cnt
+        mean_size = sum([size for _, size in samples]) / cnt
+        var = sum([(size - mean_size) ** 2 for _, size in samples])
+        if not var:
+            return 0
+        cov = sum([(size - mean_size) * (lat - mean_lat) for lat, size in samples])
+        return max(0, cov / var)
+
+    def percentile(self, perc, default=None):
+        self.__lock.acquire()
+        try:
+            samples = list(self.__samples)
+        finally:
+            self.__lock.release()
+
+        if not samples:
+            return default
+        per_byte = self.__get_time_per_byte(samples)
+        samples = sorted([max(0, lat - size * per_byte) for lat, size in samples])
+        idx = min(len(samples)-1, int(len(samples) * perc / 100.))
+        return samples[idx]
+
+
+def get_user_id_hash(key_storage):
+    if key_storage:
+        cert = X509.load_cert_string(key_storage.cert())
+        user_id = cert.get_subject().CN
+    else:
+        user_id = 'None'
+    return hashlib.sha1(user_id).hexdigest()
+
+
 class Nimbus:
-    def __init__(self, key_storage, endpoint):
-        if key_storage:
-            cert = X509.load_cert_string(key_storage.cert())
-            user_id = cert.get_subject().CN
-        else:
-            user_id = 'None'
-        self.__user_id_hash = hashlib.sha1(user_id).hexdigest()
-        self.__client = FriClient(key_storage)
+    def __init__(self, key_storage, endpoint, cache_ranges=True, hedged_reads=False, \
+                                max_calls_per_node=DEFAULT_MAX_CALLS_PER_NODE, zone=None, executor=None):
+        '''executor - CallsExecutor object shared with other client (see AsyncNimbus)
+        if it is None, own executor is created with max_calls_per_node limit'''
+        self.__user_id_hash = get_user_id_hash(key_storage)
+        if executor is None:
+            executor = CallsExecutor(key_storage, max_calls_per_node)
+        self.__executor = executor
         self.__endpoint = endpoint
 
-    def __get_keys_info(self, key, replica_count):
+        self.__cache_ranges = cache_ranges
+        self.__ranges_table = HashRangesTable()
+        self.__node_weights = NodeWeights()
+        self.__ranges_lock = threading.Lock()
+        self.__zone = zone
+
+        self.__hedged_reads = hedged_reads
+        self.__latencies = {}
+        self.__latencies_lock = threading.Lock()
+
+    def __get_latency_hist(self, nodeaddr):
+        self.__latencies_lock.acquire()
+        try:
+            hist = self.__latencies.get(nodeaddr, None)
+            if hist is None:
+                hist = self.__latencies[nodeaddr] = LatencyHistogram()
+            return hist
+        finally:
+            self.__latencies_lock.release()
+
+    def get_hedge_delay(self, nodeaddr):
+        '''delay (in seconds) before asking next replica if node is not responding'''
+        delay = self.__get_latency_hist(nodeaddr).percentile(HEDGE_PERCENTILE, DEFAULT_HEDGE_DELAY)
+        return max(delay, MIN_HEDGE_DELAY)
+
+    def refresh_ranges_table(self):
+        '''fetch hash ranges table from endpoint node
+        return True if table is loaded
+        '''
+        self.__ranges_lock.acquire()
+        try:
+            packet = FabnetPacketRequest(method='GetRangesTable')
+            ret_packet = self.__executor.call_sync(self.__endpoint, packet)
+            if ret_packet.ret_code != RC_OK:
+                return False
+            self.__ranges_table.load(str(ret_packet.ret_parameters['ranges_table']))
+            self.__node_weights.merge(ret_packet.ret_parameters.get('node_weights', {}))
+            return True
+        finally:
+            self.__ranges_lock.release()
+
+    def get_keys_info(self, key, replica_count=MIN_REPLICA_COUNT, lookup_keys=False):
+        '''return list of (key, dbct, node address) of master key and replica keys
+        if lookup_keys is True, fallback keys of replicas (see KeyUtils.get_fallback_keys)
+        are appended, they are used for reading of replicas saved with other
+        ranges table or zones of nodes'''
+        if self.__cache_ranges:
+            if self.__ranges_table.empty():
+                self.refresh_ranges_table()
+            keys_info = self.__get_local_keys_info(key, replica_count, lookup_keys)
+            if keys_info:
+                return keys_info
+
+        return self.__get_remote_keys_info(key, replica_count, lookup_keys)
+
+    def __get_local_keys_info(self, key, replica_count, lookup_keys):
+        if key is None:
+            key = KeyUtils.generate_key(self.__user_id_hash)
+        keys = KeyUtils.get_zone_aware_keys(key, replica_count, self.__ranges_table, self.__node_weights)
+        dbcts = [FSMappedDHTRange.DBCT_MASTER] + [FSMappedDHTRange.DBCT_REPLICA] * replica_count
+        if lookup_keys:
+            for f_keys in KeyUtils.get_fallback_keys(key, replica_count, keys):
+                keys += f_keys
+                dbcts += [FSMappedDHTRange.DBCT_REPLICA] * len(f_keys)
+
+        keys_info = []
+        ranges = self.__ranges_table.find_many([long(key, 16) for key in keys])
+        for key, cur_dbct, range_obj in zip(keys, dbcts, ranges):
+            if not range_obj:
+                return None
+            keys_info.append((key, cur_dbct, range_obj.node_address))
+        return keys_info
+
+    def __get_remote_keys_info(self, key, replica_count, lookup_keys):
         packet = FabnetPacketRequest(method='GetKeysInfo', \
-                parameters={'key': key, 'replica_count': replica_count})
+                parameters={'key': key, 'replica_count': replica_count, 'zone': self.__zone, \
+                        'lookup_keys': lookup_keys})
 
-        ret_packet = self.__client.call_sync(self.__endpoint, packet)
+        ret_packet = self.__executor.call_sync(self.__endpoint, packet)
         if ret_packet.ret_code != RC_OK:
             raise NimbusError('GetKeysInfo error: %s'%ret_packet.ret_message)
         keys_info = ret_packet.ret_parameters.get('keys_info', None)
@@ -47,16 +187,18 @@ class Nimbus:
 
         return keys_info
 
+    def __put_packet(self, data_block, key, replica_count, init_block, wait_writes):
+        params = {'wait_writes_count': wait_writes, 'replica_count': replica_count, \
+                'init_block': init_block, 'key': key}
+        return FabnetPacketRequest(method='ClientPutData', parameters=params, binary_data=data_block)
+
     def put_data_block(self, data_block, u_key=None, replica_count=MIN_REPLICA_COUNT, \
                                     init_block=True, wait_writes=MIN_REPLICA_COUNT+1):
-        keys_info = self.__get_keys_info(u_key, replica_count)
+        keys_info = self.get_keys_info(u_key, replica_count)
         key, _, nodeaddr = keys_info[0]
 
-        params = {'wait_writes_count': wait_writes, 'replica_count': replica_count, \
-                'init_block': init_block, 'key': key}
-        packet_obj = FabnetPacketRequest(method='ClientPutData', parameters=params, binary_data=data_block)
-
-        ret_packet = self.__client.call_sync(nodeaddr, packet_obj)
+        packet_obj = self.__put_packet(data_block, key, replica_count, init_block, wait_writes)
+        ret_packet = self.__executor.call_sync(nodeaddr, packet_obj)
 
         if (ret_packet.ret_code == RC_ALREADY_EXISTS) and (u_key is None):
             return self.put_data_block(data_block, u_key, replica_count, init_block, wait_writes)
@@ -65,25 +207,299 @@ class Nimbus:
             raise NimbusError('ClientPutData error: %s'%ret_packet.ret_message)
         return ret_packet.ret_parameters['key']
 
-    def get_data_block(self, key, replica_count=MIN_REPLICA_COUNT):
-        keys_info = self.__get_keys_info(key, replica_count)
+    def put_many(self, data_blocks, replica_count=MIN_REPLICA_COUNT, \
+                                    init_block=True, wait_writes=MIN_REPLICA_COUNT+1):
+        '''save list of data blocks with generated keys
+        requests are sent to owner nodes in parallel by calls executor
+        return list of keys in order of data blocks
+        '''
+        keys = []
+        for ret_packet in self._put_blocks(data_blocks, replica_count, init_block, wait_writes):
+            if ret_packet.ret_code != RC_OK:
+                raise NimbusError('ClientPutData error: %s'%ret_packet.ret_message)
+            keys.append(ret_packet.ret_parameters['key'])
+        return keys
+
+    def _put_blocks(self, data_blocks, replica_count, init_block, wait_writes):
+        calls = []
+        for data_block in data_blocks:
+            key, _, nodeaddr = self.get_keys_info(None, replica_count)[0]
+            calls.append((nodeaddr, self.__put_packet(data_block, key, replica_count, init_block, wait_writes)))
+
+        ret_list = []
+        for data_block, (_, packet_obj), ret_packet in zip(data_blocks, calls, self.__executor.call_many(calls)):
+            while ret_packet.ret_code == RC_ALREADY_EXISTS:
+                key, _, nodeaddr = self.get_keys_info(None, replica_count)[0]
+                packet_obj = self.__put_packet(data_block, key, replica_count, init_block, wait_writes)
+                ret_packet = self.__executor.call_sync(nodeaddr, packet_obj)
+            ret_list.append(ret_packet)
+        return ret_list
+
+    def open_upload(self, obj_path, replica_count=MIN_REPLICA_COUNT, wait_writes=MIN_REPLICA_COUNT+1):
+        '''open multipart upload session for object
+        return MultipartUpload object'''
+        return MultipartUpload(self, obj_path, replica_count, wait_writes)
+
+    def commit_object(self, obj_path, data_blocks):
+        '''update object metadata with list of saved data blocks
+        data_blocks - list of (db_key, replica_count, seek, size)
+        '''
+        params = {'obj_path': obj_path, 'data_blocks': data_blocks}
+        packet_obj = FabnetPacketRequest(method='CommitObject', parameters=params)
+        resp = self.__executor.call_sync(self.__endpoint, packet_obj)
+        if resp.ret_code != RC_OK:
+            raise NimbusError('CommitObject error: %s' % resp.ret_message)
+
+    def get_object_info(self, obj_path, req_user_info=False, limit=0, cursor=None):
+        '''return dict with path_info (and user_info if req_user_info is True)
+        if limit > 0, at most limit children of directory are returned
+        and path_info['cursor'] should be passed for getting next page'''
+        params = {'obj_path': obj_path, 'req_user_info': req_user_info, 'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        packet_obj = FabnetPacketRequest(method='GetObjectInfo', parameters=params)
+        resp = self.__executor.call_sync(self.__endpoint, packet_obj)
+        if resp.ret_code != RC_OK:
+            raise NimbusError('GetObjectInfo error: %s' % resp.ret_message)
+        return resp.ret_parameters
+
+    def iter_dir(self, obj_path, page_size=DIR_PAGE_SIZE):
+        '''iterate over children of directory (dicts with name and type)
+        listing is fetched by pages of page_size children'''
+        cursor = None
+        while True:
+            path_info = self.get_object_info(obj_path, limit=page_size, cursor=cursor)['path_info']
+            for child in path_info['children']:
+                yield child
+            cursor = path_info.get('cursor', None)
+            if not cursor:
+                break
+
+    def __get_packet(self, key, dbct):
+        params = {'key': key, 'dbct': dbct, 'user_id_hash': self.__user_id_hash}
+        return FabnetPacketRequest(method='GetDataBlock', parameters=params)
+
+    def __call_get_data_block(self, key, dbct, nodeaddr):
+        req = self.__get_packet(key, dbct)
+
+        t0 = time.time()
+        try:
+            resp = self.__executor.call_sync(nodeaddr, req)
+        except Exception, err:
+            return FabnetPacketResponse(ret_code=RC_ERROR, ret_message=str(err))
+        if resp.ret_code != RC_ERROR:
+            size = resp.ret_parameters.get('size', 0) if resp.ret_code == RC_OK else 0
+            self.__get_latency_hist(nodeaddr).add(time.time() - t0, size)
+        return resp
 
+    def __sequential_get(self, keys_info):
         for key, dbct, nodeaddr in keys_info:
-            params = {'key': key, 'dbct': dbct, 'user_id_hash': self.__user_id_hash}
-            req = FabnetPacketRequest(method='GetDataBlock', parameters=params)
+            resp = self.__call_get_data_block(key, dbct, nodeaddr)
+            if resp.ret_code in (RC_OK, RC_NO_DATA, RC_NOT_MY_RANGE):
+                yield resp
+                continue
+            raise NimbusError('GetDataBlock error: %s'%resp.ret_message)
+
+    def __hedged_get(self, keys_info):
+        '''replicas are asked by persistent workers of nodes.
+        If node does not respond for its hedge delay, next replica is asked.
+        Last replica (nothing to hedge) is asked in calling thread.
+        First valid response wins'''
+        results = Queue.Queue()
+
+        def launch(key, dbct, nodeaddr):
+            self.__executor.submit(nodeaddr, lambda: self.__call_get_data_block(key, dbct, nodeaddr), \
+                    lambda resp, err: results.put(resp or \
+                        FabnetPacketResponse(ret_code=RC_ERROR, ret_message=str(err))))
+
+        pending = list(keys_info)
+        in_flight = 0
+        last_node = None
+        errors = []
+        while pending or in_flight:
+            if len(pending) == 1 and not in_flight:
+                key, dbct, last_node = pending.pop(0)
+                resp = self.__call_get_data_block(key, dbct, last_node)
+            else:
+                if pending and not in_flight:
+                    key, dbct, last_node = pending.pop(0)
+                    launch(key, dbct, last_node)
+                    in_flight += 1
+
+                timeout = self.get_hedge_delay(last_node) if pending else None
+                try:
+                    resp = results.get(timeout=timeout)
+                except Queue.Empty:
+                    #no response from slow replica, asking next one
+                    key, dbct, last_node = pending.pop(0)
+                    launch(key, dbct, last_node)
+                    in_flight += 1
+                    continue
+                in_flight -= 1
 
-            resp = self.__client.call_sync(nodeaddr, req)
             if resp.ret_code == RC_OK:
-                return resp.binary_data
-            if resp.ret_code == RC_NO_DATA:
+                #responses of other replicas are ignored
+                yield resp
+                return
+            if resp.ret_code in (RC_NO_DATA, RC_NOT_MY_RANGE):
+                yield resp
                 continue
-            raise NimbusError('GetDataBlock error: %s'%resp.ret_message)
+            errors.append(resp.ret_message)
+
+        if errors:
+            raise NimbusError('GetDataBlock error: %s'%'\n'.join(errors))
+
+    def __sort_by_zone(self, keys_info):
+        '''replicas from client zone are read first'''
+        if not self.__zone:
+            return keys_info
+        return sorted(keys_info, key=lambda k_info: self.__node_weights.get_zone(k_info[2]) != self.__zone)
+
+    def get_data_block(self, key, replica_count=MIN_REPLICA_COUNT, refresh_ranges=True):
+        keys_info = self.get_keys_info(key, replica_count, lookup_keys=True)
+        master_key = keys_info[0][0]
+        fallback_keys_info = keys_info[replica_count+1:]
+        keys_info = self.__sort_by_zone(keys_info[:replica_count+1])
+
+        if self.__hedged_reads:
+            responses = self.__hedged_get(keys_info)
+        else:
+            responses = self.__sequential_get(keys_info)
+
+        need_refresh = False
+        for resp in responses:
+            if resp.ret_code == RC_OK:
+                return resp.binary_data
+            if resp.ret_code == RC_NOT_MY_RANGE:
+                need_refresh = True
+
+        #replicas saved with other ranges table or zones of nodes
+        #(not moved by repair process yet) are asked in parallel
+        calls = [(nodeaddr, self.__get_packet(key, dbct)) for key, dbct, nodeaddr in fallback_keys_info]
+        for resp in self.__executor.call_many(calls):
+            if resp.ret_code == RC_OK:
+                return resp.binary_data
+            if resp.ret_code == RC_NOT_MY_RANGE:
+                need_refresh = True
+
+        if need_refresh and refresh_ranges:
+            self.refresh_ranges_table()
+            return self.get_data_block(master_key, replica_count, refresh_ranges=False)
         raise NimbusError('No data found!')
 
+    def get_many(self, keys, replica_count=MIN_REPLICA_COUNT):
+        '''get list of data blocks
+        master copies are requested in pipelined mode,
+        missed data blocks are requested from replicas one by one
+        return list of binary data objects in order of keys
+        '''
+        calls = []
+        for key in keys:
+            key, dbct, nodeaddr = self.get_keys_info(key, replica_count)[0]
+            calls.append((nodeaddr, self.__get_packet(key, dbct)))
+
+        ret_list = []
+        for key, resp in zip(keys, self.__executor.call_many(calls)):
+            if resp.ret_code == RC_OK:
+                ret_list.append(resp.binary_data)
+            else:
+                ret_list.append(self.get_data_block(key, replica_count))
+        return ret_list
+
     def delete_data_block(self, key, replica_count=MIN_REPLICA_COUNT):
         params = {'key': key, 'replica_count': replica_count}
         packet_obj = FabnetPacketRequest(method='ClientDeleteData', parameters=params)
-        resp = self.__client.call_sync(self.__endpoint, packet_obj)
+        resp = self.__executor.call_sync(self.__endpoint, packet_obj)
         if resp.ret_code != RC_OK:
             raise NimbusError('ClientDeleteData error: %s' % resp.ret_message)
 
+    def close(self):
+        '''stop workers of parallel calls'''
+        self.__executor.close()
+
+
+
+class MultipartUpload:
+    '''multipart upload session
+    object parts are saved as data blocks in parallel,
+    object metadata is updated once by commit() call.
+    abort() removes all saved parts.
+    '''
+    def __init__(self, nimbus, obj_path, replica_count, wait_writes):
+        self.__nimbus = nimbus
+        self.__obj_path = obj_path
+        self.__replica_count = replica_count
+        self.__wait_writes = wait_writes
+        self.__parts = {}
+        self.__lock = threading.Lock()
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__closed:
+            return
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def __check_closed(self):
+        if self.__closed:
+            raise NimbusError('Upload session of %s is already closed'%self.__obj_path)
+
+    def put_part(self, seek, data):
+        self.put_parts([(seek, data)])
+
+    def put_parts(self, parts):
+        '''save object parts in parallel
+        parts - list of (seek, data)
+        '''
+        self.__check_closed()
+        data_blocks = [data for _, data in parts]
+        ret_list = self.__nimbus._put_blocks(data_blocks, self.__replica_count, True, self.__wait_writes)
+
+        errors = []
+        replaced = []
+        self.__lock.acquire()
+        try:
+            for (seek, _), ret_packet in zip(parts, ret_list):
+                if ret_packet.ret_code != RC_OK:
+                    errors.append('[seek=%s] %s'%(seek, ret_packet.ret_message))
+                    continue
+                old_part = self.__parts.get(seek, None)
+                if old_part:
+                    replaced.append(old_part[0])
+                self.__parts[seek] = (ret_packet.ret_parameters['key'], ret_packet.ret_parameters['size'])
+        finally:
+            self.__lock.release()
+
+        self.__delete_blocks(replaced)
+        if errors:
+            raise NimbusError('ClientPutData error: %s'%'\n'.join(errors))
+
+    def get_data_blocks(self):
+        self.__lock.acquire()
+        try:
+            return [(key, self.__replica_count, seek, size) \
+                    for seek, (key, size) in sorted(self.__parts.items())]
+        finally:
+            self.__lock.release()
+
+    def commit(self):
+        self.__check_closed()
+        self.__nimbus.commit_object(self.__obj_path, self.get_data_blocks())
+        self.__closed = True
+
+    def abort(self):
+        self.__check_closed()
+        self.__closed = True
+        self.__delete_blocks([key for key, _, _, _ in self.get_data_blocks()])
+
+    def __delete_blocks(self, keys):
+        for key in keys:
+            try:
+                self.__nimbus.delete_data_block(key, self.__replica_count)
+            except NimbusError:
+                pass
@@ -1,6 +1,7 @@
 import unittest
 from test_utils import *
 from M2Crypto import RSA, X509, EVP
+from nimbus.client import Nimbus
 
 class TestDHTInitProcedure(unittest.TestCase):
     NODES = [(1986, '/tmp/dht_1986_home', NODE1_KS), (1987, '/tmp/dht_1987_home', NODE2_KS)]
@@ -252,6 +253,29 @@ class TestDHTInitProcedure(unittest.TestCase):
 
         self.assertEqual(ret.ret_code, 0, ret.ret_message)
 
+        #multipart upload
+        nimbus = Nimbus(client_ks, '127.0.0.1:%s'%servers[0].port)
+        with nimbus.open_upload('/multipart.out') as upload:
+            upload.put_parts([(0, data), (len(data), data2)])
+            upload.put_part(len(data)+len(data2), data3)
+        ret = servers[1].get_object_info('/multipart.out', client_ks)
+        self.assertEqual(ret.ret_code, 0, ret.ret_message)
+        self.assertEqual(len(ret.ret_parameters['data_blocks']), 3)
+        self.assertEqual(ret.ret_parameters['data_blocks'][2]['seek'], len(data)+len(data2))
+        self.assertEqual(ret.ret_parameters['data_blocks'][2]['size'], len(data3))
+
+        upload = nimbus.open_upload('/aborted.out')
+        upload.put_parts([(0, data), (len(data), data2)])
+        keys = [db[0] for db in upload.get_data_blocks()]
+        upload.abort()
+        ret = servers[1].get_object_info('/aborted.out', client_ks)
+        self.assertEqual(ret.ret_code, RC_ERROR, ret.ret_message)
+        for key in keys:
+            keys_info = servers[0].get_keys_info(key)
+            server = servers[0] if keys_info[0][2].endswith('86') else servers[1]
+            ret = server.get_data_block(key, FSMappedDHTRange.DBCT_MASTER, client_ks)
+            self.assertEqual(ret.ret_code, RC_NO_DATA, ret.ret_message)
+
     def test02_dht_restore_after_network_fail(self):
         servers = []
         try:
@@ -551,6 +575,132 @@ class TestDHTInitProcedure(unittest.TestCase):
             if monitor:
                 monitor.stop()
 
+    def test06_virtual_ranges_restart(self):
+        servers = []
+        try:
+            N = self.NODES
+            server = TestServerThread(N[0][0], N[0][1], config={'MAX_USED_SIZE_PERCENTS': 99},  ks_path=N[0][2])
+            servers.append(server)
+            server.start()
+            time.sleep(1)
+
+            server = TestServerThread(N[1][0], N[1][1], neighbour='127.0.0.1:%s'%N[0][0], \
+                    config={'VIRTUAL_RANGES_COUNT': 2}, ks_path=N[1][2])
+            servers.append(server)
+            server.start()
+            time.sleep(.2)
+            server.wait_oper_status(DS_NORMALWORK)
+            server, server1 = servers
+
+            #1987 node owns main range and virtual range
+            table = self._wait_ranges_table(server, lambda ranges: len(ranges) == 3)
+            vrange = [r for r in table.iter_table() if r.node_address.endswith('87')][0]
+            keys = ['%040x'%(vrange.start + i*vrange.length()/10) for i in xrange(10)]
+            for key in keys:
+                ret = server1.put_data_block('virtual range data', key)
+                self.assertEqual(ret.ret_code, 0, ret.ret_message)
+
+            print 'RESTARTING 1987 NODE WITHOUT VIRTUAL RANGES'
+            server1.stop()
+            server1 = TestServerThread(N[1][0], N[1][1], neighbour='127.0.0.1:%s'%N[0][0], \
+                    config={}, ks_path=N[1][2], clear_home=False)
+            servers[1] = server1
+            server1.start()
+            time.sleep(.2)
+            server1.wait_oper_status(DS_NORMALWORK)
+
+            #released virtual range is removed from ranges table and its keys are owned by 1986 node
+            def released(ranges):
+                owned = [r for r in ranges if r.node_address.endswith('87')]
+                return len(owned) == 1 and ranges[0].start == MIN_KEY and ranges[-1].end == MAX_KEY \
+                        and all(ranges[i].end+1 == ranges[i+1].start for i in xrange(len(ranges)-1))
+            self._wait_ranges_table(server1, released)
+            table = self._wait_ranges_table(server, released)
+            for key in keys:
+                self.assertTrue(table.find(long(key, 16)).node_address.endswith('86'))
+
+            #data blocks of released virtual range are moved to new owner
+            client_ks = init_keystore(USER1_KS, USER_PWD)
+            for i in xrange(20):
+                if all(server.get_data_block(key, client_ks=client_ks).ret_code == 0 for key in keys):
+                    break
+                time.sleep(.5)
+            for key in keys:
+                ret = server.get_data_block(key, client_ks=client_ks)
+                self.assertEqual(ret.ret_code, 0, ret.ret_message)
+                self.assertEqual(ret.binary_data.data(), 'virtual range data')
+        finally:
+            for server in servers:
+                server.stop()
+
+    def test07_virtual_ranges_restore(self):
+        servers = []
+        try:
+            N = self.NODES
+            server = TestServerThread(N[0][0], N[0][1], config={'MAX_USED_SIZE_PERCENTS': 99},  ks_path=N[0][2])
+            servers.append(server)
+            server.start()
+            time.sleep(1)
+
+            server = TestServerThread(N[1][0], N[1][1], neighbour='127.0.0.1:%s'%N[0][0], \
+                    config={'VIRTUAL_RANGES_COUNT': 2}, ks_path=N[1][2])
+            servers.append(server)
+            server.start()
+            time.sleep(.2)
+            server.wait_oper_status(DS_NORMALWORK)
+            server, server1 = servers
+
+            self._wait_ranges_table(server, lambda ranges: len(ranges) == 3)
+            vrange = server1.operator.get_local_ranges()[1]
+            v_start, v_end = vrange.get_start(), vrange.get_end()
+            keys = ['%040x'%(v_start + i*vrange.length()/10) for i in xrange(10)]
+            for key in keys:
+                ret = server1.put_data_block('virtual range data', key)
+                self.assertEqual(ret.ret_code, 0, ret.ret_message)
+
+            print 'RESTARTING 1987 NODE WITH VIRTUAL RANGES'
+            server1.stop()
+            server1 = TestServerThread(N[1][0], N[1][1], neighbour='127.0.0.1:%s'%N[0][0], \
+                    config={'VIRTUAL_RANGES_COUNT': 2}, ks_path=N[1][2], clear_home=False)
+            servers[1] = server1
+            server1.start()
+            time.sleep(.2)
+            server1.wait_oper_status(DS_NORMALWORK)
+
+            #virtual range is restored with the same scope
+            def restored(ranges):
+                return (v_start, v_end) in [(r.start, r.end) for r in ranges if r.node_address.endswith('87')]
+            self._wait_ranges_table(server1, restored, timeout=30)
+            self._wait_ranges_table(server, restored, timeout=30)
+            local_ranges = server1.operator.get_local_ranges()
+            self.assertEqual([(r.get_start(), r.get_end()) for r in local_ranges[1:]], [(v_start, v_end)])
+
+            client_ks = init_keystore(USER1_KS, USER_PWD)
+            for key in keys:
+                ret = server1.get_data_block(key, client_ks=client_ks)
+                self.assertEqual(ret.ret_code, 0, ret.ret_message)
+                self.assertEqual(ret.binary_data.data(), 'virtual range data')
+
+            #subrange of virtual range is splitted
+            server1.operator.split_range(v_end - vrange.length()/2, v_end)
+            self.assertTrue(server1.operator.get_dht_range(v_end).get_subranges())
+            self.assertFalse(server1.operator.get_dht_range().get_subranges())
+            with self.assertRaises(Exception):
+                server1.operator.split_range(v_start, v_start + 10)
+            server1.operator.join_subranges()
+            self.assertFalse(server1.operator.get_dht_range(v_end).get_subranges())
+        finally:
+            for server in servers:
+                server.stop()
+
+    def _wait_ranges_table(self, server, predicate, timeout=15):
+        for i in xrange(int(timeout/.5)):
+            table = HashRangesTable()
+            table.load(server.operator.dump_ranges_table())
+            if predicate(list(table.iter_table())):
+                return table
+            time.sleep(.5)
+        raise Exception('[%s] ranges table wait timeouted'%server.port)
 
 
     def _make_fake_hdd(self, name, size, dev='/dev/loop0'):
@@ -264,6 +264,24 @@ class TestFSMappedRanges(unittest.TestCase):
         self.assertEqual(last.get_start(), long(START_RANGE_HASH, 16))
         self.assertEqual(last.get_end(), long(END_RANGE_HASH, 16))
 
+    def test03_move_data(self):
+        fs_ranges = FSMappedDHTRange(START_RANGE_HASH, END_RANGE_HASH, TEST_FS_RANGE_DIR)
+        vrange_path = os.path.join(TEST_FS_RANGE_DIR, 'vrange_test')
+        os.mkdir(vrange_path)
+        vrange = FSMappedDHTRange('%040x'%100, '%040x'%200, vrange_path)
+        self.assertEqual(vrange.get_path(), vrange_path)
+
+        key = '%040x'%150
+        with ThreadSafeDataBlock(vrange.get_db_path(key, FSMappedDHTRange.DBCT_MASTER)) as db:
+            db.write('test data')
+
+        vrange.move_data(fs_ranges)
+        self.assertEqual(list(vrange.iterator(all_data=True)), [])
+        path = fs_ranges.get_db_path(key, FSMappedDHTRange.DBCT_MASTER, for_write=False)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+        shutil.rmtree(vrange_path)
+
 
 
 if __name__ == '__main__':
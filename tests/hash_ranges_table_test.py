@@ -0,0 +1,204 @@
+import unittest
+import threading
+import time
+import pickle
+import sys
+
+sys.path.append('fabnet_core')
+
+from fabnet_dht.hash_ranges_table import HashRangesTable, HashRange, RangeException, RangesDump, \
+        RangesSnapshot
+from fabnet_dht.constants import MIN_KEY, MAX_KEY
+
+
+def make_table(parts, prefix='node'):
+    table = HashRangesTable()
+    step = (MAX_KEY + 1) / parts
+    for i in xrange(parts):
+        end = MAX_KEY if i == parts-1 else (i+1)*step - 1
+        table.append(i*step, end, '%s%s'%(prefix, i))
+    return table
+
+
+class FindThread(threading.Thread):
+    def __init__(self, table, cnt):
+        threading.Thread.__init__(self)
+        self.table = table
+        self.cnt = cnt
+        self.errors = []
+
+    def run(self):
+        for i in xrange(self.cnt):
+            key = (MAX_KEY / self.cnt) * i
+            if self.table.find(key) is None:
+                self.errors.append(key)
+
+
+class TestHashRangesTable(unittest.TestCase):
+    def test00_append_remove(self):
+        table = HashRangesTable()
+        self.assertTrue(table.empty())
+        table.append(100, 200, 'node1')
+        table.append(0, 99, 'node0')
+        table.append(201, 300, 'node2')
+        table.append(100, 200, 'node1')
+        self.assertEqual(table.count(), 3)
+        self.assertEqual(table.get_mod_index(), 3)
+        self.assertEqual([r.node_address for r in table.iter_table()], ['node0', 'node1', 'node2'])
+
+        with self.assertRaises(RangeException):
+            table.append(150, 250, 'node3')
+
+        self.assertEqual(table.find(150).node_address, 'node1')
+        self.assertEqual(table.find_next(150).node_address, 'node2')
+        self.assertEqual(table.find_next(250), None)
+        self.assertEqual(table.find(301), None)
+
+        table.remove(150)
+        self.assertEqual(table.find(150), None)
+        self.assertEqual(table.count(), 2)
+        self.assertEqual(table.get_mod_index(), 4)
+
+    def test01_apply_changes(self):
+        table = make_table(4)
+        first, second = table.copy()[:2]
+        snapshot = table.get_snapshot()
+
+        table.apply_changes([first, second], [HashRange(first.start, second.end, 'node_new')])
+        self.assertEqual(table.count(), 3)
+        self.assertEqual(table.find(first.start).node_address, 'node_new')
+        self.assertEqual(table.find(second.end).node_address, 'node_new')
+
+        #old snapshot is not changed
+        self.assertEqual(len(snapshot.ranges), 4)
+        self.assertEqual(snapshot.ranges[0].node_address, 'node0')
+
+    def test02_dump_load(self):
+        table = make_table(10)
+        table2 = HashRangesTable()
+        table2.load(table.dump())
+        self.assertEqual(table.get_checksum(), table2.get_checksum())
+        self.assertEqual(table.get_mod_index(), table2.get_mod_index())
+        self.assertEqual(table.get_last_dm(), table2.get_last_dm())
+        self.assertEqual(table2.find(MAX_KEY).node_address, 'node9')
+
+        #ranges table with holes
+        table.remove(MIN_KEY)
+        table.remove(MAX_KEY/2)
+        table2.load(table.dump())
+        self.assertEqual(table.get_checksum(), table2.get_checksum())
+        self.assertEqual(table2.find(MIN_KEY), None)
+
+        dump = table.dump()
+        for bad_dump in ['', 'FHRT', dump[:-1], dump + '\x00', 'XXXX' + dump[4:], \
+                dump[:4] + '\x02' + dump[5:], pickle.dumps([1, 2, 3])]:
+            with self.assertRaises(RangeException):
+                RangesDump.unpack(bad_dump)
+
+        #dump of previous release
+        table2 = HashRangesTable()
+        table2.load(pickle.dumps([table.copy(), table.get_last_dm(), table.get_mod_index()]))
+        self.assertEqual(table.get_checksum(), table2.get_checksum())
+        self.assertEqual(table.get_mod_index(), table2.get_mod_index())
+        self.assertEqual(table2.find(MIN_KEY), None)
+
+    def test03_concurrent_find(self):
+        table = make_table(64)
+        threads = [FindThread(table, 1000) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+
+        ranges = table.copy()
+        for _ in xrange(10):
+            for range_obj in ranges[:8]:
+                table.remove(range_obj.start)
+                table.append(range_obj.start, range_obj.end, range_obj.node_address)
+            table.apply_changes(ranges[8:10], ranges[8:10])
+
+        for thread in threads:
+            thread.join()
+        self.assertEqual(table.count(), 64)
+
+    def test04_find_many(self):
+        table = make_table(16)
+        table.remove(MAX_KEY/2)
+        keys = [MAX_KEY, MIN_KEY, MAX_KEY/2, MAX_KEY/3, MAX_KEY/3, 100500]
+        found = table.find_many(keys)
+        self.assertEqual(len(found), len(keys))
+        for key, range_obj in zip(keys, found):
+            self.assertEqual(range_obj, table.find(key))
+        self.assertEqual(found[2], None)
+
+        with self.assertRaises(RangeException):
+            table.append(MIN_KEY, MAX_KEY, 'node_all')
+
+    def test05_changes_log(self):
+        table = make_table(8)
+        table2 = HashRangesTable()
+        table2.load(table.dump())
+        mod_index = table2.get_mod_index()
+        self.assertEqual(table.get_changes(mod_index)[0], [])
+
+        first, second = table.copy()[:2]
+        table.apply_changes([first, second], [HashRange(first.start, second.end, 'node_new')])
+        table.remove(MAX_KEY)
+
+        changes, c_mod_index, checksum = table.get_changes(mod_index)
+        self.assertEqual(len(changes), 4)
+        self.assertEqual(c_mod_index, table.get_mod_index())
+        self.assertEqual(table2.apply_log(changes, c_mod_index, checksum), 8)
+        self.assertEqual(table2.get_checksum(), table.get_checksum())
+        self.assertEqual(table2.get_mod_index(), table.get_mod_index())
+
+        #table is not changed if changes can not be applied
+        with self.assertRaises(RangeException):
+            table2.apply_log(changes, c_mod_index + len(changes), checksum)
+        with self.assertRaises(RangeException):
+            table2.apply_log([('+', 0, 10, 'node_x')], c_mod_index + 1, checksum)
+        self.assertEqual(table2.get_checksum(), table.get_checksum())
+
+        #truncated history
+        table3 = HashRangesTable(changes_log_size=2)
+        for i in xrange(4):
+            table3.append(i*10, i*10+9, 'node%s'%i)
+        self.assertEqual(table3.get_changes(1), None)
+        self.assertEqual(len(table3.get_changes(2)[0]), 2)
+        self.assertEqual(table3.get_changes(5), None)
+        table3.load(table.dump())
+        self.assertEqual(table3.get_changes(0), None)
+
+    def test06_checksum(self):
+        table = make_table(8)
+        table2 = HashRangesTable()
+        for range_obj in reversed(table.copy()):
+            table2.append(range_obj.start, range_obj.end, range_obj.node_address)
+        self.assertEqual(table.get_checksum(), table2.get_checksum())
+
+        #same mod_index and ranges count, but different tables
+        table.remove(MIN_KEY)
+        table2.remove(MAX_KEY)
+        self.assertEqual(table.get_mod_index(), table2.get_mod_index())
+        self.assertNotEqual(table.get_checksum(), table2.get_checksum())
+
+        first = table2.get_first()
+        table2.remove(first.start)
+        table2.append(first.start, first.end, first.node_address)
+        full_checksum = RangesSnapshot(table2.copy(), None, 0).checksum
+        self.assertEqual(table2.get_checksum(), '%040x'%full_checksum)
+
+    def test07_wait(self):
+        table = make_table(4)
+        mod_index = table.get_mod_index()
+        self.assertFalse(table.wait(lambda snapshot: snapshot.mod_index > mod_index, 0.1))
+
+        timer = threading.Timer(0.1, table.remove, (MIN_KEY,))
+        timer.start()
+        t0 = time.time()
+        self.assertTrue(table.wait(lambda snapshot: snapshot.mod_index > mod_index, 10))
+        self.assertTrue(time.time() - t0 < 5)
+        self.assertEqual(table.count(), 3)
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 
 import os
 import sys
+import time
+import zlib
+import struct
 import hashlib
 import unittest
 import threading
@@ -174,6 +177,328 @@ class TestUserMetadata(unittest.TestCase):
         finally:
             um.close()
 
+    def test02_atomic_update(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            user_info = um.get_user_info()
+            um.make_path('/atomic')
+            um.update_path('/atomic/file1', [MDDataBlockInfo(hashlib.sha1('f1').hexdigest(), 1, 0, 10)])
+            um.update([('/atomic/file2', [MDDataBlockInfo(hashlib.sha1('f2').hexdigest(), 1, 0, 20)]), \
+                       ('/atomic/file2', [MDDataBlockInfo(hashlib.sha1('f3').hexdigest(), 1, 20, 30)])], \
+                       ['/atomic/file1'])
+            self.assertEqual(um.listdir('/atomic'), ['file2'])
+            self.assertEqual(len(um.get_data_blocks('/atomic/file2')), 2)
+            self.assertEqual(um.get_user_info().used_size, user_info.used_size + 50*2)
+
+            #nothing is changed if one of changes fails
+            with self.assertRaises(MDNotFound):
+                um.update([('/atomic/file3', [MDDataBlockInfo(hashlib.sha1('f4').hexdigest(), 1, 0, 10)])], \
+                        ['/atomic/file2', '/atomic/file1'])
+            self.assertEqual(um.listdir('/atomic'), ['file2'])
+            self.assertEqual(um.get_user_info().used_size, user_info.used_size + 50*2)
+
+            um.update([], ['/atomic/file2', '/atomic'])
+            with self.assertRaises(MDNotFound):
+                um.listdir('/atomic')
+            self.assertEqual(um.get_user_info().used_size, user_info.used_size)
+        finally:
+            um.close()
+
+    def test04_cache(self):
+        md_cache = MetadataCache(max_size=2, idle_timeout=0.2)
+        paths = ['%s_%s'%(TEST_MD_PATH, i) for i in xrange(3)]
+        for path in paths:
+            os.system('rm -rf %s'%path)
+        try:
+            for path in paths:
+                md_cache.call(path, 'make_path', '/test')
+            self.assertEqual(md_cache.size(), 2)
+
+            #evicted metadata is reopened
+            self.assertEqual(md_cache.call(paths[0], 'listdir', '/'), ['test'])
+            self.assertEqual(md_cache.size(), 2)
+
+            md_cache.flush_idle()
+            self.assertEqual(md_cache.size(), 2)
+            time.sleep(0.3)
+            md_cache.flush_idle()
+            self.assertEqual(md_cache.size(), 0)
+        finally:
+            md_cache.destroy()
+            for path in paths:
+                os.system('rm -rf %s'%path)
+
+    def test05_group_sync(self):
+        md_cache = MetadataCache(group_sync_interval=0.01)
+        md_path = TEST_MD_PATH + '_gs'
+        os.system('rm -rf %s'%md_path)
+        try:
+            md_cache.call(md_path, 'update_user_info', UserInfo(hashlib.sha1('fabregas').hexdigest(), 1000000, 0))
+            md_cache.call(md_path, 'make_path', '/test')
+            #all writes are synced before call() returns
+            self.assertFalse(md_cache.call(md_path, 'sync'))
+
+            errors = []
+            def update(i):
+                try:
+                    md_cache.call(md_path, 'update_path', '/test/file_%s'%i, \
+                            [MDDataBlockInfo(hashlib.sha1(str(i)).hexdigest(), 1, 0, 10)])
+                except Exception, err:
+                    errors.append(err)
+            thrds = [threading.Thread(target=update, args=(i,)) for i in xrange(10)]
+            for thrd in thrds:
+                thrd.start()
+            for thrd in thrds:
+                thrd.join()
+
+            self.assertEqual(errors, [])
+            self.assertFalse(md_cache.call(md_path, 'sync'))
+            self.assertEqual(len(md_cache.call(md_path, 'listdir', '/test')), 10)
+            self.assertEqual(md_cache.call(md_path, 'get_user_info').used_size, 10*10*2)
+        finally:
+            md_cache.destroy()
+            os.system('rm -rf %s'%md_path)
+
+    def test06_path_cache(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            um.make_path('/deep/a/b/c/d')
+            um.update_path('/deep/a/b/c/d/file', [])
+            self.assertEqual(um.listdir('/deep/a/b/c/d'), ['file'])
+
+            um.update([], ['/deep/a/b/c/d/file', '/deep/a/b/c/d'])
+            with self.assertRaises(MDNotFound):
+                um.listdir('/deep/a/b/c/d')
+            with self.assertRaises(MDNotFound):
+                um.update_path('/deep/a/b/c/d/file', [])
+
+            um.make_path('/deep/a/b/c/d/e')
+            self.assertEqual(um.listdir('/deep/a/b/c/d'), ['e'])
+            self.assertEqual(um.listdir('/deep/a/b/c'), ['d'])
+        finally:
+            um.close()
+
+    def test07_file_parts(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            used_size = um.get_user_info().used_size
+            for seek in (300, 0, 100, 200):
+                um.update_path('/parted.file', [MDDataBlockInfo(hashlib.sha1(str(seek)).hexdigest(), 1, seek, 100)])
+            #part size is updated
+            um.update_path('/parted.file', [MDDataBlockInfo(hashlib.sha1('300').hexdigest(), 1, 300, 50)])
+            #part is identified by db_key, seek of existing part is not changed
+            um.update_path('/parted.file', [MDDataBlockInfo(hashlib.sha1('100').hexdigest(), 1, 500, 100)])
+
+            dbs = um.get_data_blocks('/parted.file')
+            self.assertEqual([(db.seek, db.size) for db in dbs], [(0, 100), (100, 100), (200, 100), (300, 50)])
+            self.assertEqual(um.get_path_info('/parted.file').size, 350)
+            self.assertEqual(um.get_user_info().used_size, used_size + 350*2)
+
+            um.remove_path('/parted.file')
+            self.assertEqual(um.get_user_info().used_size, used_size)
+            um.update_path('/parted.file', [])
+            self.assertEqual(um.get_data_blocks('/parted.file'), [])
+            um.remove_path('/parted.file')
+        finally:
+            um.close()
+
+    def test08_dir_stat(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            um.make_path('/stat/a/b')
+            um.make_path('/stat/c')
+            um.update_path('/stat/a/b/f1', [MDDataBlockInfo(hashlib.sha1('f1').hexdigest(), 1, 0, 10)])
+            um.update_path('/stat/a/f2', [MDDataBlockInfo(hashlib.sha1('f2').hexdigest(), 1, 0, 20)])
+            um.update_path('/stat/a/f2', [MDDataBlockInfo(hashlib.sha1('f3').hexdigest(), 1, 20, 5)])
+
+            p_info = um.get_path_info('/stat')
+            self.assertEqual((p_info.size, p_info.files_count, p_info.dirs_count), (35, 2, 3))
+            self.assertEqual(sorted([(c.name, c.size, c.files_count) for c in p_info.children]), \
+                                [('a', 0, 0), ('c', 0, 0)])
+            self.assertEqual((um.get_path_info('/stat/a').size, um.get_path_info('/stat/a').files_count), (35, 2))
+            p_dict = p_info.to_dict()
+            self.assertEqual((p_dict['size'], p_dict['files_count'], p_dict['dirs_count']), (35, 2, 3))
+
+            um.update([], ['/stat/a/b/f1', '/stat/a/b', '/stat/c'])
+            p_info = um.get_path_info('/stat')
+            self.assertEqual((p_info.size, p_info.files_count, p_info.dirs_count), (25, 1, 1))
+            p_info = um.get_path_info('/')
+            self.assertTrue(p_info.size >= 25)
+
+            um.update([], ['/stat/a/f2', '/stat/a', '/stat'])
+        finally:
+            um.close()
+
+    def test09_paginated_listing(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            um.make_path('/pages')
+            for i in xrange(25):
+                um.update_path('/pages/file_%s'%i, [])
+
+            names = []
+            cursor = None
+            pages = 0
+            while True:
+                p_info = um.get_path_info('/pages', limit=10, cursor=cursor)
+                self.assertTrue(len(p_info.children) <= 10)
+                names += [child.name for child in p_info.children]
+                pages += 1
+                cursor = p_info.cursor
+                if not cursor:
+                    break
+            self.assertEqual(pages, 3)
+            self.assertEqual(len(names), 25)
+            self.assertEqual(names, um.listdir('/pages'))
+            self.assertEqual(p_info.files_count, 25)
+
+            self.assertEqual(um.get_path_info('/pages', limit=25).cursor, None)
+            with self.assertRaises(MDException):
+                um.get_path_info('/pages', limit=10, cursor='00'*20)
+
+            um.update([], ['/pages/file_%s'%i for i in xrange(25)] + ['/pages'])
+        finally:
+            um.close()
+
+    def test10_schema_migration(self):
+        path = TEST_MD_PATH + '_v1'
+        os.system('rm -rf %s'%path)
+        def v1_key(parent, item_path, level):
+            return struct.pack('QLHH', parent, zlib.crc32(item_path) & 0xffffffff, level, 0)
+
+        db = leveldb.DB(path, create_if_missing=True)
+        batch = leveldb.WriteBatch()
+        batch.put(MDKeyV1.UI_KEY, UserInfo('00'*20, 100000, 900).pack())
+        dir_key = v1_key(0, '/dir', 1)
+        batch.put(dir_key, MDItemValue(MDItemValue.IT_DIR, 'dir').pack())
+        dir_parent = MDKeyV1.make_parent(dir_key)
+        content = MDFileContent([MDDataBlockInfo('aa'*20, 2, 0, 100)])
+        batch.put(v1_key(dir_parent, '/dir/file', 2), \
+                MDItemValue(MDItemValue.IT_FILE, 'file', content.pack()).pack())
+        content = MDFileContent([MDDataBlockInfo('bb'*20, 2, 0, 100), MDDataBlockInfo('cc'*20, 2, 100, 100)])
+        batch.put(v1_key(0, '/root_file', 1), \
+                MDItemValue(MDItemValue.IT_FILE, 'root_file', content.pack()).pack())
+        db.write(batch)
+        db.close()
+
+        for _ in xrange(2):
+            um = UserMetadata(path)
+            try:
+                self.assertEqual(sorted(um.listdir('/')), ['dir', 'root_file'])
+                self.assertEqual(um.listdir('/dir'), ['file'])
+                self.assertEqual([db.db_key for db in um.get_data_blocks('/dir/file')], ['aa'*20])
+                self.assertEqual([(db.db_key, db.seek) for db in um.get_data_blocks('/root_file')], \
+                                [('bb'*20, 0), ('cc'*20, 100)])
+                self.assertEqual(um.get_user_info().used_size, 900)
+                self.assertEqual(um.get_path_info('/root_file').size, 200)
+                p_info = um.get_path_info('/')
+                self.assertEqual((p_info.size, p_info.files_count, p_info.dirs_count), (300, 2, 1))
+                self.assertEqual(len(list(um._iter_keys())), 3)
+            finally:
+                um.close()
+
+        um = UserMetadata(path)
+        try:
+            um.update_path('/root_file', [MDDataBlockInfo('cc'*20, 2, 100, 50)])
+            self.assertEqual(um.get_path_info('/root_file').size, 150)
+            self.assertEqual(um.get_user_info().used_size, 750)
+            um.remove_path('/dir/file')
+            self.assertEqual(um.get_user_info().used_size, 450)
+        finally:
+            um.close()
+
+    def test11_user_info_cache(self):
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            user_info = um.get_user_info()
+            user_info.used_size += 100500
+            self.assertNotEqual(um.get_user_info().used_size, user_info.used_size)
+
+            um.add_user_storage_size(1000)
+            um.update_path('/ui_file', [MDDataBlockInfo(hashlib.sha1('ui').hexdigest(), 1, 0, 10)])
+            user_info = um.get_user_info()
+        finally:
+            um.close()
+
+        um = UserMetadata(TEST_MD_PATH)
+        try:
+            self.assertEqual(str(um.get_user_info()), str(user_info))
+            um.remove_path('/ui_file')
+            self.assertEqual(um.get_user_info().used_size, user_info.used_size - 20)
+        finally:
+            um.close()
+
+    def test12_dump_import(self):
+        src_path = TEST_MD_PATH + '_dump_src'
+        dst_path = TEST_MD_PATH + '_dump_dst'
+        dump_file = TEST_MD_PATH + '.mdd'
+        fifo_path = TEST_MD_PATH + '.fifo'
+        os.system('rm -rf %s %s %s %s'%(src_path, dst_path, dump_file, fifo_path))
+        md_cache = MetadataCache()
+        try:
+            md_cache.call(src_path, 'update_user_info', UserInfo('00'*20, 10000000, 0))
+            md_cache.call(src_path, 'make_path', '/dump')
+            for i in xrange(2000):
+                md_cache.call(src_path, 'update_path', '/dump/file_%s'%i, \
+                        [MDDataBlockInfo(hashlib.sha1(str(i)).hexdigest(), 1, 0, 10)])
+            md_cache.call(dst_path, 'make_path', '/old')
+
+            #dump is written to fifo, so export is not finished until it is read
+            os.mkfifo(fifo_path)
+            ret = {}
+            exporter = threading.Thread(target=lambda: ret.update(cnt=md_cache.export_md(src_path, fifo_path)))
+            exporter.start()
+            fifo = open(fifo_path, 'rb')
+            dump_data = [fifo.read(1024)]
+
+            errors = []
+            def write(n):
+                try:
+                    for i in xrange(n, 2000, 4):
+                        md_cache.call(src_path, 'remove_path', '/dump/file_%s'%i)
+                        md_cache.call(src_path, 'update_path', '/dump/new_%s'%i, \
+                                [MDDataBlockInfo(hashlib.sha1('new%s'%i).hexdigest(), 1, 0, 5)])
+                except Exception, err:
+                    errors.append(err)
+            writers = [threading.Thread(target=write, args=(i,)) for i in xrange(4)]
+            for thrd in writers:
+                thrd.start()
+            for thrd in writers:
+                thrd.join()
+            self.assertEqual(errors, [])
+            self.assertTrue(exporter.is_alive())
+
+            #metadata is not closed while dump is written
+            closer = threading.Thread(target=md_cache.close_md, args=(src_path,))
+            closer.start()
+            time.sleep(.2)
+            self.assertTrue(closer.is_alive())
+
+            dump_data.append(fifo.read())
+            fifo.close()
+            exporter.join()
+            closer.join()
+            open(dump_file, 'wb').write(''.join(dump_data))
+            self.assertEqual(md_cache.import_md(dst_path, dump_file), ret['cnt'])
+
+            #dump is made from snapshot taken before writes
+            self.assertEqual(sorted(md_cache.call(dst_path, 'listdir', '/dump')), \
+                    sorted(['file_%s'%i for i in xrange(2000)]))
+            self.assertEqual(md_cache.call(dst_path, 'listdir', '/'), ['dump'])
+            self.assertEqual(md_cache.call(dst_path, 'get_user_info').used_size, 2000*10*2)
+            self.assertEqual(md_cache.call(dst_path, 'get_path_info', '/dump').size, 2000*10)
+            self.assertEqual(md_cache.call(src_path, 'get_user_info').used_size, 2000*5*2)
+
+            data = open(dump_file).read()
+            for bad_dump in [data[:-1], data[:100] + chr(ord(data[100])^1) + data[101:], 'XXXX' + data[4:]]:
+                open(dump_file, 'w').write(bad_dump)
+                with self.assertRaises(MDException):
+                    md_cache.import_md(dst_path, dump_file)
+            self.assertEqual(len(md_cache.call(dst_path, 'listdir', '/dump')), 2000)
+        finally:
+            md_cache.destroy()
+            os.system('rm -rf %s %s'%(dump_file, fifo_path))
+
 if __name__ == '__main__':
     unittest.main()
 
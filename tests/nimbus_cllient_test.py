@@ -2,7 +2,8 @@ import unittest
 
 from test_utils import *
 
-from nimbus.client import Nimbus, NimbusError
+from nimbus.client import Nimbus, NimbusError, LatencyHistogram
+from nimbus.async_client import AsyncNimbus, wait_all
 from fabnet.core.key_storage import init_keystore
 
 
@@ -50,7 +51,76 @@ class TestNimbus(unittest.TestCase):
         nimbus.delete_data_block(key)
         with self.assertRaises(NimbusError):
             nimbus.get_data_block(key)
-    
+
+    def test02_ranges_cache(self):
+        client_ks = init_keystore(USER1_KS, USER_PWD)
+        nimbus = Nimbus(client_ks, '127.0.0.1:1771')
+        self.assertTrue(nimbus.refresh_ranges_table())
+
+        data_block = 'test data'*1000
+        key = nimbus.put_data_block(data_block)
+
+        no_cache = Nimbus(client_ks, '127.0.0.1:1773', cache_ranges=False)
+        binary = no_cache.get_data_block(key)
+        self.assertEqual(data_block, binary.data())
+
+        binary = nimbus.get_data_block(key)
+        self.assertEqual(data_block, binary.data())
+        nimbus.delete_data_block(key)
+
+    def test03_hedged_reads(self):
+        client_ks = init_keystore(USER1_KS, USER_PWD)
+        nimbus = Nimbus(client_ks, '127.0.0.1:1770', hedged_reads=True)
+
+        data_block = 'test data'*1000
+        key = nimbus.put_data_block(data_block)
+        for _ in xrange(5):
+            binary = nimbus.get_data_block(key)
+            self.assertEqual(data_block, binary.data())
+
+        nimbus.delete_data_block(key)
+        with self.assertRaises(NimbusError):
+            nimbus.get_data_block(key)
+
+    def test04_batch_api(self):
+        client_ks = init_keystore(USER1_KS, USER_PWD)
+        nimbus = Nimbus(client_ks, '127.0.0.1:1772', max_calls_per_node=2)
+
+        data_blocks = ['test data #%s'%i*1000 for i in xrange(20)]
+        keys = nimbus.put_many(data_blocks)
+        self.assertEqual(len(keys), len(data_blocks))
+        self.assertEqual(len(set(keys)), len(data_blocks))
+
+        binaries = nimbus.get_many(keys)
+        self.assertEqual(data_blocks, [binary.data() for binary in binaries])
+
+        for key in keys:
+            nimbus.delete_data_block(key)
+
+    def test05_async_client(self):
+        client_ks = init_keystore(USER1_KS, USER_PWD)
+        nimbus = AsyncNimbus(client_ks, '127.0.0.1:1771', max_calls_per_node=2)
+        try:
+            data_blocks = ['async data #%s'%i*1000 for i in xrange(50)]
+            keys = wait_all(nimbus.put_many(data_blocks), 60)
+            self.assertEqual(len(set(keys)), len(data_blocks))
+
+            binaries = wait_all(nimbus.get_many(keys), 60)
+            self.assertEqual(data_blocks, [binary.data() for binary in binaries])
+
+            wait_all([nimbus.delete_data_block(key) for key in keys], 60)
+            with self.assertRaises(NimbusError):
+                nimbus.get_data_block(keys[0]).result(60)
+        finally:
+            nimbus.close()
+
+    def test06_latency_histogram(self):
+        hist = LatencyHistogram()
+        self.assertEqual(hist.percentile(95, 0.5), 0.5)
+        for size in [1000, 100000, 1000000]*10:
+            hist.add(0.01 + size * 0.000001, size)
+        self.assertAlmostEqual(hist.percentile(95), 0.01)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import sys
+
+sys.path.append('fabnet_core')
+
+from fabnet_dht.ranges_gossip import RangesGossip, NodeWeights
+from fabnet_dht.hash_ranges_table import HashRangesTable
+from fabnet_dht.key_utils import KeyUtils, ZONE_PROBES_COUNT
+from fabnet_dht.constants import MAX_KEY
+
+
+class TestRangesGossip(unittest.TestCase):
+    def test00_exchange(self):
+        node_a = RangesGossip('node_a')
+        node_b = RangesGossip('node_b', log_size=3)
+
+        rumor = node_a.new_rumor([], [(0, 10, 'node_a')])
+        self.assertEqual(rumor[:2], ('node_a', 1))
+        node_a.new_rumor([(0, 10, 'node_a')], [(0, 20, 'node_a')])
+
+        missing = node_a.get_missing(node_b.get_version_vector())
+        self.assertEqual(len(missing), 2)
+        self.assertEqual([node_b.accept(r) for r in missing], [True, True])
+        self.assertEqual(node_b.accept(missing[0]), False)
+        self.assertEqual(node_b.get_version_vector(), {'node_a': 2})
+        self.assertEqual(node_a.get_missing(node_b.get_version_vector()), [])
+
+        #gap in sequence
+        self.assertEqual(node_b.accept(('node_c', 2, [], [])), False)
+
+        for i in xrange(3):
+            node_b.new_rumor([], [])
+        self.assertEqual(len(node_b.get_missing({'node_a': 2, 'node_b': 1})), 2)
+        #log is truncated
+        self.assertEqual(node_b.get_missing({}), None)
+
+    def test01_reset(self):
+        node_a = RangesGossip('node_a')
+        node_a.new_rumor([], [(0, 10, 'node_a')])
+        node_a.new_rumor([], [(11, 20, 'node_a')])
+        self.assertEqual(node_a.reset({'node_a': 1, 'node_b': 5}), [('node_a', 2, [], [(11, 20, 'node_a')])])
+        self.assertEqual(node_a.get_version_vector(), {'node_a': 2, 'node_b': 5})
+
+        #received rumors are counted after they are applied
+        node_b = RangesGossip('node_b')
+        rumor = ('node_a', 2, [], [])
+        node_b.accept(('node_a', 1, [], []))
+        self.assertTrue(node_b.is_next(rumor))
+        node_b.accept(rumor)
+        self.assertEqual(node_b.reset({'node_a': 1}), [rumor])
+        self.assertEqual(node_b.get_version_vector(), {'node_a': 1, 'node_b': 0})
+        self.assertTrue(node_b.is_next(rumor))
+        self.assertTrue(node_b.accept(rumor))
+        self.assertFalse(node_b.is_next(rumor))
+
+        #restarted node continues own changes sequence
+        node_c = RangesGossip('node_c')
+        node_c.get_missing({'node_c': 7})
+        self.assertEqual(node_c.get_version_vector(), {})
+        node_c.merge_own_seq({'node_c': 7})
+        self.assertEqual(node_c.new_rumor([], [])[1], 8)
+
+    def test02_node_weights(self):
+        weights_a = NodeWeights()
+        weights_b = NodeWeights()
+        weights_a.update('node_a', 4.)
+        weights_b.update('node_b', 12.)
+        old_weights = weights_a.dump()
+        weights_a.update('node_a', 3.)
+
+        weights_b.merge(weights_a.dump())
+        weights_b.merge(old_weights)
+        self.assertEqual(weights_b.get('node_a'), 3.)
+        self.assertEqual(weights_b.get('node_b'), 12.)
+        self.assertEqual(weights_b.get('node_c'), None)
+
+        weights_a.merge(weights_b.dump())
+        self.assertEqual(weights_a.dump(), weights_b.dump())
+
+    def test03_zone_aware_keys(self):
+        table = HashRangesTable()
+        weights = NodeWeights()
+        step = (MAX_KEY + 1) / 16
+        for i in xrange(16):
+            table.append(i*step, (i+1)*step - 1, 'node%02i'%i)
+        key = '%040x'%(step / 2)
+
+        #zones are unknown
+        self.assertEqual(KeyUtils.get_zone_aware_keys(key, 2, table, weights), KeyUtils.get_all_keys(key, 2))
+
+        #node00-node07 in zone A, node08-node15 in zone B, node15 in zone C
+        for i in xrange(16):
+            weights.update('node%02i'%i, 1., 'A' if i < 8 else ('B' if i < 15 else 'C'))
+        keys = KeyUtils.get_zone_aware_keys(key, 2, table, weights)
+        self.assertEqual(keys[0], key)
+        zones = [weights.get_zone(range_obj.node_address) for range_obj in \
+                    table.find_many([long(k, 16) for k in keys])]
+        self.assertEqual(sorted(zones), ['A', 'B', 'C'])
+        for repl_key in keys[1:]:
+            self.assertTrue(KeyUtils.is_replica_key(repl_key, key, 2))
+        self.assertFalse(KeyUtils.is_replica_key(key, key, 2))
+        self.assertEqual(keys, KeyUtils.get_zone_aware_keys(key, 2, table, weights))
+
+    def test04_replica_keys_after_table_change(self):
+        table = HashRangesTable()
+        weights = NodeWeights()
+        step = (MAX_KEY + 1) / 16
+        for i in xrange(16):
+            table.append(i*step, (i+1)*step - 1, 'node%02i'%i)
+            weights.update('node%02i'%i, 1., 'A' if i < 8 else ('B' if i < 15 else 'C'))
+        key = '%040x'%(step / 2)
+        put_keys = KeyUtils.get_zone_aware_keys(key, 2, table, weights)
+
+        #node15 range is moved to node07 and zone C is gone
+        table.remove(15*step)
+        table.append(15*step, MAX_KEY, 'node07')
+        get_keys = KeyUtils.get_zone_aware_keys(key, 2, table, weights)
+        self.assertNotEqual(get_keys, put_keys)
+
+        #replicas saved with old table are found by fallback keys of the same replica
+        fallback_keys = KeyUtils.get_fallback_keys(key, 2, get_keys)
+        self.assertEqual(len(fallback_keys), 2)
+        self.assertEqual(get_keys[0], put_keys[0])
+        for put_key, get_key, f_keys in zip(put_keys[1:], get_keys[1:], fallback_keys):
+            self.assertTrue(put_key == get_key or put_key in f_keys)
+            self.assertFalse(get_key in f_keys)
+            self.assertEqual(len(f_keys), ZONE_PROBES_COUNT - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()